@@ -20,6 +20,14 @@ class Settings:
     DB_NAME: str = os.getenv("DB_NAME", "Sifen_API")
     DATABASE_URL: str = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
     
+    # Pool de conexiones (un pool por proceso worker)
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_TIMEOUT: int = int(os.getenv("DB_POOL_TIMEOUT", "30"))  # segundos esperando conexión libre
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # segundos; -1 deshabilita
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "True").lower() == "true"
+    DB_STATEMENT_TIMEOUT_MS: int = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))  # 0 = sin límite
+    
     # SIFEN Endpoints
     EVENTO_ENDPOINT: str = os.getenv("EVENTO_ENDPOINT", "https://sifen.set.gov.py/de/ws/async/envi-de.wsdl")
     LOTE_ENDPOINT: str = os.getenv("LOTE_ENDPOINT", "https://sifen.set.gov.py/de/ws/async/recibe-lote.wsdl")
@@ -31,6 +39,42 @@ class Settings:
     CERT_PATH: str = os.getenv("CERT_PATH", r"C:\Users\mauri\credenciales\certificado.pem")
     KEY_PATH: str = os.getenv("KEY_PATH", r"C:\Users\mauri\clave_privada_desenc.pem")
     
+    # Transporte SOAP: conexiones keep-alive por certificado y host
+    SOAP_POOL_CONNECTIONS: int = int(os.getenv("SOAP_POOL_CONNECTIONS", "4"))
+    SOAP_POOL_MAXSIZE: int = int(os.getenv("SOAP_POOL_MAXSIZE", "10"))
+    # Grabación/reproducción de intercambios SOAP: red | grabar | reproducir
+    SOAP_TRANSPORTE: str = os.getenv("SOAP_TRANSPORTE", "red").lower()
+    SOAP_CASSETTE: str = os.getenv("SOAP_CASSETTE", "tests/output/cassette")
+    SOAP_REPLAY_ESCALA: float = float(os.getenv("SOAP_REPLAY_ESCALA", "1.0"))  # 0 = sin latencia
+    # Reintentos, timeouts y circuit breaker por endpoint (ver core/infraestructure/soap/resiliencia.py)
+    SOAP_REINTENTOS: int = int(os.getenv("SOAP_REINTENTOS", os.getenv("MAX_RETRIES", "3")))
+    SOAP_BACKOFF_BASE: float = float(os.getenv("SOAP_BACKOFF_BASE", "0.5"))  # segundos
+    SOAP_BACKOFF_MAX: float = float(os.getenv("SOAP_BACKOFF_MAX", "8"))
+    SOAP_TIMEOUT_CONEXION: float = float(os.getenv("SOAP_TIMEOUT_CONEXION", "10"))
+    SOAP_TIMEOUT_MIN: float = float(os.getenv("SOAP_TIMEOUT_MIN", "5"))
+    SOAP_TIMEOUT_PERCENTIL: float = float(os.getenv("SOAP_TIMEOUT_PERCENTIL", "0.99"))
+    SOAP_TIMEOUT_FACTOR: float = float(os.getenv("SOAP_TIMEOUT_FACTOR", "3"))
+    SOAP_CIRCUITO_FALLOS: int = int(os.getenv("SOAP_CIRCUITO_FALLOS", "5"))  # fallas seguidas para abrir
+    SOAP_CIRCUITO_ESPERA: int = int(os.getenv("SOAP_CIRCUITO_ESPERA", "30"))  # segundos abierto
+    # Límite de tasa compartido por todos los procesos (tabla de_rate_limit, ver limitador.py)
+    RATE_LIMIT_ACTIVO: bool = os.getenv("RATE_LIMIT_ACTIVO", "False").lower() == "true"
+    RATE_LIMIT_OPERACIONES: str = os.getenv(
+        "RATE_LIMIT_OPERACIONES",
+        "rEnvioLote=10,rEnviConsLoteDe=20,rEnviDe=20,rEnviEventoDe=10,rEnviConsDeRequest=20"
+    )  # solicitudes/s por operación
+    RATE_LIMIT_EMISOR: float = float(os.getenv("RATE_LIMIT_EMISOR", "5"))  # solicitudes/s por RUC; 0 = sin límite
+    RATE_LIMIT_EMISORES: str = os.getenv("RATE_LIMIT_EMISORES", "")  # excepciones, ej. "80069563=20"
+    RATE_LIMIT_RAFAGA: float = float(os.getenv("RATE_LIMIT_RAFAGA", "1"))  # segundos de tasa acumulables
+    # Captura de sobres SOAP (ver core/infraestructure/soap/captura.py)
+    SOAP_CAPTURA_MUESTREO: float = float(os.getenv("SOAP_CAPTURA_MUESTREO", "0.0"))  # 0..1; errores siempre
+    SOAP_CAPTURA_BUFFER: int = int(os.getenv("SOAP_CAPTURA_BUFFER", "20"))  # últimos N por endpoint
+    SOAP_CAPTURA_MAX_BYTES: int = int(os.getenv("SOAP_CAPTURA_MAX_BYTES", "65536"))  # por cuerpo
+    SOAP_CAPTURA_ERRORES: bool = os.getenv("SOAP_CAPTURA_ERRORES", "True").lower() == "true"
+    SOAP_CAPTURA_ERRORES_INTERVALO: float = float(os.getenv("SOAP_CAPTURA_ERRORES_INTERVALO", "60"))  # por endpoint
+    SOAP_CAPTURA_DIR: str = os.getenv("SOAP_CAPTURA_DIR", "tests/output/capturas")
+    # CA para verificar al servidor (vacío = bundle de requests); ej. el de tests/mock_sifen.py
+    SOAP_CA_BUNDLE: str = os.getenv("SOAP_CA_BUNDLE", "")
+    
     # QR Settings
     URL_QR: str = os.getenv("URL_QR", "https://ekuatia.set.gov.py/consultas/qr?")
     CSC: str = os.getenv("CSC", "0001")  # Test: 0001, Producción: 0003
@@ -40,6 +84,54 @@ class Settings:
     PROCESSING_INTERVAL: int = int(os.getenv("PROCESSING_INTERVAL", "60"))  # segundos
     MAX_RETRIES: int = int(os.getenv("MAX_RETRIES", "3"))
     
+    # Concurrencia de workers de facturas (claim con SKIP LOCKED + lease)
+    FACTURA_WORKERS: int = int(os.getenv("FACTURA_WORKERS", "1"))
+    CLAIM_LIMIT: int = int(os.getenv("CLAIM_LIMIT", "500"))  # documentos reclamados por ciclo
+    LEASE_SECONDS: int = int(os.getenv("LEASE_SECONDS", "600"))
+    
+    # Unidad de trabajo por lote: armado y LOTE_ARMADO en una sola transacción
+    LOTE_UNIDAD_TRABAJO: bool = os.getenv("LOTE_UNIDAD_TRABAJO", "True").lower() == "true"
+    # Spool de contingencia: lotes firmados que esperan a SIFEN (LOTE_CONTINGENCIA)
+    CONTINGENCIA_CONCURRENCIA: int = int(os.getenv("CONTINGENCIA_CONCURRENCIA", "16"))  # envíos en vuelo y lotes por tanda
+    CONTINGENCIA_MAX_POR_EMISOR: int = int(os.getenv("CONTINGENCIA_MAX_POR_EMISOR", "4"))
+    LOTE_ARMADO_TIMEOUT: int = int(os.getenv("LOTE_ARMADO_TIMEOUT", "300"))  # segundos sin enviar antes de reintentar
+    
+    # Validación previa contra los XSD de SIFEN (siRecepDE_v150.xsd, siRecepEvento_v150.xsd)
+    XSD_VALIDAR: bool = os.getenv("XSD_VALIDAR", "False").lower() == "true"
+    XSD_DIR: str = os.getenv("XSD_DIR", "xsd")
+    
+    # Procesos para armar y firmar DEs en paralelo (1 = en serie dentro del worker)
+    SIGN_POOL_WORKERS: int = int(os.getenv("SIGN_POOL_WORKERS", "1"))
+    
+    # Despacho concurrente de lotes: máximo en vuelo en total y por emisor
+    DESPACHO_MAX_LOTES: int = int(os.getenv("DESPACHO_MAX_LOTES", "4"))
+    DESPACHO_MAX_POR_EMISOR: int = int(os.getenv("DESPACHO_MAX_POR_EMISOR", "2"))
+    
+    # Consultas de estado de lotes en paralelo
+    ESTADOS_CONCURRENCIA: int = int(os.getenv("ESTADOS_CONCURRENCIA", "8"))
+    # Planificación: primera consulta, backoff mientras SIFEN procesa (0361) y plazo de escalado
+    ESTADOS_PRIMERA_CONSULTA: int = int(os.getenv("ESTADOS_PRIMERA_CONSULTA", "60"))  # segundos tras el envío
+    ESTADOS_BACKOFF_BASE: int = int(os.getenv("ESTADOS_BACKOFF_BASE", "30"))
+    ESTADOS_BACKOFF_MAX: int = int(os.getenv("ESTADOS_BACKOFF_MAX", "1800"))
+    ESTADOS_PLAZO_MAXIMO: int = int(os.getenv("ESTADOS_PLAZO_MAXIMO", "172800"))  # 48 h
+    
+    # Pipeline de facturas por etapas (reclamo -> firma -> armado -> envío -> persistencia)
+    WORKER_PIPELINE: bool = os.getenv("WORKER_PIPELINE", "False").lower() == "true"
+    PIPELINE_HILOS_FIRMA: int = int(os.getenv("PIPELINE_HILOS_FIRMA", "2"))
+    PIPELINE_COLA: int = int(os.getenv("PIPELINE_COLA", "4"))  # lotes en espera por etapa
+    
+    # Carril express: documentos/emisores express van por rEnviDe síncrono
+    WORKER_EXPRESS: bool = os.getenv("WORKER_EXPRESS", "True").lower() == "true"
+    EXPRESS_LIMITE: int = int(os.getenv("EXPRESS_LIMITE", "20"))  # documentos express por ciclo
+    EXPRESS_INTERVALO: float = float(os.getenv("EXPRESS_INTERVALO", "2"))  # segundos entre reclamos en el pipeline
+    
+    # Despertar workers con LISTEN/NOTIFY (el intervalo queda como timeout de respaldo)
+    WORKER_LISTEN_NOTIFY: bool = os.getenv("WORKER_LISTEN_NOTIFY", "True").lower() == "true"
+    
+    # Cache en proceso de Emisor/Timbrado (segundos)
+    IDENTIDAD_CACHE_TTL: int = int(os.getenv("IDENTIDAD_CACHE_TTL", "300"))
+    IDENTIDAD_CACHE_VERIFICAR: float = float(os.getenv("IDENTIDAD_CACHE_VERIFICAR", "5"))  # lectura de la versión compartida
+    
     # Logging
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
     LOG_FILE: str = os.getenv("LOG_FILE", "logs/demon_siffen.log")
@@ -77,7 +169,11 @@ class Settings:
             "database": {
                 "host": cls.DB_HOST,
                 "name": cls.DB_NAME,
-                "user": cls.DB_USER
+                "user": cls.DB_USER,
+                "pool_size": cls.DB_POOL_SIZE,
+                "max_overflow": cls.DB_MAX_OVERFLOW,
+                "pool_pre_ping": cls.DB_POOL_PRE_PING,
+                "statement_timeout_ms": cls.DB_STATEMENT_TIMEOUT_MS
             },
             "endpoints": {
                 "evento": cls.EVENTO_ENDPOINT,
@@ -87,7 +183,18 @@ class Settings:
             "processing": {
                 "batch_size": cls.BATCH_SIZE,
                 "interval": cls.PROCESSING_INTERVAL,
-                "max_retries": cls.MAX_RETRIES
+                "max_retries": cls.MAX_RETRIES,
+                "factura_workers": cls.FACTURA_WORKERS,
+                "claim_limit": cls.CLAIM_LIMIT,
+                "lease_seconds": cls.LEASE_SECONDS,
+                "listen_notify": cls.WORKER_LISTEN_NOTIFY,
+                "sign_pool_workers": cls.SIGN_POOL_WORKERS,
+                "xsd_validar": cls.XSD_VALIDAR,
+                "rate_limit": cls.RATE_LIMIT_ACTIVO,
+                "despacho_max_lotes": cls.DESPACHO_MAX_LOTES,
+                "despacho_max_por_emisor": cls.DESPACHO_MAX_POR_EMISOR,
+                "pipeline": cls.WORKER_PIPELINE,
+                "express": cls.WORKER_EXPRESS
             },
             "debug": cls.DEBUG,
             "log_level": cls.LOG_LEVEL
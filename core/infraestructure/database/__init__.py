@@ -1,3 +1,3 @@
-from .database import Base, engine, SessionLocal, get_db, get_db_session
+from .database import Base, get_engine, SessionLocal, get_db, get_db_session
 
-__all__ = ['Base', 'engine', 'SessionLocal', 'get_db', 'get_db_session']
\ No newline at end of file
+__all__ = ['Base', 'get_engine', 'SessionLocal', 'get_db', 'get_db_session']
\ No newline at end of file
@@ -1,14 +1,70 @@
+import os
 from contextlib import contextmanager
 from sqlalchemy import create_engine
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
 from config.setting import settings
 
-engine = create_engine(settings.DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
 Base = declarative_base()
 
+# Engine por proceso: los workers del daemon son mp.Process y no deben
+# compartir los sockets del pool heredado del padre.
+_engine = None
+_engine_pid = None
+_SessionFactory = sessionmaker(autocommit=False, autoflush=False)
+
+
+def _crear_engine():
+    """Crea el engine con el pool configurado en Settings"""
+    connect_args = {}
+    if settings.DB_STATEMENT_TIMEOUT_MS > 0:
+        connect_args["options"] = f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"
+
+    return create_engine(
+        settings.DATABASE_URL,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+
+
+def get_engine():
+    """
+    Retorna el engine del proceso actual, creándolo si hace falta.
+    Si el engine fue heredado por fork se descarta sin cerrar las
+    conexiones del padre y se arma un pool nuevo.
+    """
+    global _engine, _engine_pid
+    pid = os.getpid()
+    if _engine is None or _engine_pid != pid:
+        if _engine is not None:
+            _engine.dispose(close=False)
+        _engine = _crear_engine()
+        _engine_pid = pid
+    return _engine
+
+
+def _despues_de_fork():
+    """En el hijo: abandonar el pool heredado (close=False no toca los sockets del padre)"""
+    global _engine, _engine_pid
+    if _engine is not None:
+        _engine.dispose(close=False)
+    _engine = None
+    _engine_pid = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_despues_de_fork)
+
+
+def SessionLocal(**kwargs):
+    """Nueva sesión ligada al engine del proceso actual"""
+    return _SessionFactory(bind=get_engine(), **kwargs)
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -28,4 +84,4 @@ def get_db_session():
         db.rollback()
         raise
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
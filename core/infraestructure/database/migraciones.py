@@ -0,0 +1,114 @@
+"""
+Migraciones idempotentes del esquema usado por DemonSiffen.
+Cada sentencia puede ejecutarse varias veces sin efecto (IF NOT EXISTS),
+por lo que se aplican al iniciar el daemon.
+"""
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from core.infraestructure.database.database import get_engine
+from config.logger import get_logger
+
+logger = get_logger(__name__)
+
+MIGRACIONES = [
+    # Lease de documentos para claim concurrente (SKIP LOCKED)
+    "ALTER TABLE de_documento ADD COLUMN IF NOT EXISTS lease_owner VARCHAR(100)",
+    "ALTER TABLE de_documento ADD COLUMN IF NOT EXISTS lease_expira TIMESTAMP",
+    "CREATE INDEX IF NOT EXISTS ix_de_documento_pendiente_envio "
+    "ON de_documento (id) WHERE estado_actual = 'PENDIENTE_ENVIO'",
+    # Resultado por documento dentro del lote (transiciones masivas)
+    "ALTER TABLE de_lote_documento ADD COLUMN IF NOT EXISTS estado_resultado VARCHAR(30)",
+    "ALTER TABLE de_lote_documento ADD COLUMN IF NOT EXISTS codigo_error VARCHAR(10)",
+    "ALTER TABLE de_lote_documento ADD COLUMN IF NOT EXISTS mensaje_error VARCHAR(500)",
+    "CREATE INDEX IF NOT EXISTS ix_de_documento_cdc_de ON de_documento (cdc_de)",
+    # Planificador de consultas de estado de lotes
+    "ALTER TABLE de_lote ADD COLUMN IF NOT EXISTS next_check_at TIMESTAMP",
+    "ALTER TABLE de_lote ADD COLUMN IF NOT EXISTS intentos_consulta INTEGER DEFAULT 0",
+    "CREATE INDEX IF NOT EXISTS ix_de_lote_consulta_pendiente "
+    "ON de_lote (next_check_at, fecha_envio) WHERE estado = 'RECIBIDO_SIFEN'",
+    # Spool de contingencia: lotes firmados que esperan a que SIFEN vuelva
+    "CREATE INDEX IF NOT EXISTS ix_de_lote_contingencia "
+    "ON de_lote (id) WHERE estado = 'LOTE_CONTINGENCIA'",
+    # Carril express (rEnviDe síncrono) por documento o por emisor
+    "ALTER TABLE de_documento ADD COLUMN IF NOT EXISTS express BOOLEAN DEFAULT FALSE",
+    "ALTER TABLE de_emisor ADD COLUMN IF NOT EXISTS express BOOLEAN DEFAULT FALSE",
+    # Límite de tasa compartido hacia SIFEN (token bucket por operación y por RUC)
+    "CREATE TABLE IF NOT EXISTS de_rate_limit ("
+    "clave VARCHAR(60) PRIMARY KEY, "
+    "tokens DOUBLE PRECISION NOT NULL, "
+    "tasa DOUBLE PRECISION NOT NULL, "
+    "capacidad DOUBLE PRECISION NOT NULL, "
+    "actualizado TIMESTAMP NOT NULL)",
+    # Versión compartida de Emisor/Timbrado: invalida la cache de identidades
+    # de todos los procesos (p. ej. al rotar cert_path/key_path)
+    "CREATE TABLE IF NOT EXISTS de_identidad_version ("
+    "id SMALLINT PRIMARY KEY, "
+    "version BIGINT NOT NULL)",
+    "INSERT INTO de_identidad_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING",
+    """
+    CREATE OR REPLACE FUNCTION sifen_identidad_version() RETURNS trigger AS $$
+    BEGIN
+        UPDATE de_identidad_version SET version = version + 1 WHERE id = 1;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS tr_de_emisor_version ON de_emisor",
+    "CREATE TRIGGER tr_de_emisor_version "
+    "AFTER INSERT OR UPDATE OR DELETE ON de_emisor "
+    "FOR EACH STATEMENT EXECUTE FUNCTION sifen_identidad_version()",
+    "DROP TRIGGER IF EXISTS tr_de_emisor_actividad_version ON de_emisor_actividad",
+    "CREATE TRIGGER tr_de_emisor_actividad_version "
+    "AFTER INSERT OR UPDATE OR DELETE ON de_emisor_actividad "
+    "FOR EACH STATEMENT EXECUTE FUNCTION sifen_identidad_version()",
+    "DROP TRIGGER IF EXISTS tr_de_timbrado_version ON de_timbrado",
+    "CREATE TRIGGER tr_de_timbrado_version "
+    "AFTER INSERT OR UPDATE OR DELETE ON de_timbrado "
+    "FOR EACH STATEMENT EXECUTE FUNCTION sifen_identidad_version()",
+    # LISTEN/NOTIFY: despertar a los workers cuando hay trabajo nuevo.
+    # El payload es constante (nombre de la tabla) para que PostgreSQL
+    # agrupe en una sola notificación los cambios masivos de una transacción.
+    """
+    CREATE OR REPLACE FUNCTION sifen_notificar() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify(TG_ARGV[0], TG_TABLE_NAME);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS tr_de_documento_pendiente ON de_documento",
+    "CREATE TRIGGER tr_de_documento_pendiente "
+    "AFTER INSERT OR UPDATE OF estado_actual ON de_documento "
+    "FOR EACH ROW WHEN (NEW.estado_actual = 'PENDIENTE_ENVIO') "
+    "EXECUTE FUNCTION sifen_notificar('sifen_documento')",
+    "DROP TRIGGER IF EXISTS tr_de_documento_aprobado ON de_documento",
+    "CREATE TRIGGER tr_de_documento_aprobado "
+    "AFTER INSERT OR UPDATE OF estado_actual ON de_documento "
+    "FOR EACH ROW WHEN (NEW.estado_actual = 'Aprobado') "
+    "EXECUTE FUNCTION sifen_notificar('sifen_aprobado')",
+    "DROP TRIGGER IF EXISTS tr_de_eventos_pendiente ON de_eventos",
+    "CREATE TRIGGER tr_de_eventos_pendiente "
+    "AFTER INSERT OR UPDATE OF estado_actual ON de_eventos "
+    "FOR EACH ROW WHEN (NEW.estado_actual = 'PENDIENTE_ENVIO') "
+    "EXECUTE FUNCTION sifen_notificar('sifen_evento')",
+    "DROP TRIGGER IF EXISTS tr_de_lote_estado ON de_lote",
+    "CREATE TRIGGER tr_de_lote_estado "
+    "AFTER INSERT OR UPDATE OF estado ON de_lote "
+    "FOR EACH ROW WHEN (NEW.estado = 'RECIBIDO_SIFEN') "
+    "EXECUTE FUNCTION sifen_notificar('sifen_lote')",
+]
+
+
+def aplicar_migraciones() -> bool:
+    """Aplica todas las migraciones en una sola transacción"""
+    try:
+        with get_engine().begin() as conn:
+            for sentencia in MIGRACIONES:
+                conn.execute(text(sentencia))
+        logger.info(f"✅ Migraciones aplicadas ({len(MIGRACIONES)} sentencias)")
+        return True
+    except SQLAlchemyError as e:
+        logger.error(f"❌ Error aplicando migraciones: {str(e)}")
+        return False
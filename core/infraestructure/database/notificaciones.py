@@ -0,0 +1,109 @@
+"""
+Espera de trabajo por LISTEN/NOTIFY de PostgreSQL.
+
+Los triggers definidos en migraciones.py notifican un canal cuando aparece
+trabajo nuevo; los workers bloquean sobre ese canal y usan su intervalo
+solo como timeout de respaldo (reconexión, notificaciones perdidas, etc.).
+"""
+
+import select
+import time
+from typing import List, Optional
+
+from core.infraestructure.database.database import get_engine
+from config.setting import settings
+from config.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Canales emitidos por los triggers
+CANAL_DOCUMENTO = "sifen_documento"    # de_documento -> PENDIENTE_ENVIO
+CANAL_APROBADO = "sifen_aprobado"      # de_documento -> Aprobado
+CANAL_EVENTO = "sifen_evento"          # de_eventos -> PENDIENTE_ENVIO
+CANAL_LOTE = "sifen_lote"              # de_lote -> RECIBIDO_SIFEN
+
+
+class EscuchaNotificaciones:
+    """
+    Conexión dedicada en autocommit que escucha uno o más canales.
+
+    Si LISTEN/NOTIFY está deshabilitado o la conexión falla, `esperar`
+    se comporta como un time.sleep del timeout, igual que antes.
+    """
+
+    def __init__(self, canales: List[str], habilitado: Optional[bool] = None):
+        self.canales = canales
+        self.habilitado = settings.WORKER_LISTEN_NOTIFY if habilitado is None else habilitado
+        self._conn = None
+
+    def _conectar(self):
+        """Abre la conexión fuera del pool y ejecuta LISTEN"""
+        raw = get_engine().raw_connection()
+        raw.detach()    # no vuelve al pool: vive lo que viva el worker
+        conn = raw.driver_connection
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            for canal in self.canales:
+                cur.execute(f"LISTEN {canal}")
+        self._conn = conn
+        logger.info(f"👂 Escuchando canales: {', '.join(self.canales)}")
+
+    def iniciar(self):
+        """
+        Registra el LISTEN antes del primer ciclo para no perder
+        notificaciones emitidas mientras el worker procesa.
+        """
+        if not self.habilitado or self._conn is not None:
+            return
+        try:
+            self._conectar()
+        except Exception as e:
+            logger.warning(f"⚠️ LISTEN no disponible, se usa el intervalo fijo: {e}")
+            self.cerrar()
+
+    def esperar(self, timeout: float) -> bool:
+        """
+        Bloquea hasta recibir una notificación o hasta `timeout` segundos.
+        Retorna True si despertó por notificación.
+        """
+        if not self.habilitado:
+            time.sleep(timeout)
+            return False
+
+        if self._conn is None:
+            self.iniciar()
+            if self._conn is None:
+                time.sleep(timeout)
+                return False
+
+        try:
+            # Notificaciones que llegaron durante el ciclo anterior
+            self._conn.poll()
+            if not self._conn.notifies:
+                listos, _, _ = select.select([self._conn], [], [], timeout)
+                if not listos:
+                    return False
+                self._conn.poll()
+
+            canales = {n.channel for n in self._conn.notifies}
+            self._conn.notifies.clear()
+            if not canales:
+                return False
+            logger.debug(f"🔔 Notificación recibida: {', '.join(sorted(canales))}")
+            return True
+
+        except Exception as e:
+            # La próxima espera reconecta; mientras tanto se respeta el intervalo
+            logger.warning(f"⚠️ Error esperando notificaciones: {e}")
+            self.cerrar()
+            time.sleep(timeout)
+            return False
+
+    def cerrar(self):
+        """Cierra la conexión de escucha"""
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
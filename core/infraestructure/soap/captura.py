@@ -0,0 +1,233 @@
+"""
+Captura de intercambios SOAP para diagnóstico.
+
+Reemplaza el volcado incondicional a tests/output y los print de cada
+respuesta. En el camino caliente solo se guarda una referencia en
+memoria:
+
+- Se muestrea una fracción SOAP_CAPTURA_MUESTREO de los intercambios
+  (los errores HTTP/red se capturan siempre).
+- Por endpoint se conservan los últimos SOAP_CAPTURA_BUFFER en un buffer
+  circular; cada cuerpo se recorta a SOAP_CAPTURA_MAX_BYTES.
+- A disco se escribe solo ante un error (SOAP_CAPTURA_ERRORES) o a pedido
+  (volcar() o SIGUSR1 al proceso), siempre desde un hilo escritor y con
+  xDE, firmas y certificados redactados.
+- Los errores de un endpoint se escriben a lo sumo uno cada
+  SOAP_CAPTURA_ERRORES_INTERVALO segundos: el archivo lleva lo que el buffer
+  juntó desde el anterior. La cola del escritor es acotada; si se llena la
+  escritura se descarta (la captura sigue en memoria).
+"""
+
+import os
+import queue
+import random
+import re
+import signal
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional
+
+from config.setting import settings
+from config.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Contenido que no debe quedar en disco: DEs completos, firmas y certificados
+_RE_REDACTAR = re.compile(
+    rb"(<(?:[\w.-]+:)?(xDE|SignatureValue|X509Certificate|DigestValue)\b[^>]*>)(.*?)(</(?:[\w.-]+:)?\2>|\Z)",
+    re.DOTALL,
+)
+_RE_OPERACION = re.compile(rb"<(?:[\w.-]+:)?Body[^>]*>\s*<(?:[\w.-]+:)?([\w.-]+)")
+
+
+class Intercambio:
+    __slots__ = ("fecha", "endpoint", "status", "latencia", "solicitud", "respuesta", "error")
+
+    def __init__(self, endpoint, status, latencia, solicitud, respuesta, error=None):
+        self.fecha = time.time()
+        self.endpoint = endpoint
+        self.status = status
+        self.latencia = latencia
+        self.solicitud = solicitud
+        self.respuesta = respuesta
+        self.error = error
+
+    @property
+    def operacion(self) -> str:
+        encontrada = _RE_OPERACION.search(self.solicitud)
+        return encontrada.group(1).decode() if encontrada else "soap"
+
+
+_buffers: Dict[str, Deque[Intercambio]] = {}
+_buffers_pid: Optional[int] = None
+_lock = threading.Lock()
+
+_MAX_COLA = 32
+_SONDEO = 1.0    # cada cuánto el escritor revisa si llegó SIGUSR1
+
+_cola: "queue.Queue" = queue.Queue(maxsize=_MAX_COLA)
+_escritor_pid: Optional[int] = None
+_ultimo_error: Dict[str, float] = {}
+_volcado_pedido = False
+
+
+def _recortar(contenido: bytes) -> bytes:
+    limite = settings.SOAP_CAPTURA_MAX_BYTES
+    return contenido if len(contenido) <= limite else contenido[:limite]
+
+
+def redactar(contenido: bytes) -> bytes:
+    """Reemplaza xDE, firmas y certificados por su tamaño"""
+    return _RE_REDACTAR.sub(
+        lambda m: m.group(1) + f"[redactado {len(m.group(3))} bytes]".encode() + m.group(4),
+        contenido,
+    )
+
+
+def _guardar(intercambio: Intercambio, es_error: bool) -> List[Intercambio]:
+    """
+    Agrega al buffer del endpoint. Si es un error y toca escribirlo retorna
+    lo capturado desde el último error escrito; si no, [].
+    """
+    global _buffers_pid, _escritor_pid
+    with _lock:
+        if _buffers_pid != os.getpid():
+            _buffers.clear()    # tras un fork el hijo empieza vacío
+            _ultimo_error.clear()
+            _buffers_pid = os.getpid()
+        if _escritor_pid != os.getpid():
+            # Los hilos no sobreviven al fork: un escritor por proceso
+            threading.Thread(target=_escribir, name="captura-soap", daemon=True).start()
+            _escritor_pid = os.getpid()
+        buffer = _buffers.get(intercambio.endpoint)
+        if buffer is None:
+            buffer = _buffers[intercambio.endpoint] = deque(maxlen=settings.SOAP_CAPTURA_BUFFER)
+        buffer.append(intercambio)
+
+        if not es_error:
+            return []
+        anterior = _ultimo_error.get(intercambio.endpoint)
+        if anterior is not None and intercambio.fecha - anterior < settings.SOAP_CAPTURA_ERRORES_INTERVALO:
+            return []
+        _ultimo_error[intercambio.endpoint] = intercambio.fecha
+        return [i for i in buffer if anterior is None or i.fecha > anterior]
+
+
+def registrar(endpoint: str, solicitud: bytes, respuesta=None, latencia: float = 0.0, error: Exception = None):
+    """
+    Registra un intercambio (respuesta de requests o la excepción del envío).
+    Solo memoria; los errores además se encolan para el escritor.
+    """
+    status = respuesta.status_code if respuesta is not None else None
+    fallo = error is not None or (status is not None and status >= 400)
+
+    if not fallo and random.random() >= settings.SOAP_CAPTURA_MUESTREO:
+        return
+
+    intercambio = Intercambio(
+        endpoint=endpoint,
+        status=status,
+        latencia=latencia,
+        solicitud=_recortar(bytes(solicitud)),
+        respuesta=_recortar(respuesta.content) if respuesta is not None else b"",
+        error=str(error) if error is not None else None,
+    )
+    a_escribir = _guardar(intercambio, fallo and settings.SOAP_CAPTURA_ERRORES)
+    if a_escribir:
+        nombre = f"error-{_sello(intercambio.fecha)}-{os.getpid()}-{intercambio.operacion}.log"
+        _encolar(nombre, a_escribir)
+
+
+def capturados(endpoint: str = None) -> List[Intercambio]:
+    """Intercambios en memoria del proceso actual, del más viejo al más nuevo"""
+    with _lock:
+        if _buffers_pid != os.getpid():
+            return []
+        buffers = [_buffers.get(endpoint, ())] if endpoint else list(_buffers.values())
+        return sorted((i for buffer in buffers for i in buffer), key=lambda i: i.fecha)
+
+
+def volcar(endpoint: str = None) -> str:
+    """
+    Escribe (en segundo plano) el contenido de los buffers del proceso.
+    Retorna la ruta del archivo que se va a generar, o "" si no hay nada
+    (o si la cola del escritor está llena).
+    """
+    intercambios = capturados(endpoint)
+    if not intercambios:
+        return ""
+    return _encolar(f"captura-{_sello(time.time())}-{os.getpid()}.log", intercambios)
+
+
+def esperar_escritura():
+    """Bloquea hasta que el escritor vacía la cola (tests y shutdown)"""
+    if _escritor_pid == os.getpid():
+        _cola.join()
+
+
+def instalar_volcado_por_senal():
+    """
+    `kill -USR1 <pid>` vuelca los buffers de ese proceso. Instalado antes de
+    crear los procesos de los workers, lo heredan todos. No existe en Windows.
+
+    El handler corre en el hilo principal, que puede estar dentro de _lock
+    enviando SOAP: solo marca el pedido y el hilo escritor hace el volcado.
+    """
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, _pedir_volcado)
+
+
+def _pedir_volcado(signum, frame):
+    global _volcado_pedido
+    _volcado_pedido = True
+
+
+def _sello(instante: float) -> str:
+    return datetime.fromtimestamp(instante).strftime("%Y%m%d-%H%M%S-%f")
+
+
+def _encolar(nombre: str, intercambios: List[Intercambio]) -> str:
+    """Encola la escritura; el destino se fija ahora y no cuando escribe el hilo"""
+    ruta = os.path.join(settings.SOAP_CAPTURA_DIR, nombre)
+    try:
+        _cola.put_nowait((ruta, intercambios))
+    except queue.Full:
+        logger.debug(f"Cola de capturas SOAP llena, se descarta {nombre}")
+        return ""
+    return ruta
+
+
+def _escribir():
+    global _volcado_pedido
+    while True:
+        if _volcado_pedido:
+            _volcado_pedido = False
+            volcar()
+        try:
+            ruta, intercambios = _cola.get(timeout=_SONDEO)
+        except queue.Empty:
+            continue
+        try:
+            os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+            with open(ruta, "wb") as f:
+                for intercambio in intercambios:
+                    f.write(_formatear(intercambio))
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo escribir la captura SOAP {ruta}: {e}")
+        finally:
+            _cola.task_done()
+
+
+def _formatear(intercambio: Intercambio) -> bytes:
+    resultado = intercambio.error or intercambio.status
+    encabezado = (
+        f"===== {datetime.fromtimestamp(intercambio.fecha).isoformat()} POST {intercambio.endpoint} "
+        f"-> {resultado} ({intercambio.latencia:.3f} s) =====\n"
+    )
+    return b"".join((
+        encabezado.encode(),
+        b"--- solicitud ---\n", redactar(intercambio.solicitud), b"\n",
+        b"--- respuesta ---\n", redactar(intercambio.respuesta), b"\n\n",
+    ))
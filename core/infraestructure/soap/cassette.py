@@ -0,0 +1,156 @@
+"""
+Transporte SOAP de grabación y reproducción (cassette).
+
+SOAP_TRANSPORTE elige cómo sale cada SOAPClient.send:
+
+    red          envío normal (por defecto)
+    grabar       envío normal y además se guarda el par solicitud/respuesta
+    reproducir   no hay red: se responde con lo grabado
+
+Cada proceso graba en su propio archivo `cassette-<pid>.jsonl.gz` dentro
+de SOAP_CASSETTE (una línea JSON comprimida por intercambio), así varios
+workers no se pisan. Al reproducir se cargan todos los archivos del
+directorio y las respuestas se indexan por (operación, dId); si la misma
+clave se grabó varias veces (p. ej. un lote consultado 0361 y luego
+0362) se devuelven en el orden original y la última se repite.
+La latencia grabada se respeta multiplicada por SOAP_REPLAY_ESCALA
+(0 = sin espera).
+"""
+
+import glob
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from requests.exceptions import ConnectionError as RequestsConnectionError
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+from config.setting import settings
+from config.logger import get_logger
+
+logger = get_logger(__name__)
+
+MODO_RED = "red"
+MODO_GRABAR = "grabar"
+MODO_REPRODUCIR = "reproducir"
+
+_RE_OPERACION = re.compile(rb"<(?:[\w.-]+:)?Body[^>]*>\s*<(?:[\w.-]+:)?([\w.-]+)")
+_RE_DID = re.compile(rb"<(?:[\w.-]+:)?dId>\s*([^<\s]*)\s*<")
+
+
+class CassetteSinRespuesta(RequestsConnectionError):
+    """No hay respuesta grabada para la solicitud (se trata como falla de red)"""
+
+
+def clave_soap(soap_bytes: bytes) -> Tuple[str, str]:
+    """(operación, dId) de un sobre SOAP, ej. ("rEnvioLote", "15")"""
+    operacion = _RE_OPERACION.search(soap_bytes)
+    did = _RE_DID.search(soap_bytes)
+    return (
+        operacion.group(1).decode() if operacion else "",
+        did.group(1).decode() if did else "",
+    )
+
+
+class GrabadorCassette:
+    """Agrega cada intercambio al archivo del proceso actual"""
+
+    def __init__(self, directorio: str):
+        os.makedirs(directorio, exist_ok=True)
+        self.ruta = os.path.join(directorio, f"cassette-{os.getpid()}.jsonl.gz")
+        self._archivo = gzip.open(self.ruta, "at", encoding="utf-8")
+        self._lock = threading.Lock()
+        logger.info(f"📼 Grabando intercambios SOAP en {self.ruta}")
+
+    def registrar(self, endpoint: str, soap_bytes: bytes, respuesta: Response, latencia: float):
+        operacion, did = clave_soap(soap_bytes)
+        linea = json.dumps({
+            "op": operacion,
+            "did": did,
+            "url": endpoint,
+            "t": round(time.time(), 3),
+            "lat": round(latencia, 4),
+            "status": respuesta.status_code,
+            "req": soap_bytes.decode("utf-8", errors="replace"),
+            "resp": respuesta.content.decode("utf-8", errors="replace"),
+        }, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._archivo.write(linea + "\n")
+            self._archivo.flush()    # cada línea queda legible aunque el proceso caiga
+
+    def cerrar(self):
+        with self._lock:
+            self._archivo.close()
+
+
+class ReproductorCassette:
+    """Responde desde los cassettes grabados, sin red"""
+
+    def __init__(self, directorio: str, escala: float = 1.0):
+        self.escala = escala
+        self._respuestas: Dict[Tuple[str, str], Deque[dict]] = {}
+        self._lock = threading.Lock()
+
+        intercambios = []
+        for ruta in sorted(glob.glob(os.path.join(directorio, "*.jsonl.gz"))):
+            with gzip.open(ruta, "rt", encoding="utf-8") as f:
+                for linea in f:
+                    if linea.strip():
+                        intercambios.append(json.loads(linea))
+
+        # Orden real entre procesos: por el instante de grabación
+        for intercambio in sorted(intercambios, key=lambda i: i["t"]):
+            clave = (intercambio["op"], intercambio["did"])
+            self._respuestas.setdefault(clave, deque()).append(intercambio)
+
+        logger.info(f"📼 Reproduciendo {len(intercambios)} intercambios SOAP de {directorio}")
+
+    def responder(self, endpoint: str, soap_bytes: bytes) -> Response:
+        clave = clave_soap(soap_bytes)
+        with self._lock:
+            grabadas = self._respuestas.get(clave)
+            if not grabadas:
+                raise CassetteSinRespuesta(f"Sin respuesta grabada para {clave[0]} dId={clave[1]}")
+            intercambio = grabadas.popleft() if len(grabadas) > 1 else grabadas[0]
+
+        if self.escala > 0:
+            time.sleep(intercambio["lat"] * self.escala)
+
+        respuesta = Response()
+        respuesta.status_code = intercambio["status"]
+        respuesta._content = intercambio["resp"].encode("utf-8")
+        respuesta.headers = CaseInsensitiveDict({"Content-Type": "application/soap+xml; charset=UTF-8"})
+        respuesta.encoding = "utf-8"
+        respuesta.url = endpoint
+        return respuesta
+
+
+_transporte = None
+_transporte_pid: Optional[int] = None
+_transporte_lock = threading.Lock()
+
+
+def obtener_cassette():
+    """
+    Grabador o reproductor del proceso según SOAP_TRANSPORTE; None en modo red.
+    Tras un fork el hijo abre su propio archivo.
+    """
+    global _transporte, _transporte_pid
+    modo = settings.SOAP_TRANSPORTE
+    if modo not in (MODO_GRABAR, MODO_REPRODUCIR):
+        return None
+
+    with _transporte_lock:
+        if _transporte is None or _transporte_pid != os.getpid():
+            if modo == MODO_GRABAR:
+                _transporte = GrabadorCassette(settings.SOAP_CASSETTE)
+            else:
+                _transporte = ReproductorCassette(settings.SOAP_CASSETTE, settings.SOAP_REPLAY_ESCALA)
+            _transporte_pid = os.getpid()
+        return _transporte
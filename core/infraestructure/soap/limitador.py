@@ -0,0 +1,118 @@
+"""
+Límite de tasa compartido (token bucket) hacia SIFEN.
+
+Todos los procesos del daemon consultan la misma tabla de_rate_limit antes
+de cada envío SOAP, así la flota entera respeta:
+
+- un límite por operación/endpoint (RATE_LIMIT_OPERACIONES, ej.
+  "rEnvioLote=10,rEnviConsLoteDe=20" en solicitudes por segundo), y
+- un límite por RUC emisor (RATE_LIMIT_EMISOR, con excepciones en
+  RATE_LIMIT_EMISORES="80069563=20"), para que un emisor no acapare el cupo.
+
+Cada balde guarda tokens, tasa, capacidad y el instante de la última
+recarga. Tomar un turno de un balde es un único INSERT ... ON CONFLICT DO
+UPDATE que recarga, descuenta un token y retorna el saldo: si queda
+negativo el turno ya está reservado y el llamador duerme -saldo/tasa
+segundos. No hay locks mantenidos entre llamadas ni sondeo.
+
+Primero se reserva en el balde del emisor y recién después de esa espera
+en el de la operación: un emisor con su cupo agotado no reserva de
+antemano tokens de la operación que necesitan los demás.
+
+Si la base no responde el envío sigue (el límite no debe frenar la
+facturación); SIFEN seguirá aplicando su propio throttling.
+"""
+
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from core.infraestructure.database.database import get_engine
+from config.setting import settings
+from config.logger import get_logger
+
+logger = get_logger(__name__)
+
+_TOMAR = text("""
+    INSERT INTO de_rate_limit AS r (clave, tokens, tasa, capacidad, actualizado)
+    VALUES (:clave, :capacidad - 1, :tasa, :capacidad, clock_timestamp())
+    ON CONFLICT (clave) DO UPDATE SET
+        tokens = LEAST(
+            EXCLUDED.capacidad,
+            r.tokens + EXTRACT(EPOCH FROM clock_timestamp() - r.actualizado) * EXCLUDED.tasa
+        ) - 1,
+        tasa = EXCLUDED.tasa,
+        capacidad = EXCLUDED.capacidad,
+        actualizado = clock_timestamp()
+    RETURNING tokens
+""")
+
+_aviso_lock = threading.Lock()
+_ultimo_aviso = 0.0
+
+
+@lru_cache(maxsize=None)
+def parsear_limites(texto: str) -> Dict[str, float]:
+    """"rEnvioLote=10, 80069563=2.5" -> {"rEnvioLote": 10.0, "80069563": 2.5}"""
+    limites = {}
+    for par in texto.split(","):
+        if "=" in par:
+            clave, valor = par.split("=", 1)
+            limites[clave.strip()] = float(valor)
+    return limites
+
+
+def baldes(operacion: str, ruc: Optional[str]) -> List[Tuple[str, float]]:
+    """
+    (clave, tasa) de los baldes que aplican al envío, en el orden en que se
+    reservan (emisor, luego operación); tasa <= 0 = sin límite
+    """
+    resultado = []
+    if ruc:
+        tasa_emisor = parsear_limites(settings.RATE_LIMIT_EMISORES).get(ruc, settings.RATE_LIMIT_EMISOR)
+        if tasa_emisor > 0:
+            resultado.append((f"ruc:{ruc}", tasa_emisor))
+    tasa_operacion = parsear_limites(settings.RATE_LIMIT_OPERACIONES).get(operacion, 0)
+    if tasa_operacion > 0:
+        resultado.append((f"op:{operacion}", tasa_operacion))
+    return resultado
+
+
+def tomar_turno(operacion: str, ruc: Optional[str] = None) -> float:
+    """
+    Reserva un turno en el balde del emisor y luego en el de la operación,
+    esperando lo necesario en cada uno. Retorna los segundos esperados.
+    """
+    if not settings.RATE_LIMIT_ACTIVO:
+        return 0.0
+
+    total = 0.0
+    for clave, tasa in baldes(operacion, ruc):
+        parametros = {"clave": clave, "tasa": tasa, "capacidad": max(1.0, tasa * settings.RATE_LIMIT_RAFAGA)}
+        try:
+            with get_engine().begin() as conn:
+                tokens = conn.execute(_TOMAR, parametros).scalar_one()
+        except SQLAlchemyError as e:
+            _avisar(f"⚠️ Límite de tasa no disponible, se envía sin esperar: {e}")
+            return total
+
+        if tokens < 0:
+            espera = -tokens / tasa
+            logger.debug(f"⏳ {operacion} (RUC {ruc}) espera {espera:.2f} s por {clave}")
+            time.sleep(espera)
+            total += espera
+    return total
+
+
+def _avisar(mensaje: str):
+    """Un aviso por minuto como mucho: con la base caída cada envío fallaría aquí"""
+    global _ultimo_aviso
+    with _aviso_lock:
+        if time.monotonic() - _ultimo_aviso < 60:
+            return
+        _ultimo_aviso = time.monotonic()
+    logger.warning(mensaje)
@@ -0,0 +1,84 @@
+"""
+Codificación del envío de lotes: rDE firmados -> ZIP -> base64 -> SOAP.
+
+Los rDE se escriben directo en el stream deflate y el ZIP resultante se
+codifica en base64 por bloques dentro de un buffer ya dimensionado con el
+sobre SOAP completo. No hay concatenaciones ni conversiones bytes/str
+intermedias: el costo es lineal y en memoria quedan solo el ZIP y el sobre.
+"""
+
+import binascii
+import io
+import zipfile
+from typing import Iterable, Union
+
+BOM = b'\xef\xbb\xbf'
+
+# Bloque de entrada para base64: múltiplo de 3 para no generar padding intermedio
+_BLOQUE_B64 = 3 * 64 * 1024
+
+_SOBRE_INICIO = (
+    b'<soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope">'
+    b'<soap:Header/>'
+    b'<soap:Body>'
+    b'<rEnvioLote xmlns="http://ekuatia.set.gov.py/sifen/xsd">'
+    b'<dId>%s</dId>'
+    b'<xDE>'
+)
+_SOBRE_FIN = (
+    b'</xDE>'
+    b'</rEnvioLote>'
+    b'</soap:Body>'
+    b'</soap:Envelope>'
+)
+
+
+def comprimir_lote(partes: Iterable[bytes]) -> io.BytesIO:
+    """Escribe las partes del XML del lote en un ZIP (lote.xml) sin unirlas antes"""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        with zf.open("lote.xml", "w") as destino:
+            primera = True
+            for parte in partes:
+                if primera and parte.startswith(BOM):
+                    parte = parte[3:]  # Quitar BOM si existe
+                primera = False
+                destino.write(parte)
+    return buf
+
+
+def _largo_b64(n: int) -> int:
+    return 4 * ((n + 2) // 3)
+
+
+def codificar_envio_lote(xml: Union[bytes, bytearray, Iterable[bytes]], id_lote) -> bytearray:
+    """
+    Arma el sobre SOAP de rEnvioLote.
+
+    `xml` puede ser el XML del lote completo o un iterable con sus partes
+    (ver XMLBuilderLote.iter_lote). Retorna un bytearray listo para enviar.
+    """
+    if isinstance(xml, (bytes, bytearray)):
+        xml = (xml,)
+
+    zip_buf = comprimir_lote(xml)
+    zip_view = zip_buf.getbuffer()
+
+    inicio = _SOBRE_INICIO % str(id_lote).encode("utf-8")
+    largo_b64 = _largo_b64(len(zip_view))
+
+    sobre = bytearray(len(inicio) + largo_b64 + len(_SOBRE_FIN))
+    destino = memoryview(sobre)
+    destino[:len(inicio)] = inicio
+
+    pos = len(inicio)
+    for i in range(0, len(zip_view), _BLOQUE_B64):
+        bloque = binascii.b2a_base64(zip_view[i:i + _BLOQUE_B64], newline=False)
+        destino[pos:pos + len(bloque)] = bloque
+        pos += len(bloque)
+
+    destino[pos:] = _SOBRE_FIN
+
+    destino.release()
+    zip_view.release()
+    return sobre
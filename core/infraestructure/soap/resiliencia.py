@@ -0,0 +1,262 @@
+"""
+Reintentos, timeouts adaptativos y circuit breaker por endpoint.
+
+Cada SOAPClient.send pasa por `ejecutar`:
+
+- Errores clasificados: los que seguro no llegaron a SIFEN (conexión
+  rechazada, DNS, timeout de conexión, handshake TLS, HTTP 429/502/503)
+  se reintentan siempre; los ambiguos (conexión cortada con el cuerpo ya
+  enviado, timeout de lectura, otros HTTP 5xx) solo en consultas
+  idempotentes, para no duplicar un lote, DE o evento ya recibido. Ambos
+  cuentan como falla del endpoint para el circuito.
+  El resto (4xx, respuestas no HTTP) se propaga sin reintentar.
+- Backoff exponencial con jitter completo entre intentos.
+- En las consultas el timeout de lectura sale de la latencia observada
+  del endpoint (percentil SOAP_TIMEOUT_PERCENTIL x SOAP_TIMEOUT_FACTOR),
+  acotado entre SOAP_TIMEOUT_MIN y el timeout pedido por el llamador. Los
+  envíos usan siempre el timeout del llamador: cortarlos antes solo
+  convierte una demora de SIFEN en un resultado ambiguo.
+- Tras SOAP_CIRCUITO_FALLOS fallas seguidas del endpoint el circuito se
+  abre: durante SOAP_CIRCUITO_ESPERA los envíos fallan al instante con
+  CircuitoAbierto, sin red. Luego pasa una sola prueba (semiabierto).
+
+El estado es por proceso: cada worker aprende de sus propios envíos.
+"""
+
+import os
+import random
+import ssl
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+
+import requests
+from urllib3.exceptions import ConnectTimeoutError
+
+from core.infraestructure.soap.cassette import CassetteSinRespuesta
+from config.setting import settings
+from config.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Consultas: repetirlas no cambia nada en SIFEN
+OPERACIONES_IDEMPOTENTES = {"rEnviConsLoteDe", "rEnviConsDeRequest", "rEnviConsRUC"}
+
+NO_ENVIADO = "no_enviado"    # seguro no llegó: reintentable
+AMBIGUO = "ambiguo"          # pudo haberse procesado
+DEFINITIVO = "definitivo"    # el servidor respondió: reintentar no cambia nada
+
+_HTTP_NO_ENVIADO = {429, 502, 503}
+
+# Fallas TLS del handshake: el cuerpo todavía no salió
+_SSL_HANDSHAKE = ("handshake", "certificate", "unknown ca")
+
+_MUESTRAS_LATENCIA = 200
+_MIN_MUESTRAS = 20
+
+
+class CircuitoAbierto(requests.exceptions.ConnectionError):
+    """El endpoint está fuera de servicio; el envío no se intentó"""
+
+    def __init__(self, endpoint: str, reintentar_en: float):
+        self.endpoint = endpoint
+        self.reintentar_en = reintentar_en
+        super().__init__(f"Circuito abierto para {endpoint}, reintentar en {reintentar_en:.0f} s")
+
+
+def clasificar(error: Exception) -> str:
+    """NO_ENVIADO, AMBIGUO o DEFINITIVO"""
+    if isinstance(error, (CircuitoAbierto, CassetteSinRespuesta)):
+        return DEFINITIVO
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        if status in _HTTP_NO_ENVIADO:
+            return NO_ENVIADO
+        # 5xx (incluido el fault Receiver de SOAP 1.2): falla del servidor,
+        # cuenta para el circuito pero pudo haberse procesado
+        return AMBIGUO if status >= 500 else DEFINITIVO
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return NO_ENVIADO
+    if isinstance(error, (requests.exceptions.ReadTimeout, requests.exceptions.ChunkedEncodingError)):
+        return AMBIGUO
+    if isinstance(error, requests.ConnectionError):
+        # requests también envuelve aquí "Connection aborted" / RemoteDisconnected,
+        # que pueden llegar con el cuerpo ya enviado
+        return NO_ENVIADO if _sin_conexion(error) else AMBIGUO
+    return DEFINITIVO
+
+
+def _causas(error: BaseException):
+    """El error y los que envuelve (args, reason, __cause__, __context__)"""
+    pendientes, vistos = [error], set()
+    while pendientes:
+        actual = pendientes.pop()
+        if id(actual) in vistos:
+            continue
+        vistos.add(id(actual))
+        yield actual
+        anidados = list(actual.args) + [getattr(actual, "reason", None), actual.__cause__, actual.__context__]
+        pendientes.extend(e for e in anidados if isinstance(e, BaseException))
+
+
+def _sin_conexion(error: requests.ConnectionError) -> bool:
+    """True si la conexión (TCP o TLS) no llegó a establecerse"""
+    for causa in _causas(error):
+        # NewConnectionError y NameResolutionError heredan de ConnectTimeoutError
+        if isinstance(causa, (ConnectTimeoutError, ssl.SSLCertVerificationError)):
+            return True
+    if isinstance(error, requests.exceptions.SSLError):
+        return any(texto in str(error).lower() for texto in _SSL_HANDSHAKE)
+    return False
+
+
+def no_enviado(error: Optional[Exception]) -> bool:
+    """
+    True si el error garantiza que SIFEN no recibió nada (incluye el
+    circuito abierto): el lote/DE puede volver a la cola tal cual.
+    """
+    return error is not None and (isinstance(error, CircuitoAbierto) or clasificar(error) == NO_ENVIADO)
+
+
+class Circuito:
+    """Circuit breaker de un endpoint: cerrado -> abierto -> semiabierto"""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.fallas = 0
+        self.abierto_hasta = 0.0
+        self.probando = False
+        self.latencias: Deque[float] = deque(maxlen=_MUESTRAS_LATENCIA)
+        self._lock = threading.Lock()
+
+    @property
+    def estado(self) -> str:
+        if self.fallas < settings.SOAP_CIRCUITO_FALLOS:
+            return "cerrado"
+        return "abierto" if time.monotonic() < self.abierto_hasta else "semiabierto"
+
+    def permitir(self):
+        """Lanza CircuitoAbierto si no se debe enviar ahora"""
+        with self._lock:
+            if self.fallas < settings.SOAP_CIRCUITO_FALLOS:
+                return
+            restante = self.abierto_hasta - time.monotonic()
+            if restante > 0 or self.probando:
+                raise CircuitoAbierto(self.endpoint, max(restante, 0.0))
+            self.probando = True    # una sola solicitud de prueba
+
+    def exito(self, latencia: float):
+        with self._lock:
+            if self.fallas >= settings.SOAP_CIRCUITO_FALLOS:
+                logger.info(f"✅ Circuito cerrado para {self.endpoint}")
+            self.fallas = 0
+            self.probando = False
+            self.latencias.append(latencia)
+
+    def falla(self, latencia: float = None):
+        with self._lock:
+            if latencia is not None:
+                # Un timeout cuenta como muestra: si SIFEN se pone lento el timeout crece
+                self.latencias.append(latencia)
+            self.fallas += 1
+            self.probando = False
+            if self.fallas >= settings.SOAP_CIRCUITO_FALLOS:
+                self.abierto_hasta = time.monotonic() + settings.SOAP_CIRCUITO_ESPERA
+                logger.warning(
+                    f"🔌 Circuito abierto para {self.endpoint} tras {self.fallas} fallas "
+                    f"({settings.SOAP_CIRCUITO_ESPERA} s sin enviar)"
+                )
+
+    def liberar(self):
+        """Respuesta que no dice nada del endpoint: libera la prueba sin contar"""
+        with self._lock:
+            self.probando = False
+
+    def timeout_lectura(self, maximo: float) -> float:
+        """Percentil de la latencia observada x factor, entre el mínimo y `maximo`"""
+        with self._lock:
+            if len(self.latencias) < _MIN_MUESTRAS:
+                return maximo
+            ordenadas = sorted(self.latencias)
+        indice = min(len(ordenadas) - 1, int(len(ordenadas) * settings.SOAP_TIMEOUT_PERCENTIL))
+        adaptativo = ordenadas[indice] * settings.SOAP_TIMEOUT_FACTOR
+        return min(maximo, max(settings.SOAP_TIMEOUT_MIN, adaptativo))
+
+
+_circuitos: Dict[str, Circuito] = {}
+_circuitos_pid: Optional[int] = None
+_circuitos_lock = threading.Lock()
+_max_reintentos: Optional[int] = None
+
+
+def configurar(max_reintentos: int = None):
+    """Fija los reintentos del proceso (WorkerConfig.max_retries)"""
+    global _max_reintentos
+    _max_reintentos = max_reintentos
+
+
+def obtener_circuito(endpoint: str) -> Circuito:
+    global _circuitos_pid
+    with _circuitos_lock:
+        if _circuitos_pid != os.getpid():
+            _circuitos.clear()
+            _circuitos_pid = os.getpid()
+        circuito = _circuitos.get(endpoint)
+        if circuito is None:
+            circuito = _circuitos[endpoint] = Circuito(endpoint)
+        return circuito
+
+
+def circuito_abierto(endpoint: str) -> bool:
+    """True mientras el endpoint no acepta envíos (ni siquiera de prueba)"""
+    return obtener_circuito(endpoint).estado == "abierto"
+
+
+def backoff(intento: int) -> float:
+    """Espera antes del reintento `intento` (0, 1, ...): jitter completo"""
+    tope = min(settings.SOAP_BACKOFF_MAX, settings.SOAP_BACKOFF_BASE * (2 ** intento))
+    return random.uniform(0, tope)
+
+
+def ejecutar(endpoint: str, operacion: str, enviar: Callable[[tuple], requests.Response], timeout: float,
+             turno: Optional[Callable[[], object]] = None):
+    """
+    Llama `enviar((timeout_conexion, timeout_lectura))` aplicando la
+    política del endpoint. Retorna la respuesta o propaga el último error.
+    `turno` se llama antes de cada intento (límite de tasa); su espera no
+    cuenta como latencia del endpoint.
+    """
+    circuito = obtener_circuito(endpoint)
+    reintentos = settings.SOAP_REINTENTOS if _max_reintentos is None else _max_reintentos
+    idempotente = operacion in OPERACIONES_IDEMPOTENTES
+    intento = 0
+
+    while True:
+        circuito.permitir()
+        if turno is not None:
+            turno()
+        inicio = time.perf_counter()
+        try:
+            lectura = circuito.timeout_lectura(timeout) if idempotente else timeout
+            respuesta = enviar((settings.SOAP_TIMEOUT_CONEXION, lectura))
+        except Exception as e:
+            tipo = clasificar(e)
+            if tipo == DEFINITIVO:
+                circuito.liberar()
+                raise
+            circuito.falla(time.perf_counter() - inicio if tipo == AMBIGUO else None)
+
+            if intento >= reintentos or (tipo == AMBIGUO and not idempotente):
+                raise
+            espera = backoff(intento)
+            intento += 1
+            logger.warning(
+                f"🔁 {operacion or 'SOAP'} a {endpoint} falló ({type(e).__name__}), "
+                f"reintento {intento}/{reintentos} en {espera:.1f} s"
+            )
+            time.sleep(espera)
+            continue
+
+        circuito.exito(time.perf_counter() - inicio)
+        return respuesta
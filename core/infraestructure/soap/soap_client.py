@@ -1,46 +1,69 @@
-import os
+import time
 import logging
 import requests
-from requests import Session, Request
+from requests import Request
+
+from core.infraestructure.soap import captura, limitador, resiliencia
+from core.infraestructure.soap.transporte import obtener_sesion
+from core.infraestructure.soap.cassette import ReproductorCassette, clave_soap, obtener_cassette
 
 class SOAPClient:
-    def __init__(self, cert_path: str, key_path: str, debug: bool = True):
+    def __init__(self, cert_path: str, key_path: str, debug: bool = True, ruc: str = None):
         self.cert = (cert_path, key_path)
+        # RUC del emisor para el límite de tasa por emisor (ver limitador.py)
+        self.ruc = ruc
+        # Solo agrega un log DEBUG por envío; la captura de los sobres es
+        # muestreada y se configura con SOAP_CAPTURA_* (ver captura.py)
         self.debug = debug
-        self.session = Session()
         self.logger = logging.getLogger(__name__)
 
-        if debug:
-            logging.basicConfig(level=logging.DEBUG)
-
     def send(self, endpoint: str, soap_bytes: bytes, timeout: int = 45):
+        """
+        Envía el sobre con reintentos, timeout adaptativo y circuit breaker
+        por endpoint (ver resiliencia.py). `timeout` es el máximo de lectura.
+        """
+        operacion = clave_soap(soap_bytes)[0]
+        return resiliencia.ejecutar(
+            endpoint,
+            operacion,
+            lambda timeouts: self._enviar(endpoint, soap_bytes, timeouts),
+            timeout,
+            # Cada intento consume un turno del límite de tasa
+            turno=lambda: limitador.tomar_turno(operacion, self.ruc),
+        )
+
+    def _enviar(self, endpoint: str, soap_bytes: bytes, timeout):
+        """Un intento de envío"""
         headers = {
             "Content-Type": "application/soap+xml; charset=UTF-8",
             "Accept": "application/soap+xml, application/xml, text/xml",
             "User-Agent": "python-sifen-client/1.0",
         }
 
-        req = Request("POST", endpoint, data=soap_bytes, headers=headers)
-        pre = self.session.prepare_request(req)
-
-        if self.debug:
-            os.makedirs("tests/output", exist_ok=True)
-            with open("tests/output/last_soap_sent.xml", "wb") as f:
-                f.write(soap_bytes)
-
-        resp = self.session.send(pre, cert=self.cert, timeout=timeout)
-
+        inicio = time.perf_counter()
+        try:
+            # Grabación/reproducción de intercambios (SOAP_TRANSPORTE, ver cassette.py)
+            cassette = obtener_cassette()
+            if isinstance(cassette, ReproductorCassette):
+                resp = cassette.responder(endpoint, soap_bytes)
+            else:
+                # Sesión keep-alive compartida por certificado y host (ver transporte.py)
+                session = obtener_sesion(self.cert[0], self.cert[1], endpoint)
+                req = Request("POST", endpoint, data=soap_bytes, headers=headers)
+                pre = session.prepare_request(req)
+
+                # El certificado cliente ya está en el SSLContext del adaptador
+                resp = session.send(pre, timeout=timeout)
+                if cassette is not None:
+                    cassette.registrar(endpoint, bytes(soap_bytes), resp, time.perf_counter() - inicio)
+        except requests.RequestException as e:
+            captura.registrar(endpoint, soap_bytes, latencia=time.perf_counter() - inicio, error=e)
+            raise
+
+        latencia = time.perf_counter() - inicio
+        captura.registrar(endpoint, soap_bytes, resp, latencia)
         if self.debug:
-            with open("tests/output/last_soap_response.xml", "wb") as f:
-                f.write(resp.content)
-
-            print("\n===== HTTP STATUS =====")
-            print(resp.status_code)
-            print("\n===== SOAP RESPONSE =====")
-            try:
-                print(resp.content.decode("utf-8"))
-            except Exception:
-                print(resp.content.decode("latin1", errors="replace"))
+            self.logger.debug("SOAP %s -> HTTP %s (%.3f s)", endpoint, resp.status_code, latencia)
 
         resp.raise_for_status()
         return resp
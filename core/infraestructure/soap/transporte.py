@@ -0,0 +1,93 @@
+"""
+Registro de transportes HTTP para SIFEN.
+
+Cada combinación (cert_path, key_path, host) tiene una requests.Session
+con un pool de conexiones keep-alive y un SSLContext con el certificado
+del emisor ya cargado. Así el handshake mTLS se paga una vez por conexión
+y no en cada lote, consulta o evento.
+"""
+
+import os
+import ssl
+import threading
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.certs import where as ca_bundle
+
+from config.setting import settings
+from config.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class AdaptadorTLS(HTTPAdapter):
+    """HTTPAdapter que usa un SSLContext propio (certificado cliente incluido)"""
+
+    def __init__(self, ssl_context: ssl.SSLContext, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["ssl_context"] = self.ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, *args, **kwargs):
+        kwargs["ssl_context"] = self.ssl_context
+        return super().proxy_manager_for(*args, **kwargs)
+
+
+_transportes: Dict[Tuple[str, str, str], Session] = {}
+_transportes_pid = None
+_lock = threading.Lock()
+
+
+def _crear_contexto(cert_path: str, key_path: str) -> ssl.SSLContext:
+    contexto = ssl.create_default_context(cafile=settings.SOAP_CA_BUNDLE or ca_bundle())
+    contexto.load_cert_chain(cert_path, key_path)
+    return contexto
+
+
+def _crear_sesion(cert_path: str, key_path: str, host: str) -> Session:
+    adaptador = AdaptadorTLS(
+        _crear_contexto(cert_path, key_path),
+        pool_connections=settings.SOAP_POOL_CONNECTIONS,
+        pool_maxsize=settings.SOAP_POOL_MAXSIZE,
+    )
+    sesion = Session()
+    sesion.mount(f"https://{host}/", adaptador)
+    logger.info(f"🔌 Transporte SOAP creado para {host} ({os.path.basename(cert_path)})")
+    return sesion
+
+
+def obtener_sesion(cert_path: str, key_path: str, endpoint: str) -> Session:
+    """
+    Retorna la sesión compartida del proceso para el certificado y el host
+    del endpoint. Tras un fork el registro se vacía: las conexiones del
+    padre no se reutilizan en el hijo.
+    """
+    global _transportes_pid
+    host = urlsplit(endpoint).netloc
+    clave = (cert_path, key_path, host)
+
+    with _lock:
+        if _transportes_pid != os.getpid():
+            _transportes.clear()
+            _transportes_pid = os.getpid()
+
+        sesion = _transportes.get(clave)
+        if sesion is None:
+            sesion = _crear_sesion(cert_path, key_path, host)
+            _transportes[clave] = sesion
+        return sesion
+
+
+def cerrar_transportes():
+    """Cierra todas las conexiones del proceso actual"""
+    with _lock:
+        if _transportes_pid == os.getpid():
+            for sesion in _transportes.values():
+                sesion.close()
+        _transportes.clear()
@@ -1,6 +1,7 @@
-from core.soap_client import SOAPClient
+from core.infraestructure.soap.soap_client import SOAPClient
+from config.setting import settings
 
-endpoint = "https://sifen.set.gov.py/de/ws/consultas/consulta-ruc.wsdl"
+endpoint = settings.CONSULTA_RUC_ENDPOINT
 
 def consultaRuc(client: SOAPClient,ruc: str, numdoc: int):
 
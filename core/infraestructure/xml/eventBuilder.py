@@ -3,12 +3,14 @@ from domain.models.models import Emisor, Evento
 from lxml import etree as ET
 from core.infraestructure.xml.sign_xml import signxml
 import decimal
-from core.infraestructure.database.database import get_db
+from core.infraestructure.database.database import SessionLocal
 from enum import Enum
 from domain.repositories.evento_repo import EventoRepository
 class eventBuilder:
 
-    db = next(get_db())
+    def __init__(self, db=None):
+        # La sesión se recibe del servicio; sin ella se abre una propia al instanciar
+        self.db = db if db is not None else SessionLocal()
     
     NS = { 
        None: "http://ekuatia.set.gov.py/sifen/xsd",
@@ -0,0 +1,121 @@
+"""
+Armado y firma de DEs en paralelo con un pool de procesos.
+
+XMLBuilder en modo puro (sin sesión) + signxml es CPU puro, así que cada
+documento se puede armar en otro proceso. Los documentos viajan
+serializados (pickle) con sus relaciones ya cargadas y vuelven los
+valores a persistir en bloque: cdc_de, ddvid, dfecfirma y xml_de.
+"""
+
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from core.infraestructure.xml.xml_builder import XMLBuilder
+from core.infraestructure.xml.validador_xsd import XSD_DE, obtener_esquema, validar_de
+from utils.buildCDC import calcularCDC
+from utils.loadDFecFirma import calcularFecFirma
+from config.setting import settings
+from config.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Relaciones que XMLBuilder lee; deben estar cargadas antes de serializar
+_RELACIONES = (
+    "emisor", "timbrado", "operacion", "receptor", "items", "totales",
+    "operacion_comercial", "nota_credito_debito", "complementos",
+)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()    # el pipeline firma desde varios hilos
+
+
+def armar_documento(doc) -> Dict:
+    """
+    Arma, firma y valida (XSD_VALIDAR) un DE sin tocar la sesión.
+    Nunca lanza: el error queda en la clave "error" para marcar ERROR_XML.
+    """
+    try:
+        cdc, ddvid = calcularCDC(doc)
+        dfecfirma = calcularFecFirma()
+        xml_de = XMLBuilder().build(doc, cdc=cdc, ddvid=ddvid, dfecfirma=dfecfirma)
+        validar_de(xml_de)
+        return {"cdc_de": cdc, "ddvid": ddvid, "dfecfirma": dfecfirma, "xml_de": xml_de, "error": None}
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def _obtener_pool() -> Optional[ProcessPoolExecutor]:
+    """Pool propio de cada proceso worker (no se hereda por fork)"""
+    if settings.SIGN_POOL_WORKERS <= 1:
+        return None
+    with _pool_lock:
+        return _crear_pool()
+
+
+def _crear_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        try:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.SIGN_POOL_WORKERS,
+                initializer=_iniciar_proceso
+            )
+            _pool_pid = os.getpid()
+            logger.info(f"🧵 Pool de firma iniciado con {settings.SIGN_POOL_WORKERS} procesos")
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo iniciar el pool de firma, se firma en serie: {e}")
+            _pool = None
+            return None
+    return _pool
+
+
+def _iniciar_proceso():
+    """Compila el XSD al levantar cada proceso, no con el primer documento"""
+    if settings.XSD_VALIDAR:
+        obtener_esquema(XSD_DE)
+
+
+def precargar(doc):
+    """Toca las relaciones en el proceso padre para que viajen en el pickle"""
+    for rel in _RELACIONES:
+        getattr(doc, rel)
+    if doc.emisor is not None:
+        doc.emisor.actividades
+
+
+def armar_documentos(documentos: List) -> List[Dict]:
+    """
+    Arma y firma los documentos y retorna los resultados en el mismo orden.
+    Con SIGN_POOL_WORKERS <= 1 (o un solo documento) se arma en serie.
+    """
+    pool = _obtener_pool() if len(documentos) > 1 else None
+    if pool is None:
+        return [armar_documento(doc) for doc in documentos]
+
+    for doc in documentos:
+        precargar(doc)
+
+    chunksize = max(1, len(documentos) // (settings.SIGN_POOL_WORKERS * 4))
+    try:
+        return list(pool.map(armar_documento, documentos, chunksize=chunksize))
+    except Exception as e:
+        # Pool roto (un proceso murió): se descarta y se arma en serie
+        logger.error(f"❌ Error en el pool de firma, se reintenta en serie: {e}")
+        cerrar_pool()
+        return [armar_documento(doc) for doc in documentos]
+
+
+def cerrar_pool():
+    """Libera los procesos del pool del proceso actual"""
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
+    _pool_pid = None
+
+
+atexit.register(cerrar_pool)
@@ -1,36 +1,92 @@
+import os
+import threading
 from copy import deepcopy
 from xml.dom.expatbuilder import Namespaces
 from signxml import XMLSigner, methods, namespaces
 from lxml import etree
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
 from cryptography.exceptions import InvalidKey
 
 
-def signxml(xml_bytes: bytes,cert_path:str,key_path:str,password:str) -> tuple[etree.Element, str]:
-    parser = etree.XMLParser(remove_blank_text=True)
-    de_node = etree.fromstring(xml_bytes, parser=parser)
-    # Leer certificado y clave
-    try:
-        with open(cert_path, "rb") as f:
-            cert_pem = f.read()
+class ContextoFirma:
+    """
+    Material de firma de un emisor ya cargado: clave privada, certificado
+    PEM y los valores de X509IssuerSerial. Se arma una sola vez por
+    (cert_path, key_path) y se invalida si cambia el mtime de los archivos.
+    """
+
+    def __init__(self, cert_path: str, key_path: str, password: str = None):
+        try:
+            with open(cert_path, "rb") as f:
+                self.cert_pem = f.read()
+
+            with open(key_path, "rb") as f:
+                key_pem = f.read()
+
+        except FileNotFoundError as e:
+            raise FileNotFoundError(f"No se encontró el archivo de certificado/clave: {e}")
+
+        try:
+            cert = x509.load_pem_x509_certificate(self.cert_pem, default_backend())
+        except Exception as e:
+            raise ValueError(f"Certificado inválido: {str(e)}")
+
+        self.issuer_name = cert.issuer.rfc4514_string()
+        self.serial_number = str(cert.serial_number)
+        self.key = self._cargar_clave(key_pem, password)
+        self.mtimes = _mtimes(cert_path, key_path)
+
+    @staticmethod
+    def _cargar_clave(key_pem: bytes, password: str):
+        """Carga la clave; si está cifrada se descifra con la contraseña del emisor"""
+        try:
+            return serialization.load_pem_private_key(key_pem, password=None)
+        except TypeError:
+            # Clave cifrada: se necesita Emisor.passwrd
+            if not password:
+                raise ValueError("La clave privada está cifrada y el emisor no tiene contraseña.")
+        except Exception as e:
+            raise ValueError(f"Clave privada inválida: {str(e)}")
 
-        with open(key_path, "rb") as f:
-            key = f.read()
+        try:
+            return serialization.load_pem_private_key(key_pem, password=password.encode())
+        except Exception:
+            raise ValueError("Clave privada inválida o contraseña errónea.")
 
-    except FileNotFoundError as e:
-        raise FileNotFoundError(f"No se encontró el archivo de certificado/clave: {e}")
 
-    #password_bytes = password.encode() if password else None
+_contextos = {}
+_contextos_lock = threading.Lock()
+
+
+def _mtimes(cert_path: str, key_path: str) -> tuple:
+    return (os.path.getmtime(cert_path), os.path.getmtime(key_path))
+
+
+def obtener_contexto_firma(cert_path: str, key_path: str, password: str = None) -> ContextoFirma:
+    """Retorna el contexto de firma cacheado, recargándolo si los archivos cambiaron"""
+    clave = (cert_path, key_path)
+    contexto = _contextos.get(clave)
     try:
-        cert = x509.load_pem_x509_certificate(cert_pem, default_backend())
-    except Exception as e:
-        raise ValueError(f"Certificado inválido: {str(e)}")
-    # Cargar certificado y clave privada
+        vigente = contexto is not None and contexto.mtimes == _mtimes(cert_path, key_path)
+    except OSError:
+        vigente = False
+    if vigente:
+        return contexto
+
+    with _contextos_lock:
+        contexto = ContextoFirma(cert_path, key_path, password)
+        _contextos[clave] = contexto
+    return contexto
 
 
-    issuer_name = cert.issuer.rfc4514_string()
-    serial_number = str(cert.serial_number)
+def signxml(xml_bytes: bytes,cert_path:str,key_path:str,password:str, contexto: ContextoFirma = None) -> tuple[etree.Element, str]:
+    parser = etree.XMLParser(remove_blank_text=True)
+    de_node = etree.fromstring(xml_bytes, parser=parser)
+    # Certificado y clave ya cargados (cache por emisor)
+    if contexto is None:
+        contexto = obtener_contexto_firma(cert_path, key_path, password)
 
     de_id = de_node.get("Id")
     if not de_id:
@@ -46,9 +102,8 @@ def signxml(xml_bytes: bytes,cert_path:str,key_path:str,password:str) -> tuple[e
     try:
         signed_root = signer.sign(
             de_node,
-            key=key,
-            #passphrase=password_bytes,
-            cert=cert_pem,
+            key=contexto.key,
+            cert=contexto.cert_pem,
             reference_uri="#" + de_id
         )
 
@@ -65,8 +120,8 @@ def signxml(xml_bytes: bytes,cert_path:str,key_path:str,password:str) -> tuple[e
         x509_data = signature_node.find(".//{http://www.w3.org/2000/09/xmldsig#}X509Data")
         if x509_data is not None:
             issuer_serial = etree.SubElement(x509_data, "{http://www.w3.org/2000/09/xmldsig#}X509IssuerSerial")
-            etree.SubElement(issuer_serial, "{http://www.w3.org/2000/09/xmldsig#}X509IssuerName").text = issuer_name
-            etree.SubElement(issuer_serial, "{http://www.w3.org/2000/09/xmldsig#}X509SerialNumber").text = serial_number
+            etree.SubElement(issuer_serial, "{http://www.w3.org/2000/09/xmldsig#}X509IssuerName").text = contexto.issuer_name
+            etree.SubElement(issuer_serial, "{http://www.w3.org/2000/09/xmldsig#}X509SerialNumber").text = contexto.serial_number
 
         signature_copy = deepcopy(signature_node)
         # Quitar todos los prefijos y xmlns:ds
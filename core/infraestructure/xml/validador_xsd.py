@@ -0,0 +1,97 @@
+"""
+Validación previa contra los XSD de SIFEN.
+
+Un error de esquema detectado por SIFEN cuesta un viaje completo y deja
+todo el lote LOTE_RECHAZADO. Con XSD_VALIDAR cada rDE (y cada evento) se
+valida localmente antes de enviarse; el documento inválido queda en
+ERROR_XML sin tocar la red ni el resto del lote.
+
+Los XSD (siRecepDE_v150.xsd, siRecepEvento_v150.xsd y sus include/import)
+se leen de XSD_DIR. El XMLSchema compilado se guarda por proceso: cada
+proceso del pool de firma compila el suyo una vez y lo reutiliza.
+"""
+
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from lxml import etree
+
+from config.setting import settings
+from config.logger import get_logger
+
+logger = get_logger(__name__)
+
+XSD_DE = "siRecepDE_v150.xsd"
+XSD_EVENTO = "siRecepEvento_v150.xsd"
+
+# (pid, directorio, archivo) -> esquema compilado; None si no está disponible
+_esquemas: Dict[Tuple[int, str, str], Optional[etree.XMLSchema]] = {}
+_esquemas_lock = threading.Lock()
+
+
+class ErrorEsquema(ValueError):
+    """El XML no cumple el XSD de SIFEN"""
+
+    def __init__(self, archivo: str, errores: list):
+        self.archivo = archivo
+        self.errores = errores
+        super().__init__(f"XML inválido según {archivo}: " + "; ".join(errores))
+
+
+def obtener_esquema(archivo: str) -> Optional[etree.XMLSchema]:
+    """
+    Compila (una vez por proceso) el XSD indicado. Retorna None si el
+    archivo no existe o no compila; en ese caso no se valida.
+    """
+    clave = (os.getpid(), settings.XSD_DIR, archivo)
+    esquema = _esquemas.get(clave, False)
+    if esquema is not False:
+        return esquema
+
+    with _esquemas_lock:
+        if clave in _esquemas:
+            return _esquemas[clave]
+
+        ruta = os.path.join(settings.XSD_DIR, archivo)
+        try:
+            # Desde archivo: los include/import relativos se resuelven en XSD_DIR
+            esquema = etree.XMLSchema(etree.parse(ruta))
+            logger.info(f"📐 Esquema {archivo} compilado (pid {os.getpid()})")
+        except (OSError, etree.XMLSchemaParseError, etree.XMLSyntaxError) as e:
+            logger.warning(f"⚠️ No se pudo cargar {ruta}, se omite la validación: {e}")
+            esquema = None
+
+        _esquemas[clave] = esquema
+        return esquema
+
+
+def validar(xml: bytes, archivo: str, max_errores: int = 5):
+    """
+    Valida el XML contra el XSD. Lanza ErrorEsquema si no cumple.
+    Sin XSD_VALIDAR o sin el XSD disponible no hace nada.
+    """
+    if not settings.XSD_VALIDAR:
+        return
+
+    esquema = obtener_esquema(archivo)
+    if esquema is None:
+        return
+
+    documento = etree.fromstring(xml)
+    if not esquema.validate(documento):
+        errores = [
+            f"línea {error.line}: {error.message}"
+            for error in list(esquema.error_log)[:max_errores]
+        ]
+        raise ErrorEsquema(archivo, errores)
+
+
+def validar_de(xml: bytes):
+    """Valida un rDE armado por XMLBuilder"""
+    validar(xml, XSD_DE)
+
+
+def validar_evento(xml: bytes):
+    """Valida un gGroupGesEve armado por eventBuilder"""
+    validar(xml, XSD_EVENTO)
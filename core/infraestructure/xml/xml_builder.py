@@ -1,5 +1,6 @@
 import os
 import warnings
+from datetime import datetime
 from dotenv import load_dotenv
 from lxml import etree as ET
 from pytest import Session
@@ -9,8 +10,8 @@ from core.infraestructure.database.database import get_db
 from domain.models.models import Documento, OperacionContado, Timbrado, OperacionCredito,Emisor as emisor
 from utils.hashQR import sha256_hash_bytes
 from utils.toInt import to_int_if_possible
-from utils.buildCDC import buildCDC
-from utils.loadDFecFirma import loadFec
+from utils.buildCDC import buildCDC, calcularCDC
+from utils.loadDFecFirma import loadFec, calcularFecFirma
 load_dotenv()
 
 
@@ -26,7 +27,9 @@ def safe_get(obj, attr, default=None):
 
 class XMLBuilder:
     
-    def __init__(self, db: Session):
+    def __init__(self, db: Session = None):
+        # Sin sesión el builder es puro: CDC, dDVId y dFecFirma llegan como
+        # parámetros de build() y no se escribe nada en la base de datos
         self.db = db
     
     
@@ -35,7 +38,14 @@ class XMLBuilder:
         "xsi": "http://www.w3.org/2001/XMLSchema-instance",
     }
 
-    def build(self, doc:Documento):
+    def build(self, doc:Documento, cdc: str = None, ddvid=None, dfecfirma: datetime = None):
+        """
+        Arma y firma el rDE del documento.
+
+        Con sesión, los valores no recibidos se calculan y se cargan en el
+        documento (buildCDC / loadFec). Sin sesión se calculan en memoria y
+        el documento no se modifica; el llamador los persiste en bloque.
+        """
         
         rDE = ET.Element("rDE", nsmap=self.NS)
 
@@ -46,17 +56,28 @@ class XMLBuilder:
         )
 
         ET.SubElement(rDE, "dVerFor").text = str(safe_get(doc, "dverfor"))
-        buildCDC(self.db,doc)
-        
-        cdc =safe_get(doc, "cdc_de")
+        if cdc is None:
+            if self.db is None:
+                cdc, ddvid = calcularCDC(doc)
+            else:
+                buildCDC(self.db,doc)
+                cdc = safe_get(doc, "cdc_de")
+                ddvid = safe_get(doc, "ddvid")
+        elif ddvid is None:
+            ddvid = cdc[-1]
         
         Id_DE=cdc
         
         DE = ET.SubElement(rDE, "DE", Id=Id_DE)
-        ET.SubElement(DE, "dDVId").text = str(safe_get(doc, "ddvid"))
-        
-        loadFec(self.db,doc)
-        fechafirma =doc.dfecfirma.strftime("%Y-%m-%dT%H:%M:%S") #"2025-12-18T14:17:10"
+        ET.SubElement(DE, "dDVId").text = str(ddvid)
+        
+        if dfecfirma is None:
+            if self.db is None:
+                dfecfirma = calcularFecFirma()
+            else:
+                loadFec(self.db,doc)
+                dfecfirma = doc.dfecfirma
+        fechafirma =dfecfirma.strftime("%Y-%m-%dT%H:%M:%S") #"2025-12-18T14:17:10"
         ET.SubElement(DE, "dFecFirma").text = fechafirma
 
         ET.SubElement(DE, "dSisFact").text = str(safe_get(doc, "dsisfact"))
@@ -95,7 +116,7 @@ class XMLBuilder:
         rDE.append(signature_node)
         
                 # 2. CONSTRUIR <gCamFuFD> (y <rQR>) usando el DigestValue
-        self._build_gCamFuFD(rDE, doc, digest_value_b64)
+        self._build_gCamFuFD(rDE, doc, digest_value_b64, cdc)
         
         # 4. Serializar y retornar el XML COMPLETO Y FIRMADO CON declaración XML
         xml_signed = ET.tostring(rDE, encoding="utf-8", xml_declaration=False, pretty_print=False)
@@ -422,13 +443,13 @@ class XMLBuilder:
         ET.SubElement(gCamNCDE, "dPunExp").text = safe_get(nc, "dpunexp_ref")
         ET.SubElement(gCamNCDE, "dNumDoc").text = safe_get(nc, "dnumdoc_ref")
         
-    def _build_gCamFuFD(self, rDE, doc, digest_value_b64):
+    def _build_gCamFuFD(self, rDE, doc, digest_value_b64, cdc=None):
         gCamFuFD = ET.SubElement(rDE, "gCamFuFD")
 
         # ---- parámetros obligatorios del QR ----
         version = "150" 
-        cdc =safe_get(doc, "cdc_de")
-        dv = safe_get(doc, "ddvid")
+        if cdc is None:
+            cdc =safe_get(doc, "cdc_de")
         Id=cdc  # el CDC completo (44 dígitos)
         dfeemide = safe_get(doc, "dfeemide")
         dFeEmiDE = dfeemide.strftime("%Y-%m-%dT%H:%M:%S").encode().hex() if dfeemide else ""
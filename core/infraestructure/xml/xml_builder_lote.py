@@ -5,12 +5,15 @@ class XMLBuilderLote:
     XSI = "http://www.w3.org/2001/XMLSchema-instance"
     SCHEMA_LOC = "http://ekuatia.set.gov.py/sifen/xsd siRecepDE_v150.xsd"
 
-    def build_lote(self, rde_list):
-        xml = b'<?xml version="1.0" encoding="UTF-8"?>'
-        xml += b'<rLoteDE xmlns="http://ekuatia.set.gov.py/sifen/xsd">'
+    def iter_lote(self, rde_list):
+        """Partes del XML del lote en orden, sin concatenar"""
+        yield b'<?xml version="1.0" encoding="UTF-8"?>'
+        yield b'<rLoteDE xmlns="http://ekuatia.set.gov.py/sifen/xsd">'
 
         for rde in rde_list:
-            xml += rde.strip()  # rde YA firmado, sin tocar
+            yield rde.strip()  # rde YA firmado, sin tocar
+
+        yield b'</rLoteDE>'
 
-        xml += b'</rLoteDE>'
-        return xml
\ No newline at end of file
+    def build_lote(self, rde_list):
+        return b"".join(self.iter_lote(rde_list))
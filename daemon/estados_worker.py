@@ -1,10 +1,12 @@
 # daemon/event_worker.py
-import time
 import logging
+from datetime import datetime
 from typing import Optional
 from dataclasses import dataclass
 
 from core.infraestructure.database.database import get_db_session
+from core.infraestructure.database.notificaciones import EscuchaNotificaciones, CANAL_LOTE
+from core.infraestructure.soap import resiliencia
 from services.estados_service import EstadosService 
 
 logger = logging.getLogger(__name__)
@@ -24,6 +26,8 @@ class EstadosWorker:
     def __init__(self, config: Optional[EstadosWorkerConfig] = None):
         self.config = config or EstadosWorkerConfig()
         self.running = False
+        self._escucha = EscuchaNotificaciones([CANAL_LOTE])
+        self._proxima_consulta = None
         
     def setup(self):
         """Configura el worker de estados"""
@@ -45,6 +49,12 @@ class EstadosWorker:
         self.running = True
         logger.info("🚀 Iniciando EstadosWorker...")
         
+        # Reintentos de la capa SOAP en este proceso (ver resiliencia.py)
+        resiliencia.configurar(max_reintentos=self.config.max_retries)
+        
+        # LISTEN antes del primer ciclo: no se pierde trabajo nuevo
+        self._escucha.iniciar()
+        
         try:
             while self.running:
                 self._process_lotes_cycle()
@@ -52,8 +62,9 @@ class EstadosWorker:
                 if not self.running:
                     break
                     
-                logger.info(f"⏳ Esperando {self.config.interval} segundos...")
-                time.sleep(self.config.interval)
+                espera = self._proxima_espera()
+                logger.info(f"⏳ Esperando trabajo (máx. {espera} segundos)...")
+                self._escucha.esperar(espera)
                 
         except KeyboardInterrupt:
             logger.info("🛑 Interrupción recibida")
@@ -71,11 +82,19 @@ class EstadosWorker:
             try:
                 service = EstadosService(db,self.config.batch_size)
                 result = service.processLotes(self.config.estados)
+                self._proxima_consulta = result.get("proxima_consulta") if result else None
                 self._log_results(result)
                 
             except Exception as e:
                 logger.error(f"❌ Error en ciclo de estados: {e}")
     
+    def _proxima_espera(self) -> int:
+        """Segundos hasta la próxima consulta programada, con el intervalo como tope"""
+        if self._proxima_consulta is None:
+            return self.config.interval
+        restante = (self._proxima_consulta - datetime.now()).total_seconds()
+        return max(1, min(self.config.interval, int(restante)))
+    
     def _log_results(self, result):
         """Loggea resultados del procesamiento de estados"""
         if not result:
@@ -83,7 +102,7 @@ class EstadosWorker:
             return
         
         total_procesados = result.get("total_procesados", 0)
-        logger.info(f"✅ Documentos procesados: {total_procesados}")
+        logger.info(f"✅ Lotes concluidos: {total_procesados} - reprogramados: {result.get('reprogramados', 0)}")
     
     def stop(self):
         """Detiene el worker de Estados"""
@@ -92,6 +111,7 @@ class EstadosWorker:
         
         logger.info("🛑 Deteniendo EstadosWorker...")
         self.running = False
+        self._escucha.cerrar()
         logger.info("✅ EstadosWorker detenido")
     
     def process_once(self):
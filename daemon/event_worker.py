@@ -1,10 +1,11 @@
 # daemon/event_worker.py
-import time
 import logging
 from typing import Optional
 from dataclasses import dataclass
 
 from core.infraestructure.database.database import get_db_session
+from core.infraestructure.database.notificaciones import EscuchaNotificaciones, CANAL_EVENTO
+from core.infraestructure.soap import resiliencia
 from services.evento_service import EventoService  # Necesitarás crear este servicio
 
 logger = logging.getLogger(__name__)
@@ -23,6 +24,7 @@ class EventWorker:
     def __init__(self, config: Optional[EventWorkerConfig] = None):
         self.config = config or EventWorkerConfig()
         self.running = False
+        self._escucha = EscuchaNotificaciones([CANAL_EVENTO])
         
     def setup(self):
         """Configura el worker de eventos"""
@@ -44,6 +46,12 @@ class EventWorker:
         self.running = True
         logger.info("🚀 Iniciando EventWorker...")
         
+        # Reintentos de la capa SOAP en este proceso (ver resiliencia.py)
+        resiliencia.configurar(max_reintentos=self.config.max_retries)
+        
+        # LISTEN antes del primer ciclo: no se pierde trabajo nuevo
+        self._escucha.iniciar()
+        
         try:
             while self.running:
                 self._process_event_cycle()
@@ -51,8 +59,8 @@ class EventWorker:
                 if not self.running:
                     break
                     
-                logger.info(f"⏳ Esperando {self.config.interval} segundos...")
-                time.sleep(self.config.interval)
+                logger.info(f"⏳ Esperando trabajo (máx. {self.config.interval} segundos)...")
+                self._escucha.esperar(self.config.interval)
                 
         except KeyboardInterrupt:
             logger.info("🛑 Interrupción recibida")
@@ -91,6 +99,7 @@ class EventWorker:
         
         logger.info("🛑 Deteniendo EventWorker...")
         self.running = False
+        self._escucha.cerrar()
         logger.info("✅ EventWorker detenido")
     
     def process_once(self):
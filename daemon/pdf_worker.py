@@ -2,12 +2,12 @@
 """
 Worker de DemonSiffen - Generador automático de PDFs para documentos aprobados por SIFEN
 """
-import time
 import logging
 from typing import Optional
 from dataclasses import dataclass
 
 from core.infraestructure.database.database import get_db_session
+from core.infraestructure.database.notificaciones import EscuchaNotificaciones, CANAL_APROBADO
 from services.pdf_service import PDFService
 
 logger = logging.getLogger(__name__)
@@ -26,6 +26,7 @@ class PDFWorker:
     def __init__(self, config: Optional[PDFWorkerConfig] = None):
         self.config = config or PDFWorkerConfig()
         self.running = False
+        self._escucha = EscuchaNotificaciones([CANAL_APROBADO])
         
     def setup(self):
         """Configura el worker de PDFs"""
@@ -50,6 +51,9 @@ class PDFWorker:
         self.running = True
         logger.info("🚀 Iniciando PDFWorker...")
         
+        # LISTEN antes del primer ciclo: no se pierde trabajo nuevo
+        self._escucha.iniciar()
+        
         try:
             while self.running:
                 self._process_pdf_cycle()
@@ -57,8 +61,8 @@ class PDFWorker:
                 if not self.running:
                     break
                     
-                logger.info(f"⏳ Esperando {self.config.interval} segundos para siguiente ciclo de PDFs...")
-                time.sleep(self.config.interval)
+                logger.info(f"⏳ Esperando trabajo (máx. {self.config.interval} segundos)...")
+                self._escucha.esperar(self.config.interval)
                 
         except KeyboardInterrupt:
             logger.info("🛑 Interrupción recibida")
@@ -108,6 +112,7 @@ class PDFWorker:
         
         logger.info("🛑 Deteniendo PDFWorker...")
         self.running = False
+        self._escucha.cerrar()
         logger.info("✅ PDFWorker detenido")
     
     def process_once(self):
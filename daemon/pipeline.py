@@ -0,0 +1,353 @@
+"""
+Pipeline de facturación por etapas para SifenWorker.
+
+    reclamo -> firma -> armado de lote -> envío -> persistencia
+
+Los documentos express no pasan por esas etapas: un hilo aparte los
+envía por rEnviDe (ExpressService) sin esperar detrás de los lotes.
+
+Cada etapa corre en sus propios hilos y se conecta con la siguiente por
+una cola acotada: si una etapa se atrasa, la anterior se bloquea
+(backpressure) en lugar de acumular trabajo en memoria. Así la firma del
+lote N+1 se solapa con el viaje a SIFEN del lote N.
+
+Las etapas que tocan la base (reclamo, armado y persistencia) abren una
+sesión propia por unidad de trabajo; los documentos viajan entre etapas
+desconectados de la sesión y los envíos solo reciben valores planos.
+
+Nada espera en una cola con el lease vencido: se reclama a lo sumo una
+cola de documentos, la firma renueva el lease de los documentos al
+tomarlos, el armado solo usa los que este worker sigue teniendo
+reclamados y el envío renueva fecha_envio (LOTE_ARMADO) al tomar el lote.
+Si otro worker ya los tomó, se descartan sin firmar ni enviar.
+"""
+
+import logging
+import queue
+import threading
+from typing import Dict, List, Optional
+
+from core.infraestructure.database.database import get_db_session
+from core.infraestructure.xml.pool_firma import armar_documentos, precargar
+from domain.repositories.doc_repo import DocumentoRepo
+from services.factura_service import FacturaService
+from services.express_service import ExpressService
+from config.setting import settings
+
+logger = logging.getLogger(__name__)
+
+_FIN = object()    # marca de cierre que recorre las colas
+_ESPERA_ERROR = 5   # segundos de pausa de una etapa tras un error (p. ej. la base caída)
+
+
+class PipelineFacturas:
+    """Pipeline de facturas con colas acotadas y concurrencia por etapa"""
+
+    ETAPAS = ("firma", "armado", "envio", "persistencia")
+
+    def __init__(self, owner: str, batch_size: int = 50, claim_limit: int = 500,
+                 lease_seconds: int = 600, escucha=None, interval: int = 60, express: bool = False):
+        self.owner = owner
+        self.batch_size = batch_size
+        self.claim_limit = claim_limit
+        self.lease_seconds = lease_seconds
+        self.escucha = escucha
+        self.interval = interval
+        self.express = express
+
+        self.hilos_firma = max(1, settings.PIPELINE_HILOS_FIRMA)
+        self.hilos_envio = max(1, settings.DESPACHO_MAX_LOTES)
+        self.max_por_emisor = max(1, settings.DESPACHO_MAX_POR_EMISOR)
+
+        tamano = max(1, settings.PIPELINE_COLA)
+        self.colas: Dict[str, queue.Queue] = {
+            etapa: queue.Queue(maxsize=tamano) for etapa in self.ETAPAS
+        }
+        self.procesados: Dict[str, int] = {etapa: 0 for etapa in ("reclamo",) + self.ETAPAS + ("express",)}
+
+        self._detener = threading.Event()
+        self._terminado = threading.Event()
+        self._cerrados: Dict[str, int] = {}
+        # Lotes armados o en envío dentro de este pipeline: el reclamo de
+        # LOTE_ARMADO huérfanos no debe tomarlos aunque esperen en cola
+        self._lotes_en_curso = set()
+        self._hilos: List[threading.Thread] = []
+        self._cupos_emisor: Dict[int, threading.BoundedSemaphore] = {}
+        self._cupos_lock = threading.Lock()
+        self._contador_lock = threading.Lock()
+
+    # ------------------------------------------------------------------ ciclo de vida
+
+    def iniciar(self):
+        """Arranca los hilos de todas las etapas"""
+        self._lanzar("reclamo", self._etapa_reclamo, 1)
+        self._lanzar("firma", self._etapa_firma, self.hilos_firma)
+        self._lanzar("armado", self._etapa_armado, 1)
+        self._lanzar("envio", self._etapa_envio, self.hilos_envio)
+        self._lanzar("persistencia", self._etapa_persistencia, 1)
+        if self.express:
+            self._lanzar("express", self._etapa_express, 1)
+        logger.info(
+            f"🏭 Pipeline iniciado - firma: {self.hilos_firma} hilos, "
+            f"envío: {self.hilos_envio} hilos, cola: {settings.PIPELINE_COLA}"
+        )
+
+    def detener(self, timeout: Optional[float] = None):
+        """Deja de reclamar y espera a que las etapas vacíen sus colas"""
+        self._detener.set()
+        for hilo in self._hilos:
+            hilo.join(timeout)
+
+    def esperar(self, timeout: Optional[float] = None) -> bool:
+        """Bloquea hasta que termine el pipeline; True si ya terminó"""
+        return self._terminado.wait(timeout)
+
+    def _lanzar(self, nombre: str, objetivo, cantidad: int):
+        for i in range(cantidad):
+            hilo = threading.Thread(target=objetivo, name=f"pipeline-{nombre}-{i}", daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+
+    def profundidades(self) -> Dict[str, int]:
+        """Elementos esperando en cada cola"""
+        return {etapa: cola.qsize() for etapa, cola in self.colas.items()}
+
+    def get_status(self) -> dict:
+        return {
+            "colas": self.profundidades(),
+            "lotes_en_curso": len(self._lotes_en_curso),
+            "procesados": dict(self.procesados),
+            "hilos": {"firma": self.hilos_firma, "envio": self.hilos_envio},
+        }
+
+    def _contar(self, etapa: str, cantidad: int = 1):
+        with self._contador_lock:
+            self.procesados[etapa] += cantidad
+
+    def _consumir(self, etapa: str, consumidores: int, siguiente: Optional[str]):
+        """
+        Itera los elementos de la cola de la etapa. Cuando el último
+        consumidor recibe el cierre lo propaga a la etapa siguiente.
+        """
+        cola = self.colas[etapa]
+        while True:
+            item = cola.get()
+            if item is _FIN:
+                # Reenviar a los otros consumidores de esta etapa y luego cerrar la siguiente
+                with self._contador_lock:
+                    self._cerrados[etapa] = self._cerrados.get(etapa, 0) + 1
+                    ultimo = self._cerrados[etapa] == consumidores
+                if not ultimo:
+                    cola.put(_FIN)
+                elif siguiente:
+                    self.colas[siguiente].put(_FIN)
+                return
+            yield item
+
+    # ------------------------------------------------------------------ etapas
+
+    def _etapa_reclamo(self):
+        """Reclama documentos (SKIP LOCKED) y lotes armados huérfanos"""
+        try:
+            while not self._detener.is_set():
+                try:
+                    encontrados = self._reclamar()
+                except Exception as e:
+                    logger.error(f"❌ Error reclamando trabajo en pipeline: {e}")
+                    self._pausa_error()
+                    continue
+                if not encontrados and not self._detener.is_set():
+                    if self.escucha is not None:
+                        self.escucha.esperar(self.interval)
+                    else:
+                        self._detener.wait(self.interval)
+        finally:
+            self.colas["firma"].put(_FIN)
+
+    def _reclamar(self) -> int:
+        with self._contador_lock:
+            en_curso = set(self._lotes_en_curso)
+        lotes = []
+        with get_db_session() as db:
+            service = FacturaService(db, unidad_trabajo=True)
+
+            # Lotes ya firmados van directo a la etapa de envío: los que quedaron
+            # armados sin enviar y el spool de contingencia, este solo hasta llenar
+            # la cola de envío (el lease se renueva igual al salir de la cola).
+            # Los que ya esperan en este pipeline no se reclaman: renovarles
+            # fecha_envio haría fallar el lease del trabajo encolado
+            listos = service.lotes_armados_pendientes(excluir=en_curso)
+            libres = self.colas["envio"].maxsize - self.colas["envio"].qsize() - len(listos)
+            if libres > 0:
+                listos += service.lotes_contingencia_pendientes(libres, excluir=en_curso)
+
+            documentos = DocumentoRepo(db).claimPendientes(
+                # Una cola de firma: lo reclamado no espera detrás del backpressure
+                limite=min(self.claim_limit, self.batch_size * max(1, settings.PIPELINE_COLA)),
+                owner=self.owner,
+                lease_segundos=self.lease_seconds,
+                express=False if self.express else None,
+            )
+            if documentos:
+                # Todo cargado y desconectado: las etapas siguientes no usan esta sesión
+                for doc in documentos:
+                    precargar(doc)
+                lotes = list(FacturaService.agrupar_en_lotes(documentos, self.batch_size))
+                db.expunge_all()
+
+        # Las colas pueden bloquear (backpressure): se llenan con la sesión ya cerrada
+        with self._contador_lock:
+            self._lotes_en_curso.update(trabajo["lote_id"] for trabajo in listos)
+        for trabajo in listos:
+            self.colas["envio"].put(trabajo)
+
+        if documentos:
+            self._contar("reclamo", len(documentos))
+        for emisor, tipo_doc, batch in lotes:
+            self.colas["firma"].put({
+                "emisor": emisor,
+                "tipo_documento": str(tipo_doc),
+                "documentos": batch,
+            })
+        # Sin documentos nuevos pero con lotes listos: seguir drenando
+        return len(documentos) + len(listos)
+
+    def _etapa_express(self):
+        """
+        Carril express: no comparte colas con los lotes, así un documento
+        de mostrador no espera detrás de la firma o el envío de un lote.
+        """
+        while not self._detener.is_set():
+            try:
+                with get_db_session() as db:
+                    resultado = ExpressService(db).procesar_express(
+                        owner=self.owner,
+                        lease_segundos=self.lease_seconds,
+                    )
+                procesados = resultado["total_procesados"]
+            except Exception as e:
+                logger.error(f"❌ Error en carril express: {e}")
+                procesados = 0
+
+            if procesados:
+                self._contar("express", procesados)
+            else:
+                self._detener.wait(settings.EXPRESS_INTERVALO)
+
+    def _etapa_firma(self):
+        for item in self._consumir("firma", self.hilos_firma, "armado"):
+            try:
+                documentos = self._renovar_documentos(item["documentos"])
+                if not documentos:
+                    continue
+                item["documentos"] = documentos
+                item["armados"] = dict(zip(
+                    (doc.id for doc in documentos),
+                    armar_documentos(documentos)
+                ))
+            except Exception as e:
+                # Siguen PENDIENTE_ENVIO con el lease de este worker: se
+                # reintentan cuando vence
+                logger.error(f"❌ Error firmando documentos en pipeline: {e}")
+                self._pausa_error()
+                continue
+            self._contar("firma", len(documentos))
+            self.colas["armado"].put(item)
+
+    def _renovar_documentos(self, documentos: list) -> list:
+        """Renueva el lease al salir de la cola; descarta los que ya no son de este worker"""
+        with get_db_session() as db:
+            propios = set(DocumentoRepo(db).renovarLease(
+                self.owner, [doc.id for doc in documentos], self.lease_seconds
+            ))
+        if len(propios) < len(documentos):
+            logger.warning(f"⚠️ {len(documentos) - len(propios)} documentos reclamados por otro worker, se descartan")
+        return [doc for doc in documentos if doc.id in propios]
+
+    def _etapa_armado(self):
+        for item in self._consumir("armado", 1, "envio"):
+            try:
+                trabajo = self._armar_lote(item)
+            except Exception as e:
+                # Tras el rollback siguen PENDIENTE_ENVIO con el lease de este
+                # worker: se reintentan cuando vence, no en el próximo reclamo
+                logger.error(f"❌ Error armando lote en pipeline: {e}")
+                self._pausa_error()
+                continue
+
+            if trabajo is not None:
+                with self._contador_lock:
+                    self._lotes_en_curso.add(trabajo["lote_id"])
+                self._contar("armado")
+                self.colas["envio"].put(trabajo)
+
+    def _armar_lote(self, item: dict) -> Optional[dict]:
+        ids = [doc.id for doc in item["documentos"]]
+        with get_db_session() as db:
+            service = FacturaService(db, unidad_trabajo=True)
+            trabajo = service.armar_lote(
+                documentos=item["documentos"],
+                tipo_documento=item["tipo_documento"],
+                emisor=db.merge(item["emisor"], load=False),
+                armados=item["armados"],
+                owner=self.owner,
+            )
+
+        try:
+            # Ya no están PENDIENTE_ENVIO (o no eran de este worker)
+            with get_db_session() as db:
+                DocumentoRepo(db).liberarLease(self.owner, ids)
+        except Exception as e:
+            # El lote ya quedó armado: se envía igual y el lease vence solo
+            logger.warning(f"⚠️ No se pudo liberar el lease de {len(ids)} documentos: {e}")
+        return trabajo
+
+    def _pausa_error(self):
+        """Espera antes de seguir tras un error; corta al detener el pipeline"""
+        self._detener.wait(_ESPERA_ERROR)
+
+    def _cupo_emisor(self, emisor_id) -> threading.BoundedSemaphore:
+        with self._cupos_lock:
+            cupo = self._cupos_emisor.get(emisor_id)
+            if cupo is None:
+                cupo = threading.BoundedSemaphore(self.max_por_emisor)
+                self._cupos_emisor[emisor_id] = cupo
+            return cupo
+
+    def _etapa_envio(self):
+        for trabajo in self._consumir("envio", self.hilos_envio, "persistencia"):
+            with self._cupo_emisor(trabajo["emisor_id"]):
+                if not self._iniciar_envio(trabajo):
+                    with self._contador_lock:
+                        self._lotes_en_curso.discard(trabajo["lote_id"])
+                    continue
+                try:
+                    respuesta, error = FacturaService.enviar_soap(trabajo), None
+                except Exception as e:
+                    respuesta, error = None, e
+            self._contar("envio")
+            self.colas["persistencia"].put((trabajo, respuesta, error))
+
+    def _iniciar_envio(self, trabajo: dict) -> bool:
+        """Renueva fecha_envio del lote al salir de la cola de envío"""
+        try:
+            with get_db_session() as db:
+                return FacturaService(db, unidad_trabajo=True).iniciar_envio(trabajo)
+        except Exception as e:
+            # Sin lease confirmado no se envía: el lote sigue LOTE_ARMADO y se reclama luego
+            logger.error(f"❌ No se pudo renovar el lease del lote {trabajo['lote_id']}: {e}")
+            return False
+
+    def _etapa_persistencia(self):
+        for trabajo, respuesta, error in self._consumir("persistencia", 1, None):
+            try:
+                with get_db_session() as db:
+                    resultado = FacturaService(db, unidad_trabajo=True).registrar_envio(trabajo, respuesta, error)
+                logger.info(f"📦 Lote {resultado['lote_id']}: {resultado['estado']}")
+                self._contar("persistencia")
+            except Exception as e:
+                logger.error(f"❌ Error persistiendo respuesta del lote {trabajo['lote_id']}: {e}")
+            finally:
+                with self._contador_lock:
+                    self._lotes_en_curso.discard(trabajo["lote_id"])
+        self._terminado.set()
@@ -2,13 +2,18 @@
 Worker de DemonSiffen - Proceso background para procesamiento de facturas
 """
 
-import time
+import os
+import socket
 import logging
 from typing import Optional
 from dataclasses import dataclass
 
 from core.infraestructure.database.database import get_db_session
+from core.infraestructure.database.notificaciones import EscuchaNotificaciones, CANAL_DOCUMENTO
+from core.infraestructure.soap import resiliencia
 from services.factura_service import FacturaService
+from services.express_service import ExpressService
+from daemon.pipeline import PipelineFacturas
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +24,11 @@ class WorkerConfig:
     batch_size: int = 50
     max_retries: int = 3
     debug: bool = False
+    claim_limit: int = 500      # Documentos reclamados por ciclo (SKIP LOCKED)
+    lease_seconds: int = 600    # Vigencia del lease sobre los documentos reclamados
+    worker_id: Optional[str] = None
+    pipeline: bool = False      # Etapas solapadas en lugar de ciclos (ver daemon/pipeline.py)
+    express: bool = False       # Carril express por rEnviDe antes de los lotes
 
 class SifenWorker:
     """Worker para procesamiento automático de facturas SIFEN"""
@@ -27,6 +37,8 @@ class SifenWorker:
         self.config = config or WorkerConfig()
         self.running = False
         self._service = None
+        self._pipeline = None
+        self._escucha = EscuchaNotificaciones([CANAL_DOCUMENTO])
         
     def setup(self):
         """Configura el worker con los servicios necesarios"""
@@ -48,11 +60,29 @@ class SifenWorker:
         
         if self.config.batch_size <= 0:
             raise ValueError("El batch_size debe ser mayor a 0")
+        
+        if self.config.claim_limit <= 0:
+            raise ValueError("El claim_limit debe ser mayor a 0")
+    
+    @property
+    def worker_id(self) -> str:
+        """Identificador del worker usado como owner del lease (host:pid)"""
+        return self.config.worker_id or f"{socket.gethostname()}:{os.getpid()}"
     
     def start(self):
         """Inicia el bucle de procesamiento"""
         self.running = True
-        logger.info("🚀 Iniciando SifenWorker...")
+        logger.info(f"🚀 Iniciando SifenWorker {self.worker_id}...")
+        
+        # Reintentos de la capa SOAP en este proceso (ver resiliencia.py)
+        resiliencia.configurar(max_reintentos=self.config.max_retries)
+        
+        # LISTEN antes del primer ciclo: no se pierde trabajo nuevo
+        self._escucha.iniciar()
+        
+        if self.config.pipeline:
+            self._start_pipeline()
+            return
         
         try:
             while self.running:
@@ -61,8 +91,8 @@ class SifenWorker:
                 if not self.running:
                     break
                     
-                logger.info(f"⏳ Esperando {self.config.interval} segundos...")
-                time.sleep(self.config.interval)
+                logger.info(f"⏳ Esperando trabajo (máx. {self.config.interval} segundos)...")
+                self._escucha.esperar(self.config.interval)
                 
         except KeyboardInterrupt:
             logger.info("🛑 Interrupción recibida")
@@ -72,17 +102,63 @@ class SifenWorker:
         finally:
             self.stop()
     
+    def _start_pipeline(self):
+        """Ejecuta el pipeline por etapas hasta que se detenga el worker"""
+        self._pipeline = PipelineFacturas(
+            owner=self.worker_id,
+            batch_size=self.config.batch_size,
+            claim_limit=self.config.claim_limit,
+            lease_seconds=self.config.lease_seconds,
+            escucha=self._escucha,
+            interval=self.config.interval,
+            express=self.config.express
+        )
+        
+        try:
+            self._pipeline.iniciar()
+            while self.running and not self._pipeline.esperar(timeout=5):
+                pass
+                
+        except KeyboardInterrupt:
+            logger.info("🛑 Interrupción recibida")
+        except Exception as e:
+            logger.error(f"❌ Error fatal en pipeline: {e}")
+            raise
+        finally:
+            self.stop()
+    
     def _process_cycle(self):
         """Ejecuta un ciclo completo de procesamiento"""
         logger.info("📋 Iniciando ciclo de procesamiento...")
         
         with get_db_session() as db:
             try:
+                # Carril express primero: son los que esperan en mostrador
+                if self.config.express:
+                    express = ExpressService(db).procesar_express(
+                        owner=self.worker_id,
+                        lease_segundos=self.config.lease_seconds
+                    )
+                    if express["total_procesados"]:
+                        logger.info(f"⚡ Express: {express['total_procesados']} documentos enviados por rEnviDe")
+                
                 # Crear servicio con configuración actual
                 service = FacturaService(db)
                 
+                # Spool de contingencia primero: son los lotes firmados más viejos
+                service.drenar_contingencia()
+                
+                # Reenviar lotes que quedaron armados sin enviar (caída del proceso)
+                service.reintentar_lotes_armados()
+                
                 # Procesar documentos pendientes
-                result = service.procesar_pendientes(batch_size=self.config.batch_size)
+                result = service.procesar_pendientes(
+                    batch_size=self.config.batch_size,
+                    owner=self.worker_id,
+                    limite=self.config.claim_limit,
+                    lease_segundos=self.config.lease_seconds,
+                    express=False if self.config.express else None
+                )
                 
                 # Log de resultados
                 self._log_results(result)
@@ -119,6 +195,11 @@ class SifenWorker:
         if self._service:
             self._service = None
         
+        if self._pipeline:
+            logger.info("⏳ Vaciando colas del pipeline...")
+            self._pipeline.detener()
+        
+        self._escucha.cerrar()
         logger.info("✅ Worker detenido")
     
     def process_once(self):
@@ -136,10 +217,16 @@ class SifenWorker:
         """Retorna el estado actual del worker"""
         return {
             "running": self.running,
+            "worker_id": self.worker_id,
+            "pipeline": self._pipeline.get_status() if self._pipeline else None,
             "config": {
                 "interval": self.config.interval,
                 "batch_size": self.config.batch_size,
                 "max_retries": self.config.max_retries,
-                "debug": self.config.debug
+                "debug": self.config.debug,
+                "claim_limit": self.config.claim_limit,
+                "lease_seconds": self.config.lease_seconds,
+                "pipeline": self.config.pipeline,
+                "express": self.config.express
             }
         }
\ No newline at end of file
@@ -29,6 +29,11 @@ class Documento(Base):
     #iIndPres = Column(Integer)
     #dDesIndPres = Column(String(20))
     xml_de = Column(TEXT)
+    # Lease de procesamiento (claim concurrente entre workers)
+    lease_owner = Column(String(100))
+    lease_expira = Column(TIMESTAMP)
+    # Carril express: envío síncrono por rEnviDe en lugar de lote
+    express = Column(Boolean, default=False)
 
     # Relaciones 
     emisor = relationship("Emisor", back_populates="documentos") 
@@ -122,6 +127,7 @@ class Emisor(Base):
     cert_path = Column(String(255), nullable=False)
     key_path = Column(String(255), nullable=False)
     passwrd = Column(String(255),nullable=False)
+    express = Column(Boolean, default=False)  # todos sus documentos por el carril express
 
     documentos = relationship("Documento", back_populates="emisor", cascade="all, delete-orphan")
     actividades = relationship("EmisorActividad", back_populates="emisor")
@@ -477,6 +483,9 @@ class Lote(Base):
     xml_request = Column(Text)
     xml_response = Column(Text)
     tipo_documento = Column(String(10))
+    # Planificación de consultas de estado (backoff mientras SIFEN procesa)
+    next_check_at = Column(TIMESTAMP)
+    intentos_consulta = Column(Integer, default=0)
 
     emisor = relationship("Emisor")
     documentos = relationship("LoteDocumento", back_populates="lote")
@@ -488,6 +497,10 @@ class LoteDocumento(Base):
     id = Column(Integer, primary_key=True)
     lote_id = Column(Integer, ForeignKey("de_lote.id", ondelete="CASCADE"), nullable=False)
     documento_id = Column(Integer, ForeignKey("de_documento.id", ondelete="CASCADE"), nullable=False)
+    # Resultado SIFEN del documento dentro del lote
+    estado_resultado = Column(String(30))
+    codigo_error = Column(String(10))
+    mensaje_error = Column(String(500))
 
     lote = relationship("Lote", back_populates="documentos")
     documento = relationship("Documento", back_populates="lotes")
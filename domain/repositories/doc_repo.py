@@ -1,10 +1,12 @@
+from datetime import timedelta
 from typing import Any, Dict, List
 import logging
 from venv import logger
 
-from sqlalchemy import String, cast
+from sqlalchemy import String, and_, bindparam, cast, func, or_, select, update
 from domain.models.models import Documento, Emisor, Timbrado # Asegúrate de importar Timbrado
-from sqlalchemy.orm import joinedload
+from domain.repositories.identidad_cache import identidad_cache
+from sqlalchemy.orm import joinedload, selectinload
 from config.setting import limite
 
 class DocumentoRepo:
@@ -12,21 +14,29 @@ class DocumentoRepo:
         self.db = db
         
 
-    def getPendiente(self):
-        # 1. Consulta inicial para obtener los documentos sin cargar Emisor y Timbrado
-        # Removemos las opciones joinedload para Timbrado y Emisor
-        docs = (
+    def _queryPendientes(self):
+        """Consulta base de documentos con las relaciones necesarias para armar el XML"""
+        # Emisor y Timbrado se resuelven con identidad_cache; las colecciones
+        # van con selectinload para no multiplicar filas en el JOIN
+        return (
             self.db.query(Documento)
             .options(
                 joinedload(Documento.operacion),
-                joinedload(Documento.items),
                 joinedload(Documento.totales),
                 joinedload(Documento.operacion_comercial),
-                joinedload(Documento.estados),
                 joinedload(Documento.receptor),
-                joinedload(Documento.emisor),
-                joinedload(Documento.timbrado),
+                selectinload(Documento.items),
+                selectinload(Documento.estados),
+                selectinload(Documento.complementos),
+                selectinload(Documento.nota_credito_debito),
             )
+        )
+
+    def getPendiente(self):
+        # 1. Consulta inicial para obtener los documentos sin cargar Emisor y Timbrado
+        # Removemos las opciones joinedload para Timbrado y Emisor
+        docs = (
+            self._queryPendientes()
             .filter(
                 Documento.estado_actual == "PENDIENTE_ENVIO",
             )
@@ -35,53 +45,203 @@ class DocumentoRepo:
             .all()
         )
 
-        # 2. Iterar sobre los documentos para cargar Emisor y Timbrado por ID
-        for doc in docs:
-            
-            # --- Cargar Timbrado por ID ---
-            # Asume que Documento tiene un campo 'idtimbrado'
-            id_timbrado = doc.idtimbrado 
-            if id_timbrado:
-                # Consulta para buscar el Timbrado por su ID
-                doc.timbrado = self.db.query(Timbrado).filter(Timbrado.id == id_timbrado).first()
-            else:
-                doc.timbrado = None
-                
-            # --- Cargar Emisor por ID ---
-            # Asume que Documento tiene un campo 'idemisor'
-            drucem = doc.drucem 
-            if drucem:
-                # Consulta para buscar el Emisor por su ID
-                # También cargamos sus actividades, ya que eran parte de la carga inicial
-                doc.emisor = (
-                    self.db.query(Emisor)
-                    .options(joinedload(Emisor.actividades))
-                    .filter(Emisor.drucem == drucem)
-                    .first()
-                )
-            else:
-                doc.emisor = None
+        return self._cargarEmisorTimbrado(docs)
 
-            # Lógica original: Acceso a la relación nota_credito_debito si aplica
-            if doc.timbrado and doc.timbrado.itide == 5: 
-                # Esto fuerza la carga perezosa (lazy load) de la relación si no está joinedload
-                _ = doc.nota_credito_debito 
-        
-        return docs
+    def claimPendientes(self, limite: int, owner: str, lease_segundos: int = 600, express: bool = None):
+        """
+        Reclama de forma atómica hasta `limite` documentos PENDIENTE_ENVIO.
 
-    def masiveSetState(self,data: List[Dict[str, Any]],state):
-        for doc in data:
-            documento =self.db.query(Documento).filter(Documento.id==doc["documento_id"]).first()
-            documento.estado_actual = state
-            
+        Usa SELECT ... FOR UPDATE SKIP LOCKED para que varios workers (en
+        distintos procesos o hosts) no tomen los mismos CDC, y estampa un
+        lease (owner + vencimiento) con el reloj de la BD. Un documento con
+        lease vigente no vuelve a ser reclamado hasta que venza.
+        `express` True reclama solo el carril express, False lo excluye y
+        None no filtra.
+        """
+        query = (
+            self.db.query(Documento.id)
+            .filter(
+                Documento.estado_actual == "PENDIENTE_ENVIO",
+                or_(Documento.lease_expira == None, Documento.lease_expira < func.now()),
+            )
+        )
+        if express is not None:
+            es_express = self._filtroExpress()
+            query = query.filter(es_express if express else ~es_express)
+
+        filas = (
+            query
+            .order_by(Documento.id.asc())
+            .limit(limite)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        ids = [fila.id for fila in filas]
+
+        if not ids:
+            self.db.commit()  # cerrar la transacción del SELECT FOR UPDATE
+            return []
+
+        self.db.query(Documento).filter(Documento.id.in_(ids)).update(
+            {
+                Documento.lease_owner: owner,
+                Documento.lease_expira: func.now() + timedelta(seconds=lease_segundos),
+            },
+            synchronize_session=False,
+        )
+        self.db.commit()
+        logger.info(f"{owner} reclamó {len(ids)} documentos pendientes")
+
+        docs = (
+            self._queryPendientes()
+            .filter(Documento.id.in_(ids))
+            .order_by(Documento.id.asc())
+            .all()
+        )
+        return self._cargarEmisorTimbrado(docs)
+
+    def _filtroExpress(self):
+        """Documento marcado express o de un emisor express (el emisor se resuelve por drucem)"""
+        emisores_express = select(Emisor.drucem).where(Emisor.express.is_(True))
+        # Sin NULLs: la negación debe seguir siendo verdadera para el carril de lotes
+        return or_(
+            Documento.express.is_(True),
+            and_(Documento.drucem.isnot(None), Documento.drucem.in_(emisores_express)),
+        ).self_group()
+
+    def liberarLease(self, owner: str, ids: List[int]):
+        """Libera el lease de los documentos reclamados por `owner`"""
+        if not ids:
+            return 0
+        liberados = self.db.query(Documento).filter(
+            Documento.id.in_(ids),
+            Documento.lease_owner == owner,
+        ).update(
+            {Documento.lease_owner: None, Documento.lease_expira: None},
+            synchronize_session=False,
+        )
         self.db.commit()
+        return liberados
+
+    def renovarLease(self, owner: str, ids: List[int], lease_segundos: int = 600) -> List[int]:
+        """
+        Extiende el lease de los documentos que `owner` todavía tiene
+        reclamados y siguen PENDIENTE_ENVIO. Retorna esos ids: el resto ya
+        lo tomó otro worker o cambió de estado.
+        """
+        if not ids:
+            return []
+        renovados = self.db.execute(
+            update(Documento)
+            .where(
+                Documento.id.in_(ids),
+                Documento.lease_owner == owner,
+                Documento.estado_actual == "PENDIENTE_ENVIO",
+            )
+            .values(lease_expira=func.now() + timedelta(seconds=lease_segundos))
+            .returning(Documento.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        self.db.commit()
+        return renovados
+
+    def bloquearReclamados(self, owner: str, ids: List[int]) -> List[int]:
+        """
+        Bloquea (FOR UPDATE, hasta el commit del llamador) los documentos que
+        `owner` tiene reclamados y siguen PENDIENTE_ENVIO, y retorna sus ids.
+        Las escrituras por id que siguen en la misma transacción quedan
+        protegidas: otro worker no puede reclamarlos hasta el commit.
+        """
+        if not ids:
+            return []
+        filas = (
+            self.db.query(Documento.id)
+            .filter(
+                Documento.id.in_(ids),
+                Documento.lease_owner == owner,
+                Documento.estado_actual == "PENDIENTE_ENVIO",
+            )
+            .with_for_update()
+            .all()
+        )
+        return [fila.id for fila in filas]
+
+    def _cargarEmisorTimbrado(self, docs):
+        """Carga Emisor (por drucem) y Timbrado (por idtimbrado) de todo el lote"""
+        return identidad_cache.resolver(self.db, docs)
+
+    # Campos admitidos por bulkSetEstados -> columna de de_documento
+    _CAMPOS_BULK = {
+        "estado": "estado_actual",
+        "prot_aut": "prot_aut",
+        "cod_res": "cod_res",
+        "msg_res": "msg_res",
+        # Resultado del armado puro del XML (XMLBuilder sin sesión)
+        "cdc_de": "cdc_de",
+        "ddvid": "ddvid",
+        "dfecfirma": "dfecfirma",
+        "xml_de": "xml_de",
+    }
+
+    def bulkSetEstados(self, cambios: List[Dict[str, Any]], por: str = "id", commit: bool = True):
+        """
+        Aplica transiciones de estado en bloque.
+
+        Cada cambio es un dict con la clave del documento ("id" o "cdc",
+        según `por`) y los campos a actualizar: estado, prot_aut, cod_res,
+        msg_res. Las filas que actualizan los mismos campos se envían en un
+        único UPDATE executemany y se hace un solo commit al final.
+        Los objetos ya cargados en la sesión no se sincronizan.
+        """
+        if por not in ("id", "cdc"):
+            raise ValueError(f"Clave de documento no soportada: {por}")
+        if not cambios:
+            return 0
+
+        tabla = Documento.__table__
+        columna_clave = tabla.c.id if por == "id" else tabla.c.cdc_de
+
+        grupos = {}
+        for cambio in cambios:
+            campos = tuple(sorted(c for c in cambio if c in self._CAMPOS_BULK))
+            if campos:
+                grupos.setdefault(campos, []).append(cambio)
+
+        for campos, filas in grupos.items():
+            stmt = (
+                update(tabla)
+                .where(columna_clave == bindparam("b_clave"))
+                .values({self._CAMPOS_BULK[c]: bindparam(f"b_{c}") for c in campos})
+            )
+            self.db.execute(stmt, [
+                {"b_clave": fila[por], **{f"b_{c}": fila[c] for c in campos}}
+                for fila in filas
+            ])
+
+        if commit:
+            self.db.commit()
+        return len(cambios)
+
+    def bulkSetFirmas(self, firmas: List[Dict[str, Any]], commit: bool = True):
+        """
+        Persiste en bloque cdc_de, ddvid, dfecfirma y xml_de calculados
+        fuera de la sesión. Cada elemento lleva "id" y esos campos.
+        """
+        return self.bulkSetEstados(firmas, por="id", commit=commit)
+
+    def masiveSetState(self,data: List[Dict[str, Any]],state):
+        self.bulkSetEstados(
+            [{"id": doc["documento_id"], "estado": state} for doc in data]
+        )
         
     
     def newEstado(self, id_doc,estado_nuevo):
-        doc = self.db.query(Documento).filter(Documento.id == id_doc).first()
-        if not doc:
+        actualizados = self.db.query(Documento).filter(Documento.id == id_doc).update(
+            {Documento.estado_actual: estado_nuevo},
+            synchronize_session=False,
+        )
+        if not actualizados:
             return None
-        doc.estado_actual = estado_nuevo
         self.db.commit()
         return f'Success'
     
@@ -99,14 +259,13 @@ class DocumentoRepo:
                     self.db.query(Documento)
                     .options(
                         joinedload(Documento.operacion),
-                        joinedload(Documento.items),
-                        joinedload(Documento.emisor),
-                        joinedload(Documento.timbrado),
                         joinedload(Documento.totales),
                         joinedload(Documento.operacion_comercial),
-                        joinedload(Documento.estados),
                         joinedload(Documento.receptor),
                         joinedload(Documento.complementos),
+                        selectinload(Documento.items),
+                        selectinload(Documento.estados),
+                        selectinload(Documento.nota_credito_debito),
                     ).filter(Documento.id == id).first()
                 )
         
@@ -114,49 +273,26 @@ class DocumentoRepo:
         if not doc:
             return None
         
-        id_timbrado = doc.idtimbrado 
-        if id_timbrado:
-            # Consulta para buscar el Timbrado por su ID
-            doc.timbrado = self.db.query(Timbrado).filter(Timbrado.id == id_timbrado).first()
-        else:
-            doc.timbrado = None
-            
-        # --- Cargar Emisor por ID ---
-        # Asume que Documento tiene un campo 'idemisor'
-        drucem = doc.drucem 
-        if drucem:
-            # Consulta para buscar el Emisor por su ID
-            # También cargamos sus actividades, ya que eran parte de la carga inicial
-            doc.emisor = (
-                self.db.query(Emisor)
-                .options(joinedload(Emisor.actividades))
-                .filter(Emisor.drucem == drucem)
-                .first()
-            )
-        else:
-            doc.emisor = None
-
-        # Lógica original: Acceso a la relación nota_credito_debito si aplica
-        if doc.timbrado and doc.timbrado.itide == 5: 
-            # Esto fuerza la carga perezosa (lazy load) de la relación si no está joinedload
-            _ = doc.nota_credito_debito 
+        # Emisor (por drucem) y Timbrado (por id) desde la cache de identidades
+        self._cargarEmisorTimbrado([doc])
     
         return doc
 
     def loadEstRes(self, data: dict):
         try:
-            for detalle in data["detalles"]:
-                doc = self.db.query(Documento).filter(
-                    Documento.cdc_de == detalle["cdc"]
-                ).first()
-
-                if doc:
-                    doc.estado_actual = detalle["est_res"]
-                    doc.prot_aut = detalle["prot_aut"]
-                    doc.cod_res = detalle["cod_res"]
-                    doc.msg_res = detalle["msg_res"]
-
-            self.db.commit()
+            self.bulkSetEstados(
+                [
+                    {
+                        "cdc": detalle["cdc"],
+                        "estado": detalle["est_res"],
+                        "prot_aut": detalle["prot_aut"],
+                        "cod_res": detalle["cod_res"],
+                        "msg_res": detalle["msg_res"],
+                    }
+                    for detalle in data["detalles"]
+                ],
+                por="cdc",
+            )
             logger.info(f"Estados actualizados para {len(data['detalles'])} documentos")
         except Exception as e:
             self.db.rollback()
@@ -191,12 +327,10 @@ class DocumentoRepo:
         docs = (
             self.db.query(Documento)
             .options(
-                joinedload(Documento.emisor),
-                joinedload(Documento.timbrado),
                 joinedload(Documento.receptor),
-                joinedload(Documento.items),
                 joinedload(Documento.totales),
                 joinedload(Documento.operacion),
+                selectinload(Documento.items),
             )
             .filter(
                 Documento.estado_actual == "Aprobado",
@@ -207,26 +341,8 @@ class DocumentoRepo:
             .all()
         )
 
-        # Cargar Timbrado y Emisor por ID
-        for doc in docs:
-            id_timbrado = doc.idtimbrado 
-            if id_timbrado:
-                doc.timbrado = self.db.query(Timbrado).filter(Timbrado.id == id_timbrado).first()
-            else:
-                doc.timbrado = None
-                
-            drucem = doc.drucem 
-            if drucem:
-                doc.emisor = (
-                    self.db.query(Emisor)
-                    .options(joinedload(Emisor.actividades))
-                    .filter(Emisor.drucem == drucem)
-                    .first()
-                )
-            else:
-                doc.emisor = None
-        
-        return docs
+        # Cargar Timbrado y Emisor de todo el batch desde la cache de identidades
+        return self._cargarEmisorTimbrado(docs)
     
     def marcarPDFGenerado(self, id_doc):
         """Marca un documento como PDF generado"""
@@ -0,0 +1,155 @@
+"""
+Cache en proceso de Emisor y Timbrado para los repositorios de documentos.
+
+Un ciclo de procesamiento suele tocar pocos emisores y timbrados, por lo que
+en lugar de consultarlos por cada documento se resuelven todos los del lote
+con una consulta por entidad y se conservan en memoria hasta que vence el
+TTL o se invalida la cache.
+
+La invalidación es compartida: un trigger incrementa de_identidad_version
+ante cualquier cambio en de_emisor, de_emisor_actividad o de_timbrado
+(p. ej. un cert_path rotado) y cada proceso compara esa versión, a lo sumo
+cada IDENTIDAD_CACHE_VERIFICAR segundos, antes de usar sus entradas.
+"""
+
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+
+from core.infraestructure.database.database import SessionLocal
+from domain.models.models import Documento, Emisor, Timbrado
+from config.setting import settings
+from config.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class IdentidadCache:
+    """
+    Mapa de identidades Emisor (por drucem) y Timbrado (por id).
+
+    Las instancias se cargan en una sesión propia y quedan desacopladas de
+    ella; cada sesión que las usa recibe su copia con merge(load=False), que
+    no emite SQL. La cache se invalida por TTL o cuando cambia la versión
+    compartida (`version` es la última vista por este proceso).
+    """
+
+    def __init__(self, ttl: int = 300, verificar: float = 5):
+        self.ttl = ttl
+        self.verificar = verificar
+        self.version: Optional[int] = None
+        self._verificada = float("-inf")
+        self._emisores: Dict[str, Tuple[float, Emisor]] = {}
+        self._timbrados: Dict[int, Tuple[float, Timbrado]] = {}
+        self._lock = threading.Lock()
+
+    def invalidar(self, version: Optional[int] = None):
+        """Descarta todas las entradas (p. ej. tras cambiar un certificado)"""
+        with self._lock:
+            self._emisores.clear()
+            self._timbrados.clear()
+            self.version = version
+        logger.info(f"Cache de identidades invalidada (versión {version})")
+
+    @staticmethod
+    def _version_compartida() -> Optional[int]:
+        """Versión de de_identidad_version; None si no se puede leer"""
+        try:
+            with SessionLocal() as sesion:
+                return sesion.execute(text("SELECT version FROM de_identidad_version WHERE id = 1")).scalar()
+        except SQLAlchemyError as e:
+            logger.warning(f"⚠️ No se pudo leer la versión de identidades, solo TTL: {e}")
+            return None
+
+    def _verificar_version(self, ahora: float):
+        """Invalida si otro proceso (o un cambio en la BD) movió la versión"""
+        with self._lock:
+            if ahora - self._verificada < self.verificar:
+                return
+            self._verificada = ahora
+        version = self._version_compartida()
+        if version is not None and version != self.version:
+            if self.version is None:
+                with self._lock:
+                    self.version = version    # primera lectura: no hay nada viejo que descartar
+            else:
+                self.invalidar(version)
+
+    def _faltantes(self, cache: dict, claves: Iterable, ahora: float) -> set:
+        return {
+            clave for clave in claves
+            if clave not in cache or ahora - cache[clave][0] >= self.ttl
+        }
+
+    def _cargar(self, drucems: set, ids_timbrado: set, ahora: float):
+        """Carga emisores y timbrados faltantes: una consulta por entidad"""
+        with SessionLocal() as sesion:
+            emisores = []
+            timbrados = []
+            if drucems:
+                emisores = (
+                    sesion.query(Emisor)
+                    .options(joinedload(Emisor.actividades))
+                    .filter(Emisor.drucem.in_(drucems))
+                    .all()
+                )
+            if ids_timbrado:
+                timbrados = (
+                    sesion.query(Timbrado)
+                    .filter(Timbrado.id.in_(ids_timbrado))
+                    .all()
+                )
+            sesion.expunge_all()
+
+        with self._lock:
+            for emisor in emisores:
+                self._emisores[emisor.drucem] = (ahora, emisor)
+            for timbrado in timbrados:
+                self._timbrados[timbrado.id] = (ahora, timbrado)
+
+    def resolver(self, db, docs: Iterable[Documento]):
+        """
+        Asigna doc.emisor y doc.timbrado a cada documento usando la cache.
+        Solo consulta la BD por las identidades que no están o vencieron.
+        """
+        docs = list(docs)
+        ahora = time.monotonic()
+        self._verificar_version(ahora)
+        drucems = {doc.drucem for doc in docs if doc.drucem}
+        ids_timbrado = {doc.idtimbrado for doc in docs if doc.idtimbrado}
+
+        with self._lock:
+            faltan_emisores = self._faltantes(self._emisores, drucems, ahora)
+            faltan_timbrados = self._faltantes(self._timbrados, ids_timbrado, ahora)
+
+        if faltan_emisores or faltan_timbrados:
+            self._cargar(faltan_emisores, faltan_timbrados, ahora)
+
+        # Copias locales a la sesión, una por identidad
+        locales_emisor = {}
+        locales_timbrado = {}
+        with self._lock:
+            for drucem in drucems:
+                entrada = self._emisores.get(drucem)
+                if entrada:
+                    locales_emisor[drucem] = db.merge(entrada[1], load=False)
+            for id_timbrado in ids_timbrado:
+                entrada = self._timbrados.get(id_timbrado)
+                if entrada:
+                    locales_timbrado[id_timbrado] = db.merge(entrada[1], load=False)
+
+        for doc in docs:
+            # set_committed_value no marca cambios: no genera UPDATE en el flush
+            set_committed_value(doc, "emisor", locales_emisor.get(doc.drucem))
+            set_committed_value(doc, "timbrado", locales_timbrado.get(doc.idtimbrado))
+
+        return docs
+
+
+# Instancia compartida por proceso
+identidad_cache = IdentidadCache(ttl=settings.IDENTIDAD_CACHE_TTL, verificar=settings.IDENTIDAD_CACHE_VERIFICAR)
@@ -1,9 +1,11 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, func, insert, or_, update
+from sqlalchemy.orm import Session, joinedload
 from sqlalchemy.exc import SQLAlchemyError
-from typing import List, Optional, Dict, Any
-from datetime import datetime
+from typing import Collection, List, Optional, Dict, Any
+from datetime import datetime, timedelta
 import logging
 from domain.models.models import Lote, LoteDocumento, Documento
+from domain.repositories.doc_repo import DocumentoRepo
 
 logger = logging.getLogger(__name__)
 
@@ -11,15 +13,20 @@ class LoteRepository:
     def __init__(self, db: Session):
         self.db = db
     
-    def crear_lote(self, lote_data: Dict[str, Any]) -> Lote:
+    def crear_lote(self, lote_data: Dict[str, Any], commit: bool = True) -> Lote:
         """
-        Crea un nuevo lote
+        Crea un nuevo lote.
+        Con commit=False solo hace flush (para obtener el ID) y deja la
+        transacción abierta para la unidad de trabajo del llamador.
         """
         try:
             lote = Lote(**lote_data)
             self.db.add(lote)
-            self.db.commit()
-            self.db.refresh(lote)
+            if commit:
+                self.db.commit()
+                self.db.refresh(lote)
+            else:
+                self.db.flush()
             logger.info(f"Lote creado con ID: {lote.id}")
             return lote
         except SQLAlchemyError as e:
@@ -32,7 +39,8 @@ class LoteRepository:
         Obtiene un lote por su ID
         """
         try:
-            return self.db.query(Lote).filter(Lote.id == lote_id).first()
+            # get() usa el identity map de la sesión antes de ir a la BD
+            return self.db.get(Lote, lote_id)
         except SQLAlchemyError as e:
             logger.error(f"Error al obtener lote {lote_id}: {str(e)}")
             raise
@@ -49,18 +57,20 @@ class LoteRepository:
             logger.error(f"Error al obtener lote {nro_lote}: {str(e)}")
             raise
     
-    def actualizar_lote(self, lote_id: int, update_data: Dict[str, Any]) -> Optional[Lote]:
+    def actualizar_lote(self, lote_id: int, update_data: Dict[str, Any], commit: bool = True) -> Optional[Lote]:
         """
         Actualiza un lote existente
         """
         try:
             lote = self.obtener_lote_por_id(lote_id)
             if lote:
+                # fecha_envio ya no se pisa en cada actualización: el
+                # planificador de consultas ordena por ella (más antiguo primero)
                 for key, value in update_data.items():
                     setattr(lote, key, value)
-                lote.fecha_envio = datetime.now()
-                self.db.commit()
-                self.db.refresh(lote)
+                if commit:
+                    self.db.commit()
+                    self.db.refresh(lote)
                 logger.info(f"Lote {lote_id} actualizado")
             return lote
         except SQLAlchemyError as e:
@@ -112,6 +122,185 @@ class LoteRepository:
             logger.error(f"Error al listar lotes por estado {estado}: {str(e)}")
             raise
     
+    def listar_lotes_para_consulta(self, estado: str, limit: int = 100) -> List[Lote]:
+        """
+        Lotes cuya próxima consulta ya venció (next_check_at <= ahora o sin
+        programar), del envío más antiguo al más nuevo
+        """
+        try:
+            return (
+                self.db.query(Lote)
+                .options(joinedload(Lote.emisor))
+                .filter(
+                    Lote.estado == estado,
+                    # next_check_at se escribe con el reloj de la aplicación
+                    or_(Lote.next_check_at.is_(None), Lote.next_check_at <= datetime.now()),
+                )
+                .order_by(Lote.fecha_envio.asc(), Lote.id.asc())
+                .limit(limit)
+                .all()
+            )
+        except SQLAlchemyError as e:
+            logger.error(f"Error al listar lotes para consulta {estado}: {str(e)}")
+            raise
+    
+    def proxima_consulta(self, estado: str) -> Optional[datetime]:
+        """Fecha de la próxima consulta programada (None si no hay lotes)"""
+        return self.db.query(func.min(Lote.next_check_at)).filter(Lote.estado == estado).scalar()
+    
+    def programar_consultas(self, cambios: List[Dict[str, Any]], commit: bool = True) -> int:
+        """
+        Actualiza en bloque estado, next_check_at e intentos_consulta.
+        Cada cambio lleva "id" y los tres campos.
+        """
+        if not cambios:
+            return 0
+        try:
+            tabla = Lote.__table__
+            self.db.execute(
+                update(tabla)
+                .where(tabla.c.id == bindparam("b_id"))
+                .values(
+                    estado=bindparam("b_estado"),
+                    next_check_at=bindparam("b_next_check_at"),
+                    intentos_consulta=bindparam("b_intentos"),
+                ),
+                [
+                    {
+                        "b_id": c["id"],
+                        "b_estado": c["estado"],
+                        "b_next_check_at": c["next_check_at"],
+                        "b_intentos": c["intentos_consulta"],
+                    }
+                    for c in cambios
+                ],
+            )
+            if commit:
+                self.db.commit()
+            return len(cambios)
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            logger.error(f"Error al programar consultas de lotes: {str(e)}")
+            raise
+    
+    def reclamar_lotes_armados(self, antiguedad_segundos: int = 300, limit: int = 20,
+                               excluir: Collection[int] = ()) -> List[Lote]:
+        """
+        Reclama lotes que quedaron en LOTE_ARMADO sin enviarse (p. ej. el
+        proceso cayó entre el commit del lote y el envío). Usa SKIP LOCKED y
+        renueva fecha_envio, que actúa como lease para otros workers.
+        `excluir`: lotes que el llamador ya tiene en curso (no se tocan).
+        """
+        try:
+            limite_fecha = datetime.now() - timedelta(seconds=antiguedad_segundos)
+            query = self.db.query(Lote).filter(
+                Lote.estado == "LOTE_ARMADO",
+                Lote.fecha_envio < limite_fecha,
+            )
+            if excluir:
+                query = query.filter(Lote.id.notin_(list(excluir)))
+            lotes = (
+                query
+                .order_by(Lote.id.asc())
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            for lote in lotes:
+                lote.fecha_envio = datetime.now()
+            self.db.commit()
+            if lotes:
+                logger.info(f"{len(lotes)} lotes armados reclamados para reenvío")
+            return lotes
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            logger.error(f"Error al reclamar lotes armados: {str(e)}")
+            raise
+    
+    def renovar_lease(self, lote_id: int, lease: datetime) -> Optional[datetime]:
+        """
+        Renueva fecha_envio de un lote LOTE_ARMADO justo antes de enviarlo,
+        solo si sigue siendo `lease` (el valor que vio este worker). Retorna
+        el nuevo lease, o None si otro worker ya lo reclamó o dejó de estar armado.
+        """
+        try:
+            ahora = datetime.now()
+            renovados = self.db.execute(
+                update(Lote)
+                .where(
+                    Lote.id == lote_id,
+                    Lote.estado == "LOTE_ARMADO",
+                    Lote.fecha_envio == lease,
+                )
+                .values(fecha_envio=ahora)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            self.db.commit()
+            return ahora if renovados else None
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            logger.error(f"Error al renovar lease del lote {lote_id}: {str(e)}")
+            raise
+    
+    def reclamar_lotes_contingencia(self, limit: int = 100, excluir: Collection[int] = ()) -> List[Lote]:
+        """
+        Reclama lotes del spool de contingencia (LOTE_CONTINGENCIA: firmados,
+        nunca enviados) con SKIP LOCKED. Pasan a LOTE_ARMADO con fecha_envio
+        actual: si el proceso cae durante el envío, reclamar_lotes_armados
+        los recupera como a cualquier lote armado. `excluir` como en
+        reclamar_lotes_armados.
+        """
+        try:
+            query = self.db.query(Lote).filter(Lote.estado == "LOTE_CONTINGENCIA")
+            if excluir:
+                query = query.filter(Lote.id.notin_(list(excluir)))
+            lotes = (
+                query
+                .options(joinedload(Lote.emisor))
+                .order_by(Lote.id.asc())
+                .limit(limit)
+                .with_for_update(skip_locked=True, of=Lote)
+                .all()
+            )
+            ahora = datetime.now()
+            for lote in lotes:
+                lote.estado = "LOTE_ARMADO"
+                lote.fecha_envio = ahora
+            self.db.commit()
+            if lotes:
+                logger.info(f"{len(lotes)} lotes de contingencia reclamados para envío")
+            return lotes
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            logger.error(f"Error al reclamar lotes de contingencia: {str(e)}")
+            raise
+    
+    def contar_lotes(self, estado: str) -> int:
+        """Cantidad de lotes en un estado (tamaño del spool de contingencia)"""
+        return self.db.query(func.count(Lote.id)).filter(Lote.estado == estado).scalar()
+    
+    def actualizar_estado_lotes(self, lote_ids: List[int], estado: str, commit: bool = True) -> int:
+        """
+        Cambia el estado de varios lotes con un único UPDATE
+        """
+        if not lote_ids:
+            return 0
+        try:
+            actualizados = self.db.execute(
+                update(Lote)
+                .where(Lote.id.in_(lote_ids))
+                .values(estado=estado)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if commit:
+                self.db.commit()
+            logger.info(f"{actualizados} lotes actualizados a {estado}")
+            return actualizados
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            logger.error(f"Error al actualizar estado de lotes: {str(e)}")
+            raise
+    
     def eliminar_lote(self, lote_id: int) -> bool:
         """
         Elimina un lote (y sus documentos relacionados por cascade)
@@ -134,63 +323,40 @@ class LoteDocumentoRepository:
     def __init__(self, db: Session):
         self.db = db
     
-    def agregar_documento_a_lote(self, lote_id: int, documento_id: int) -> LoteDocumento:
+    def agregar_documento_a_lote(self, lote_id: int, documento_id: int) -> int:
         """
-        Agrega un documento a un lote
+        Agrega un documento a un lote (ver agregar_documentos_a_lote)
         """
-        try:
-            lote_documento = LoteDocumento(
-                lote_id=lote_id,
-                documento_id=documento_id,
-            )
-            self.db.add(lote_documento)
-            self.db.commit()
-            self.db.refresh(lote_documento)
-            
-            # Actualizar estado del documento
-            documento = self.db.query(Documento).filter(
-                Documento.id == documento_id
-            ).first()
-            if documento:
-                documento.estado_actual = 'EN_PROCESO_LOTE'
-                self.db.commit()
-            
-            logger.info(f"Documento {documento_id} agregado al lote {lote_id}")
-            return lote_documento
-        except SQLAlchemyError as e:
-            self.db.rollback()
-            logger.error(f"Error al agregar documento al lote: {str(e)}")
-            raise
+        return self.agregar_documentos_a_lote(lote_id, [documento_id], commit=True)
     
-    def agregar_documentos_a_lote(self, lote_id: int, documentos: List[Dict[str, Any]]) -> List[LoteDocumento]:
+    def agregar_documentos_a_lote(self, lote_id: int, documento_ids: List[int],
+                                  commit: bool = False) -> int:
         """
-        Agrega múltiples documentos a un lote
+        Agrega múltiples documentos a un lote: un INSERT (executemany) y un
+        UPDATE, sin cargar objetos. Con commit=False queda en la transacción
+        del llamador (armar_lote). Retorna la cantidad agregada.
         """
+        if not documento_ids:
+            return 0
         try:
-            lote_documentos = []
-            for doc_data in documentos:
-                lote_doc = LoteDocumento(
-                    lote_id=lote_id,
-                    documento_id=doc_data['documento_id'],
-                )
-                self.db.add(lote_doc)
-                lote_documentos.append(lote_doc)
-            
-            self.db.commit()
+            self.db.execute(
+                insert(LoteDocumento),
+                [{"lote_id": lote_id, "documento_id": documento_id} for documento_id in documento_ids],
+            )
             
             # Actualizar estados de los documentos
-            doc_ids = [doc['documento_id'] for doc in documentos]
-            documentos_db = self.db.query(Documento).filter(
-                Documento.id.in_(doc_ids)
-            ).all()
-            
-            for doc in documentos_db:
-                doc.estado_actual = 'EN_PROCESO_LOTE'
+            self.db.query(Documento).filter(
+                Documento.id.in_(documento_ids)
+            ).update(
+                {Documento.estado_actual: 'EN_PROCESO_LOTE'},
+                synchronize_session=False,
+            )
             
-            self.db.commit()
+            if commit:
+                self.db.commit()
             
-            logger.info(f"{len(documentos)} documentos agregados al lote {lote_id}")
-            return lote_documentos
+            logger.info(f"{len(documento_ids)} documentos agregados al lote {lote_id}")
+            return len(documento_ids)
         except SQLAlchemyError as e:
             self.db.rollback()
             logger.error(f"Error al agregar documentos al lote: {str(e)}")
@@ -208,6 +374,25 @@ class LoteDocumentoRepository:
             logger.error(f"Error al obtener documentos del lote {lote_id}: {str(e)}")
             raise
     
+    def documentos_por_lotes(self, lote_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """
+        Documentos de varios lotes en una sola consulta:
+        {lote_id: [{"documento_id": ...}, ...]}
+        """
+        documentos = {lote_id: [] for lote_id in lote_ids}
+        if not lote_ids:
+            return documentos
+        try:
+            filas = self.db.query(LoteDocumento.lote_id, LoteDocumento.documento_id).filter(
+                LoteDocumento.lote_id.in_(lote_ids)
+            ).all()
+            for lote_id, documento_id in filas:
+                documentos[lote_id].append({"documento_id": documento_id})
+            return documentos
+        except SQLAlchemyError as e:
+            logger.error(f"Error al obtener documentos de lotes: {str(e)}")
+            raise
+    
     def obtener_documentos_por_estado(self, estado: str) -> List[LoteDocumento]:
         """
         Obtiene documentos de lotes por estado de resultado
@@ -258,31 +443,52 @@ class LoteDocumentoRepository:
             logger.error(f"Error al actualizar estado documento: {str(e)}")
             raise
     
-    def actualizar_estados_documentos_masivo(self, resultados: List[Dict[str, Any]]) -> bool:
+    def actualizar_estados_documentos_masivo(self, lote_id: int, resultados: List[Dict[str, Any]]) -> bool:
         """
-        Actualiza estados de múltiples documentos en lote
+        Actualiza estados de múltiples documentos del lote `lote_id`.
+        Un UPDATE ... FROM de_documento (executemany por CDC) para los
+        resultados y una transición masiva para los documentos; un commit.
+        Solo se tocan las filas de ese lote: las de lotes anteriores del
+        mismo CDC conservan su resultado.
         """
         try:
-            for resultado in resultados:
-                lote_doc = self.db.query(LoteDocumento).filter(
-                    LoteDocumento.cdc == resultado['cdc']
-                ).first()
-                
-                if lote_doc:
-                    lote_doc.estado_resultado = resultado.get('estado_resultado')
-                    lote_doc.codigo_error = resultado.get('codigo_error')
-                    lote_doc.mensaje_error = resultado.get('mensaje_error')
-                    
-                    # Actualizar documento principal
-                    documento = self.db.query(Documento).filter(
-                        Documento.id == lote_doc.documento_id
-                    ).first()
-                    
-                    if documento and resultado.get('estado_resultado'):
-                        if resultado['estado_resultado'] == 'APROBADO':
-                            documento.estado_actual = 'APROBADO'
-                        elif resultado['estado_resultado'] == 'RECHAZADO':
-                            documento.estado_actual = 'RECHAZADO'
+            if not resultados:
+                return True
+            
+            lote_doc = LoteDocumento.__table__
+            documento = Documento.__table__
+            stmt = (
+                update(lote_doc)
+                .where(lote_doc.c.documento_id == documento.c.id)
+                .where(documento.c.cdc_de == bindparam("b_cdc"))
+                .where(lote_doc.c.lote_id == bindparam("b_lote_id"))
+                .values(
+                    estado_resultado=bindparam("b_estado_resultado"),
+                    codigo_error=bindparam("b_codigo_error"),
+                    mensaje_error=bindparam("b_mensaje_error"),
+                )
+            )
+            self.db.execute(stmt, [
+                {
+                    "b_lote_id": lote_id,
+                    "b_cdc": resultado['cdc'],
+                    "b_estado_resultado": resultado.get('estado_resultado'),
+                    "b_codigo_error": resultado.get('codigo_error'),
+                    "b_mensaje_error": resultado.get('mensaje_error'),
+                }
+                for resultado in resultados
+            ])
+            
+            # Actualizar documento principal
+            DocumentoRepo(self.db).bulkSetEstados(
+                [
+                    {"cdc": resultado['cdc'], "estado": resultado['estado_resultado']}
+                    for resultado in resultados
+                    if resultado.get('estado_resultado') in ('APROBADO', 'RECHAZADO')
+                ],
+                por="cdc",
+                commit=False,
+            )
             
             self.db.commit()
             logger.info(f"Estados actualizados para {len(resultados)} documentos")
@@ -297,8 +503,10 @@ class LoteDocumentoRepository:
         Obtiene un LoteDocumento por su CDC
         """
         try:
-            return self.db.query(LoteDocumento).filter(
-                LoteDocumento.cdc == cdc
+            return self.db.query(LoteDocumento).join(
+                Documento, LoteDocumento.documento_id == Documento.id
+            ).filter(
+                Documento.cdc_de == cdc
             ).first()
         except SQLAlchemyError as e:
             logger.error(f"Error al obtener LoteDocumento por CDC {cdc}: {str(e)}")
@@ -8,6 +8,8 @@ from daemon.worker import SifenWorker, WorkerConfig
 from daemon.event_worker import EventWorker, EventWorkerConfig  # Nuevo
 from daemon.pdf_worker import PDFWorker, PDFWorkerConfig  # Nuevo worker de PDFs
 from config.setting import get_settings
+from core.infraestructure.database.migraciones import aplicar_migraciones
+from core.infraestructure.soap.captura import instalar_volcado_por_senal
 import multiprocessing as mp
 
  
@@ -22,12 +24,19 @@ class DemonSiffenApp:
     
     def _setup_services(self):
         """Inicializa  workers"""
+        # Columnas/índices requeridos por los workers (idempotente)
+        aplicar_migraciones()
+        
         # Worker de facturas
         factura_config = WorkerConfig(
             interval=self.settings.PROCESSING_INTERVAL,
             batch_size=self.settings.BATCH_SIZE,
             max_retries=self.settings.MAX_RETRIES,
-            debug=self.settings.DEBUG
+            debug=self.settings.DEBUG,
+            claim_limit=self.settings.CLAIM_LIMIT,
+            lease_seconds=self.settings.LEASE_SECONDS,
+            pipeline=self.settings.WORKER_PIPELINE,
+            express=self.settings.WORKER_EXPRESS
         )
         self.factura_worker = SifenWorker(factura_config)
         self.factura_worker.setup()
@@ -71,11 +80,19 @@ class DemonSiffenApp:
         
         self.running = True
         
+        # `kill -USR1 <pid>` vuelca las capturas SOAP del worker (se hereda al fork)
+        instalar_volcado_por_senal()
+        
         # Crear procesos para cada worker
-        factura_process = mp.Process(
-            target=self.factura_worker.start,
-            name="FacturaWorker"
-        )
+        # Los FacturaWorker reclaman documentos con SKIP LOCKED, por lo que
+        # pueden correr varios en paralelo sin duplicar envíos
+        factura_processes = [
+            mp.Process(
+                target=self.factura_worker.start,
+                name=f"FacturaWorker-{i}"
+            )
+            for i in range(max(1, self.settings.FACTURA_WORKERS))
+        ]
         evento_process = mp.Process(
             target=self.evento_worker.start,
             name="EventoWorker"
@@ -90,13 +107,15 @@ class DemonSiffenApp:
         )
         try:
             # Iniciar todos los procesos
-            factura_process.start()
+            for factura_process in factura_processes:
+                factura_process.start()
             evento_process.start()
             estados_process.start()
             pdf_process.start()
             
             # Esperar a que terminen
-            factura_process.join()
+            for factura_process in factura_processes:
+                factura_process.join()
             evento_process.join()
             estados_process.join()
             pdf_process.join()
@@ -104,7 +123,8 @@ class DemonSiffenApp:
             
         except KeyboardInterrupt:
             print("\n🛑 Interrupción recibida")
-            factura_process.terminate()
+            for factura_process in factura_processes:
+                factura_process.terminate()
             evento_process.terminate()
             estados_process.terminate()
             pdf_process.terminate()
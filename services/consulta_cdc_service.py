@@ -1,6 +1,7 @@
 from core.infraestructure.soap.soap_client import SOAPClient
+from config.setting import settings
 
-endpoint = "https://sifen.set.gov.py/de/ws/consultas/consulta.wsdl"
+endpoint = settings.CONSULTA_ENDPOINT
 
 def consultaCDC(client: SOAPClient,cdc: str, numdoc: int):
 
@@ -0,0 +1,78 @@
+"""
+Despacho concurrente de lotes a SIFEN.
+
+El envío SOAP (red) corre en un pool de hilos con un límite global de
+lotes en vuelo y otro por emisor. Las respuestas se entregan de a una en
+el hilo llamador, así las escrituras en la base de datos siguen
+serializadas sobre la misma sesión. También en el hilo llamador corre
+`al_iniciar`, justo antes de que cada envío ocupe su lugar.
+"""
+
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Hashable, List, Optional
+
+from config.setting import settings
+from config.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class DespachoLotes:
+    """Mantiene hasta `max_total` envíos en vuelo y `max_por_emisor` por emisor"""
+
+    def __init__(self, max_total: Optional[int] = None, max_por_emisor: Optional[int] = None):
+        self.max_total = max(1, max_total or settings.DESPACHO_MAX_LOTES)
+        self.max_por_emisor = max(1, max_por_emisor or settings.DESPACHO_MAX_POR_EMISOR)
+
+    def despachar(
+        self,
+        trabajos: List[Any],
+        enviar: Callable[[Any], Any],
+        al_completar: Callable[[Any, Any, Optional[Exception]], Any],
+        clave: Callable[[Any], Hashable],
+        al_iniciar: Optional[Callable[[Any], bool]] = None,
+    ) -> List[Any]:
+        """
+        Ejecuta `enviar(trabajo)` en paralelo y llama
+        `al_completar(trabajo, respuesta, error)` en este hilo a medida que
+        terminan. Retorna los resultados de `al_completar` en orden de llegada.
+        Si `al_iniciar(trabajo)` retorna False el trabajo se descarta sin enviar.
+        """
+        if not trabajos:
+            return []
+
+        pendientes = deque(trabajos)
+        en_vuelo = {}
+        por_clave = Counter()
+        resultados = []
+
+        with ThreadPoolExecutor(max_workers=self.max_total) as pool:
+            while pendientes or en_vuelo:
+                # Programar lo que entre en los límites; el resto espera su turno
+                en_espera = deque()
+                while pendientes and len(en_vuelo) < self.max_total:
+                    trabajo = pendientes.popleft()
+                    k = clave(trabajo)
+                    if por_clave[k] >= self.max_por_emisor:
+                        en_espera.append(trabajo)
+                        continue
+                    if al_iniciar is not None and not al_iniciar(trabajo):
+                        continue
+                    en_vuelo[pool.submit(enviar, trabajo)] = trabajo
+                    por_clave[k] += 1
+                pendientes.extendleft(reversed(en_espera))
+                if not en_vuelo:
+                    continue    # todo lo programable se descartó en al_iniciar
+
+                listos, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                for futuro in listos:
+                    trabajo = en_vuelo.pop(futuro)
+                    por_clave[clave(trabajo)] -= 1
+                    try:
+                        respuesta, error = futuro.result(), None
+                    except Exception as e:
+                        respuesta, error = None, e
+                    resultados.append(al_completar(trabajo, respuesta, error))
+
+        return resultados
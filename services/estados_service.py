@@ -1,3 +1,4 @@
+from datetime import datetime, timedelta
 from typing import List
 import logging
 from venv import logger
@@ -7,7 +8,9 @@ from domain.repositories.doc_repo import DocumentoRepo
 from core.infraestructure.soap.soap_client import SOAPClient
 from domain.models.models import Lote
 from services.consulta_lote_service import consultaLote
-from utils.parseResponseLote import parse_lote_response
+from utils.parseSifen import ResultadoLote, parse_respuesta_lote
+from services.despacho_service import DespachoLotes
+from config.setting import settings
 
 class EstadosService:
     def __init__(self, db: Session,limit):
@@ -19,40 +22,149 @@ class EstadosService:
         self.cert_path = r"C:\Users\mauri\credenciales\certificado.pem"
         self.key_path = r"C:\Users\mauri\clave_privada_desenc.pem"
         
+    # Códigos de respuesta de rEnviConsLoteDe
+    COD_LOTE_EN_PROCESO = "0361"
+    COD_LOTE_CONCLUIDO = "0362"
+    ESTADO_ESCALADO = "CONSULTA_ESCALADA"
+    
     def processLotes(self,estado:str):
         
-       """Procesa facturas por lote para consultar su estado luego del envio """
+       """
+       Consulta el estado de los lotes cuya próxima consulta ya venció,
+       del más antiguo al más nuevo. Mientras SIFEN responde 0361 (lote en
+       procesamiento) la siguiente consulta se aleja con backoff
+       exponencial; pasado ESTADOS_PLAZO_MAXIMO desde el envío el lote se
+       escala a CONSULTA_ESCALADA para revisión.
+       """
        logger.info(f"🔍 Buscando lotes con estado: {estado}")
        
-       # Depuración: mostrar todos los lotes existentes
-       logger.info("🔍 DEPURACIÓN - Todos los lotes en BD:")
-       self.lote_repo.listar_todos_los_lotes(10)
+       LotesPending:List[Lote]=self.lote_repo.listar_lotes_para_consulta(estado,self.limit)
+       logger.info(f"📊 Lotes a consultar con estado '{estado}': {len(LotesPending)}")
        
-       LotesPending:List[Lote]=self.lote_repo.listar_lotes_por_estado(estado,self.limit)
-       logger.info(f"📊 Lotes encontrados con estado '{estado}': {len(LotesPending)}")
+       # Solo valores planos hacia los hilos: nada de objetos ORM fuera de la sesión
+       consultas = [
+           {
+               "lote_id": lote.id,
+               "nro_lote_sifen": lote.nro_lote_sifen,
+               "emisor_id": lote.emisorId,
+               "ruc": lote.emisor.drucem,
+               "cert_path": lote.emisor.cert_path,
+               "key_path": lote.emisor.key_path,
+               "fecha_envio": lote.fecha_envio,
+               "intentos": lote.intentos_consulta or 0,
+           }
+           for lote in LotesPending
+       ]
        
-       # Mostrar detalles de los lotes encontrados para depuración
-       for lote in LotesPending:
-           logger.info(f"   - Lote ID: {lote.id}, Estado: {lote.estado}, Nro SIFEN: {lote.nro_lote_sifen}")
+       # Consultas concurrentes; los resultados se juntan en este hilo
+       resultados = DespachoLotes(
+           max_total=settings.ESTADOS_CONCURRENCIA,
+           max_por_emisor=settings.ESTADOS_CONCURRENCIA
+       ).despachar(
+           consultas,
+           enviar=self._consultar,
+           al_completar=self._recolectar,
+           clave=lambda consulta: consulta["emisor_id"]
+       )
        
-       total_procesados = 0
+       ahora = datetime.now()
+       concluidos = []
+       reprogramados = []
+       for consulta, dataDE in resultados:
+           if dataDE is not None and (
+               dataDE["cod_res_lot"] == self.COD_LOTE_CONCLUIDO or dataDE["detalles"]
+           ):
+               concluidos.append((consulta["lote_id"], dataDE))
+           else:
+               reprogramados.append(self._reprogramar(consulta, dataDE, ahora))
        
-       for lote in LotesPending:
-            try:
-                soap_client = SOAPClient(lote.emisor.cert_path, lote.emisor.key_path, True)
-                response = consultaLote(soap_client,lote.id,lote.nro_lote_sifen)
-                dataDE = parse_lote_response(response.content)
-                self.doc_repo.loadEstRes(dataDE)
-                
-                # ACTUALIZAR ESTADO DEL LOTE PARA EVITAR BUCLE
-                self.lote_repo.actualizar_lote(lote.id, {"estado": "PROCESADO"})
-                
-                logger.info(f"Lote N* {lote.id} consultado correctamente")
-                total_procesados += 1
-                
-            except Exception as e:
-                logger.error(f"Error procesando respuesta del lote {lote.id}: {str(e)}")
-                # No elevar la excepción, continuar con el siguiente lote
-                continue
+       # Un único UPDATE masivo de documentos y otro de lotes, un solo commit
+       try:
+           detalles = [detalle for _, dataDE in concluidos for detalle in dataDE["detalles"]]
+           self.doc_repo.bulkSetEstados(
+               [
+                   {
+                       "cdc": detalle["cdc"],
+                       "estado": detalle["est_res"],
+                       "prot_aut": detalle["prot_aut"],
+                       "cod_res": detalle["cod_res"],
+                       "msg_res": detalle["msg_res"],
+                   }
+                   for detalle in detalles
+               ],
+               por="cdc",
+               commit=False
+           )
+           
+           # ACTUALIZAR ESTADO DEL LOTE PARA EVITAR BUCLE
+           self.lote_repo.actualizar_estado_lotes(
+               [lote_id for lote_id, _ in concluidos], "PROCESADO", commit=False
+           )
+           self.lote_repo.programar_consultas(reprogramados, commit=False)
+           self.db.commit()
+           logger.info(
+               f"Estados actualizados para {len(detalles)} documentos de {len(concluidos)} lotes; "
+               f"{len(reprogramados)} lotes reprogramados"
+           )
+       except Exception as e:
+           self.db.rollback()
+           logger.error(f"Error guardando estados de lotes: {str(e)}")
+           raise
        
-       return {"total_procesados": total_procesados}
\ No newline at end of file
+       return {
+           "total_procesados": len(concluidos),
+           "reprogramados": len(reprogramados),
+           "proxima_consulta": self.lote_repo.proxima_consulta(estado)
+       }
+    
+    @staticmethod
+    def _backoff(intentos: int) -> timedelta:
+        """Espera antes de la siguiente consulta: base * 2^intentos, con tope"""
+        segundos = settings.ESTADOS_BACKOFF_BASE * (2 ** min(intentos, 16))
+        return timedelta(seconds=min(segundos, settings.ESTADOS_BACKOFF_MAX))
+    
+    def _reprogramar(self, consulta: dict, dataDE: dict, ahora: datetime) -> dict:
+        """Programa la próxima consulta de un lote que todavía no concluyó"""
+        intentos = consulta["intentos"] + 1
+        fecha_envio = consulta["fecha_envio"] or ahora
+        vencido = ahora - fecha_envio > timedelta(seconds=settings.ESTADOS_PLAZO_MAXIMO)
+        
+        # 0361 o error de red se reintentan; cualquier otro código (0360 lote
+        # inexistente, 0364 consulta extemporánea, ...) no se resuelve esperando
+        cod_res_lot = dataDE["cod_res_lot"] if dataDE is not None else None
+        reintentable = dataDE is None or cod_res_lot == self.COD_LOTE_EN_PROCESO
+        
+        if vencido or not reintentable:
+            logger.warning(
+                f"⚠️ Lote {consulta['lote_id']} escalado ({cod_res_lot or 'sin respuesta'}) "
+                f"tras {intentos} consultas"
+            )
+            return {
+                "id": consulta["lote_id"],
+                "estado": self.ESTADO_ESCALADO,
+                "next_check_at": None,
+                "intentos_consulta": intentos,
+            }
+        
+        return {
+            "id": consulta["lote_id"],
+            "estado": "RECIBIDO_SIFEN",
+            "next_check_at": ahora + self._backoff(intentos - 1),
+            "intentos_consulta": intentos,
+        }
+    
+    @staticmethod
+    def _consultar(consulta: dict) -> ResultadoLote:
+        """Consulta un lote en SIFEN y parsea la respuesta (se ejecuta en un hilo)"""
+        soap_client = SOAPClient(consulta["cert_path"], consulta["key_path"], True, ruc=consulta["ruc"])
+        response = consultaLote(soap_client,consulta["lote_id"],consulta["nro_lote_sifen"])
+        return parse_respuesta_lote(response.content)
+    
+    @staticmethod
+    def _recolectar(consulta: dict, dataDE: dict, error: Exception):
+        if error is not None:
+            logger.error(f"Error procesando respuesta del lote {consulta['lote_id']}: {str(error)}")
+            # No elevar la excepción: el lote se reprograma con backoff
+            return consulta, None
+        logger.info(f"Lote N* {consulta['lote_id']} consultado: {dataDE['cod_res_lot']}")
+        return consulta, dataDE
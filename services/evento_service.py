@@ -3,9 +3,11 @@ from domain.repositories.doc_repo import DocumentoRepo
 from domain.repositories.evento_repo import EventoRepository
 from domain.models.models import Emisor, Evento
 from core.infraestructure.soap.soap_client import SOAPClient
+from core.infraestructure.soap.resiliencia import no_enviado
 from core.infraestructure.use_cases.enviEv import sendEvento
+from core.infraestructure.xml.validador_xsd import ErrorEsquema, validar_evento
 from config.logger import get_logger
-from utils.parseResponseEvento import parse_evento_response
+from utils.parseSifen import parse_respuesta_evento
 logger = get_logger(__name__)
 
 class EventoService:
@@ -44,12 +46,21 @@ class EventoService:
             # 1. Generar XML del evento
             emisor :Emisor =DocumentoRepo(self.db).getEmisorBycdc(evento.cdc_dte)
             from core.infraestructure.xml.eventBuilder import eventBuilder
-            builder = eventBuilder()
+            builder = eventBuilder(self.db)
             xml = builder.build(emisor,evento)
+            
+            # Validación local (XSD_VALIDAR): un evento inválido no viaja a SIFEN
+            try:
+                validar_evento(xml)
+            except ErrorEsquema as e:
+                self.evento_repo.update_estado(evento.id, "ERROR_XML")
+                logger.error(f"Evento {evento.id} no cumple el esquema: {e}")
+                return
             soap_client = SOAPClient(
             cert_path=emisor.cert_path,
             key_path=emisor.key_path,
-            debug=True
+            debug=True,
+            ruc=emisor.drucem
         )
             if isinstance(xml, str):
                 xml_bytes = xml.encode("utf-8")
@@ -69,10 +80,10 @@ class EventoService:
             else:
                 response_bytes = response
 
-            res = parse_evento_response(response_bytes)
+            res = parse_respuesta_evento(response_bytes)
             
 
-            if not res["dCodRes"]:
+            if not res.cod_res:
                 self.evento_repo.update_estado(evento.id, "ERROR")
                 logger.error(f"Respuesta inválida para evento {evento.id}")
                 return
@@ -80,22 +91,26 @@ class EventoService:
             # Guardar respuesta completa en BD
             self.evento_repo.update_respuesta(
                 evento.id,{
-                "dcodres":res["dCodRes"],
-                "dmsgres":res["dMsgRes"],
-                "dprot_aut":res["dProtAut"],
-                "destres":res["dEstRes"],
-                "dfecproc":res["dFecProc"],
+                "dcodres":res.cod_res,
+                "dmsgres":res.msg_res,
+                "dprot_aut":res.prot_aut,
+                "destres":res.est_res,
+                "dfecproc":res.fec_proc,
                 }
             )
 
-            if res["dCodRes"] in ("0600", "0300"):
+            if res.cod_res in ("0600", "0300"):
                 self.evento_repo.update_estado(evento.id, "PROCESADO")
                 logger.info(f"Evento {evento.id} procesado OK")
             else:
                 self.evento_repo.update_estado(evento.id, "ERROR")
-                logger.error(f"Evento {evento.id} rechazado: {res['dMsgRes']}")
+                logger.error(f"Evento {evento.id} rechazado: {res.msg_res}")
                 
         except Exception as e:
+            if no_enviado(e):
+                # SIFEN no lo recibió (circuito abierto o sin conexión): sigue PENDIENTE_ENVIO
+                logger.warning(f"Evento {evento.id} no enviado, se reintenta luego: {e}")
+                return
             self.evento_repo.update_estado(evento.id, "ERROR")
             logger.error(f"Error procesando evento {evento.id}: {e}")
             raise
@@ -0,0 +1,168 @@
+"""
+Carril express: envío síncrono de un DE por rEnviDe (sendDE).
+
+Los documentos marcados express (o de un emisor express) no esperan a
+formar un lote ni a la consulta de estado: se firman, se envían de a uno
+y el rProtDe de la respuesta deja el documento Aprobado/Rechazado en
+segundos, listo para imprimir el KuDE. El tráfico masivo sigue por lotes.
+"""
+
+from core.infraestructure.soap.soap_client import SOAPClient
+from core.infraestructure.soap.resiliencia import circuito_abierto, no_enviado
+from core.infraestructure.use_cases.enviDE import endpointsendDE, sendDE
+from core.infraestructure.xml.pool_firma import armar_documentos
+from domain.repositories.doc_repo import DocumentoRepo
+from services.despacho_service import DespachoLotes
+from services.response_service import getResponse, leerProtDe
+from config.setting import settings
+from config.logger import get_logger
+
+logger = get_logger(__name__)
+
+COD_DE_APROBADO = "0260"    # Autorización del DE satisfactoria
+
+
+class ExpressService:
+    def __init__(self, db):
+        self.db = db
+        self.repo_doc = DocumentoRepo(db)
+
+    def procesar_express(self, owner: str, limite: int = None, lease_segundos: int = 600) -> dict:
+        """
+        Reclama documentos express, los firma y los envía por rEnviDe.
+        Las respuestas se persisten en este hilo a medida que llegan.
+        """
+        if circuito_abierto(endpointsendDE):
+            # Sin SIFEN no se reclama: los documentos siguen pendientes sin volver a firmarse
+            return {"total_procesados": 0, "documentos": []}
+
+        documentos = self.repo_doc.claimPendientes(
+            limite=limite or settings.EXPRESS_LIMITE,
+            owner=owner,
+            lease_segundos=lease_segundos,
+            express=True,
+        )
+        if not documentos:
+            return {"total_procesados": 0, "documentos": []}
+
+        ids_reclamados = [doc.id for doc in documentos]
+        try:
+            trabajos = self._firmar(documentos)
+            resultados = DespachoLotes().despachar(
+                trabajos,
+                enviar=self.enviar_de,
+                al_completar=self.registrar_respuesta,
+                clave=lambda trabajo: trabajo["emisor_id"]
+            )
+        finally:
+            self.repo_doc.liberarLease(owner, ids_reclamados)
+
+        return {"total_procesados": len(documentos), "documentos": resultados}
+
+    def _firmar(self, documentos: list) -> list:
+        """
+        Arma y firma los DEs y persiste CDC/XML en un solo commit.
+        Retorna los envíos como valores planos para los hilos del despacho.
+        Los que ya tienen XML firmado (un envío anterior no llegó a SIFEN)
+        se reenvían tal cual, con el mismo CDC.
+        """
+        firmas, errores, trabajos = [], [], []
+
+        firmados = [doc for doc in documentos if doc.xml_de and doc.cdc_de]
+        por_firmar = [doc for doc in documentos if not (doc.xml_de and doc.cdc_de)]
+        for doc in firmados:
+            trabajos.append(self._trabajo(doc, doc.cdc_de, doc.xml_de.encode('utf-8')))
+        if not por_firmar:
+            return trabajos
+
+        for doc, armado in zip(por_firmar, armar_documentos(por_firmar)):
+            if armado["error"]:
+                logger.error(f"❌ Error armando documento express {doc.id}: {armado['error']}")
+                errores.append({"id": doc.id, "estado": "ERROR_XML"})
+                continue
+
+            firmas.append({
+                "id": doc.id,
+                "cdc_de": armado["cdc_de"],
+                "ddvid": armado["ddvid"],
+                "dfecfirma": armado["dfecfirma"],
+                "xml_de": armado["xml_de"].decode('utf-8')
+            })
+            trabajos.append(self._trabajo(doc, armado["cdc_de"], armado["xml_de"]))
+
+        try:
+            self.repo_doc.bulkSetFirmas(firmas, commit=False)
+            self.repo_doc.bulkSetEstados(errores, commit=False)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()    # siguen PENDIENTE_ENVIO para otro ciclo
+            raise
+
+        return trabajos
+
+    @staticmethod
+    def _trabajo(doc, cdc: str, xml_de: bytes) -> dict:
+        return {
+            "documento_id": doc.id,
+            "cdc": cdc,
+            "xml_de": xml_de,
+            "emisor_id": doc.emisor.id,
+            "ruc": doc.emisor.drucem,
+            "cert_path": doc.emisor.cert_path,
+            "key_path": doc.emisor.key_path,
+        }
+
+    @staticmethod
+    def enviar_de(trabajo: dict) -> dict:
+        """
+        Envía el DE y lee el rProtDe. Solo red y parseo: corre en otro hilo
+        """
+        soap_client = SOAPClient(trabajo["cert_path"], trabajo["key_path"], True, ruc=trabajo["ruc"])
+        respuesta = sendDE(soap_client, trabajo["xml_de"], numdoc=trabajo["documento_id"]).text
+        return {"xml": respuesta, "protocolo": leerProtDe(respuesta)}
+
+    def registrar_respuesta(self, trabajo: dict, response: dict, error: Exception) -> dict:
+        """
+        Persiste el resultado de un envío (siempre en el hilo de la sesión)
+        """
+        documento_id = trabajo["documento_id"]
+
+        if error is None:
+            try:
+                protocolo = response["protocolo"]
+                estado = self._estado_documento(protocolo)
+
+                getResponse(response["xml"], self.db, documento_id, protocolo=protocolo, commit=False)
+                self.repo_doc.bulkSetEstados([{
+                    "id": documento_id,
+                    "estado": estado,
+                    "prot_aut": protocolo["prot_aut"],
+                    "cod_res": protocolo["dcodres"],
+                    "msg_res": protocolo["dmsgres"][:100],
+                }], commit=False)
+                self.db.commit()
+
+                logger.info(f"⚡ Documento {documento_id} ({trabajo['cdc']}): {estado} [{protocolo['dcodres']}]")
+                return {"documento_id": documento_id, "estado": estado, "cod_res": protocolo["dcodres"]}
+            except Exception as e:
+                error = e
+
+        self.db.rollback()
+        if no_enviado(error):
+            # SIFEN no lo recibió: sigue PENDIENTE_ENVIO con su XML firmado, que
+            # el próximo ciclo reenvía sin volver a firmar (ver _firmar)
+            logger.warning(f"⏸️ Documento express {documento_id} no enviado: {error}")
+            return {"documento_id": documento_id, "estado": "PENDIENTE_ENVIO", "error": str(error)}
+
+        logger.error(f"❌ Error enviando documento express {documento_id}: {str(error)}")
+
+        self.repo_doc.bulkSetEstados([{"id": documento_id, "estado": "ERROR_ENVIO"}])
+
+        return {"documento_id": documento_id, "estado": "ERROR_ENVIO", "error": str(error)}
+
+    @staticmethod
+    def _estado_documento(protocolo: dict) -> str:
+        """dEstRes de SIFEN; sin él, se deduce del código de resultado"""
+        if protocolo["est_res"]:
+            return protocolo["est_res"]
+        return "Aprobado" if protocolo["dcodres"] == COD_DE_APROBADO else "Rechazado"
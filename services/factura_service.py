@@ -1,31 +1,70 @@
+from typing import Collection
+from datetime import datetime, timedelta
 from core.infraestructure.soap.soap_client import SOAPClient
+from core.infraestructure.soap.resiliencia import circuito_abierto, no_enviado
 from core.infraestructure.xml.xml_builder import XMLBuilder
 from core.infraestructure.xml.xml_builder_lote import XMLBuilderLote
 from domain.models.models import Emisor
-from services.lote_service import LoteService
+from services.lote_service import LoteService, endpoint as endpoint_lote
+from services.despacho_service import DespachoLotes
 from domain.repositories.doc_repo import DocumentoRepo
 from domain.repositories.lote_repo import LoteRepository, LoteDocumentoRepository
+from config.setting import settings
+from core.infraestructure.xml.pool_firma import armar_documentos
+from core.infraestructure.xml.validador_xsd import validar_de
+from utils.parseSifen import parse_envio_lote
 from config.logger import get_logger
 
 logger = get_logger(__name__)
 
 class FacturaService:
-    def __init__(self, db):
+    def __init__(self, db, unidad_trabajo: bool = None):
         self.db = db
+        # Unidad de trabajo: el lote completo se arma y persiste en una transacción
+        self.unidad_trabajo = settings.LOTE_UNIDAD_TRABAJO if unidad_trabajo is None else unidad_trabajo
         self.repo_doc = DocumentoRepo(db)
         self.lote_repo = LoteRepository(db)
         self.lote_doc_repo = LoteDocumentoRepository(db)
         self.cert_path = r"C:\Users\mauri\credenciales\certificado.pem"
         self.key_path = r"C:\Users\mauri\clave_privada_desenc.pem"
         
-    def procesar_pendientes(self, batch_size: int = 50):
+    def procesar_pendientes(self, batch_size: int = 50, owner: str = None,
+                            limite: int = None, lease_segundos: int = 600, express: bool = None):
+        """
+        Procesa documentos PENDIENTE_ENVIO agrupados en lotes.
+
+        Si se indica `owner`, los documentos se reclaman con
+        `claimPendientes` (SKIP LOCKED + lease) de modo que varios workers
+        puedan correr en paralelo sin enviar dos veces el mismo CDC.
+        Con `express=False` se dejan los documentos express a su carril.
+        """
         logger.info("Iniciando procesamiento de documentos pendientes")
 
-        documentos = self.repo_doc.getPendiente()  # ESTADO de la factura = PENDIENTE_ENVIO
+        if owner:
+            documentos = self.repo_doc.claimPendientes(
+                limite=limite or batch_size,
+                owner=owner,
+                lease_segundos=lease_segundos,
+                express=express,
+            )
+        else:
+            documentos = self.repo_doc.getPendiente()  # ESTADO de la factura = PENDIENTE_ENVIO
         if not documentos:
             return {"total_procesados": 0, "lotes": []}
 
-        
+        ids_reclamados = [doc.id for doc in documentos]
+        try:
+            return self._procesar_documentos(documentos, batch_size, owner)
+        finally:
+            if owner:
+                self.repo_doc.liberarLease(owner, ids_reclamados)
+
+    @staticmethod
+    def agrupar_en_lotes(documentos: list, batch_size: int):
+        """
+        Agrupa por (emisor, tipo_doc) y corta cada grupo en lotes de batch_size.
+        Genera tuplas (emisor, tipo_doc, documentos).
+        """
         documentos = sorted(
             documentos,
             key=lambda d: (
@@ -34,9 +73,6 @@ class FacturaService:
             )
         )
 
-        resultados = []
-
-        
         grupos = {}
         for doc in documentos:
             if not doc.emisor:
@@ -56,15 +92,36 @@ class FacturaService:
             )
 
             for i in range(0, len(docs_grupo), batch_size):
-                batch = docs_grupo[i:i + batch_size]
+                yield emisor, tipo_doc, docs_grupo[i:i + batch_size]
 
-                resultado = self._procesar_lote(
-                    documentos=batch,
-                    tipo_documento=str(tipo_doc),
-                    emisor=emisor
-                )
+    def _procesar_documentos(self, documentos: list, batch_size: int, owner: str = None):
+        """Agrupa por (emisor, tipo_doc) y procesa cada grupo en lotes de batch_size"""
+        trabajos = []
 
-                resultados.append(resultado)
+        # Armado y firma de todos los documentos reclamados en paralelo;
+        # cada lote luego solo persiste y envía
+        armados = None
+        if self.unidad_trabajo:
+            armados = dict(zip(
+                (doc.id for doc in documentos),
+                armar_documentos(documentos)
+            ))
+        
+        for emisor, tipo_doc, batch in self.agrupar_en_lotes(documentos, batch_size):
+
+            trabajo = self.armar_lote(
+                documentos=batch,
+                tipo_documento=str(tipo_doc),
+                emisor=emisor,
+                armados=armados,
+                owner=owner
+            )
+
+            if trabajo is not None:
+                trabajos.append(trabajo)
+
+        # Envío concurrente; las respuestas se persisten de a una en este hilo
+        resultados = self._despachar(trabajos)
 
         return {
             "total_procesados": len(documentos),
@@ -72,13 +129,35 @@ class FacturaService:
         }
 
     
-    def _procesar_lote(self, documentos: list, tipo_documento: str,emisor:Emisor) -> dict: 
+    def armar_lote(self, documentos: list, tipo_documento: str,emisor:Emisor, armados: dict = None,
+                   owner: str = None) -> dict: 
     
         """
-        Procesa un lote de documentos
-        """
+        Arma un lote de documentos y lo deja LOTE_ARMADO listo para enviar.
 
-        
+        En modo unidad de trabajo el lote se crea, se le agregan los
+        documentos y queda LOTE_ARMADO en una sola transacción, sin commits
+        ni refresh intermedios. Si algo falla antes del commit se hace
+        rollback y los documentos siguen PENDIENTE_ENVIO para otro ciclo.
+        `armados` trae los DEs ya firmados por el pool (id -> resultado).
+        Con `owner` solo entran los documentos que ese worker sigue teniendo
+        reclamados (bloqueados hasta el commit); si no queda ninguno retorna None.
+        """
+        commit = not self.unidad_trabajo
+        fecha_armado = datetime.now()
+        if owner:
+            propios = set(self.repo_doc.bloquearReclamados(owner, [doc.id for doc in documentos]))
+            if len(propios) < len(documentos):
+                logger.warning(
+                    f"⚠️ {len(documentos) - len(propios)} documentos ya no pertenecen a {owner}, "
+                    f"quedan fuera del lote"
+                )
+                documentos = [doc for doc in documentos if doc.id in propios]
+            if not documentos:
+                self.db.rollback()
+                return None
+        if self.unidad_trabajo and armados is None:
+            armados = dict(zip((doc.id for doc in documentos), armar_documentos(documentos)))
        
         lote_data = {
             "estado": "PENDIENTE_ENVIO",    #Primer ESTADO del lote PENDIENTE_ENVIO
@@ -88,45 +167,69 @@ class FacturaService:
             "emisor":emisor,
         }
         
-        lote = self.lote_repo.crear_lote(lote_data)
+        lote = self.lote_repo.crear_lote(lote_data, commit=commit)
         logger.info(f"Lote creado en BD con ID: {lote.id}")
         
     
         documentos_procesados = []
         xmls_documentos = []
+        errores_xml = []
+        firmas = []
         
         for doc in documentos:
             try:
                 
-                xml_de = XMLBuilder(self.db).build(doc)
+                if self.unidad_trabajo:
+                    # Armado puro: nada toca la sesión hasta el UPDATE masivo
+                    armado = armados[doc.id]
+                    if armado["error"]:
+                        raise Exception(armado["error"])
+                    cdc = armado["cdc_de"]
+                    xml_de = armado["xml_de"]
+                    firmas.append({
+                        "id": doc.id,
+                        "cdc_de": cdc,
+                        "ddvid": armado["ddvid"],
+                        "dfecfirma": armado["dfecfirma"],
+                        "xml_de": xml_de.decode('utf-8')
+                    })
+                else:
+                    xml_de = XMLBuilder(self.db).build(doc)
+                    validar_de(xml_de)
+                    cdc = doc.cdc_de
+                    self.repo_doc.loadXML(xml_de.decode('utf-8'),cdc)
                 
                 
                 doc_data = {
                     "documento_id": doc.id,
-                    "cdc": doc.cdc_de,  
+                    "cdc": cdc,  
                     "xml": xml_de
                 }
                 
                 documentos_procesados.append(doc_data)
-                self.repo_doc.loadXML(xml_de.decode('utf-8'),doc.cdc_de)
                 xmls_documentos.append(xml_de)
                 
-                
-                self.lote_doc_repo.agregar_documento_a_lote(
-                    lote_id=lote.id,
-                    documento_id=doc.id
-                )
-                
                 logger.debug(f"Documento {doc.id} preparado para lote {lote.id}")
                 
             except Exception as e:
                 logger.error(f"Error procesando documento {doc.id}: {str(e)}")
                 
                 if hasattr(doc, 'id'):
-                    self.repo_doc.newEstado(doc.id, "ERROR_XML")  #ERROR_XML para el estado del documento
-        
+                    errores_xml.append({"id": doc.id, "estado": "ERROR_XML"})  #ERROR_XML para el estado del documento
         
         try:
+            # CDC, dFecFirma y XML de todo el lote en un solo UPDATE
+            self.repo_doc.bulkSetFirmas(firmas, commit=commit)
+            
+            # Transiciones masivas: un INSERT/UPDATE por lote en lugar de uno por documento
+            if documentos_procesados:
+                self.lote_doc_repo.agregar_documentos_a_lote(
+                    lote_id=lote.id,
+                    documento_ids=[doc["documento_id"] for doc in documentos_procesados],
+                    commit=commit
+                )
+            self.repo_doc.bulkSetEstados(errores_xml, commit=commit)
+            
             xml_lote = XMLBuilderLote().build_lote(xmls_documentos)
             
             
@@ -134,79 +237,252 @@ class FacturaService:
                 lote_id=lote.id,
                 update_data={
                     "xml_request": xml_lote.decode('utf-8'),
-                    "estado":"LOTE_ARMADO"
-                    }
-                
+                    "estado":"LOTE_ARMADO",
+                    # Lease de LOTE_ARMADO: el default de la columna es el inicio de
+                    # la transacción, que puede ser anterior a la firma del lote
+                    "fecha_envio": fecha_armado
+                    },
+                commit=commit
             )
             
+            if self.unidad_trabajo:
+                self.db.commit()
+            
             logger.info(f"Request{lote.id}")
             
         except Exception as e:
             logger.error(f"Error generando XML del lote {lote.id}: {str(e)}")
-            self.lote_repo.actualizar_lote(
-                lote_id=lote.id,
-                update_data={"estado": "ERROR_XML"}    #ACA ESTADO = ERROR_XML si es que no se puede armar los lotes
-            )
+            if self.unidad_trabajo:
+                self.db.rollback()    # no queda nada a medias: se reintenta en otro ciclo
+            else:
+                self.lote_repo.actualizar_lote(
+                    lote_id=lote.id,
+                    update_data={"estado": "ERROR_XML"}    #ACA ESTADO = ERROR_XML si es que no se puede armar los lotes
+                )
             raise
         
+        return self._trabajo_envio(lote.id, xml_lote, emisor, documentos_procesados, fecha_armado)
+    
+    @staticmethod
+    def _trabajo_envio(lote_id: int, xml_lote: bytes, emisor: Emisor, documentos_procesados: list,
+                       lease: datetime = None) -> dict:
+        """
+        Datos del envío como valores planos: los hilos del despacho no
+        deben tocar objetos ORM (un atributo expirado dispara un SELECT).
+        `lease` es el fecha_envio del lote LOTE_ARMADO que vio este worker.
+        """
+        return {
+            "lote_id": lote_id,
+            "lease": lease,
+            "xml_lote": xml_lote,
+            "emisor_id": emisor.id,
+            "ruc": emisor.drucem,
+            "cert_path": emisor.cert_path,
+            "key_path": emisor.key_path,
+            "documentos": documentos_procesados,
+        }
+    
+    @staticmethod
+    def enviar_soap(trabajo: dict) -> str:
+        """
+        Envía el lote a SIFEN. Solo red: se puede ejecutar en otro hilo
+        """
+        soap_client = SOAPClient(trabajo["cert_path"], trabajo["key_path"], True, ruc=trabajo["ruc"])
+        return LoteService.rEnvioLote(soap_client,xml=trabajo["xml_lote"],id=trabajo["lote_id"])
+    
+    def _despachar(self, trabajos: list, max_total: int = None, max_por_emisor: int = None) -> list:
+        """
+        Envía los lotes con DespachoLotes (límite global y por emisor).
+        Con el circuito de SIFEN abierto no se intenta: van al spool de contingencia.
+        """
+        if trabajos and circuito_abierto(endpoint_lote):
+            return self._a_contingencia(trabajos, "circuito abierto")
         
-        try:
-            soap_client = SOAPClient(emisor.cert_path, emisor.key_path, True)
-            response = LoteService.rEnvioLote(soap_client,xml=xml_lote,id=lote.id)
-            
-            self._procesar_respuesta_lote(lote.id, response, documentos_procesados) 
-            logger.info(f"Lote {lote.id} enviado exitosamente a SIFEN")
-            
-            return {
-                "lote_id": lote.id,
-                "estado": "ENVIADO_SIFEN",   # si todo sale bien se marca nuevo estado de lote como ENVIADO_SIFEN
-                "documentos": len(documentos_procesados),
-                "respuesta": response[:500] if response else None 
+        return DespachoLotes(max_total, max_por_emisor).despachar(
+            trabajos,
+            enviar=self.enviar_soap,
+            al_completar=self.registrar_envio,
+            clave=lambda trabajo: trabajo["emisor_id"],
+            al_iniciar=self.iniciar_envio
+        )
+    
+    def iniciar_envio(self, trabajo: dict) -> bool:
+        """
+        Renueva el lease (fecha_envio) del lote en el momento en que sale a
+        SIFEN y no cuando se armó: un lote que esperó su turno en el despacho
+        no queda vencido para reclamar_lotes_armados mientras se envía.
+        False si otro worker ya lo tomó: ese worker lo envía.
+        """
+        lease = self.lote_repo.renovar_lease(trabajo["lote_id"], trabajo["lease"])
+        if lease is None:
+            logger.warning(f"⚠️ Lote {trabajo['lote_id']} ya no pertenece a este worker, no se envía")
+            return False
+        trabajo["lease"] = lease
+        return True
+    
+    def registrar_envio(self, trabajo: dict, response: str, error: Exception) -> dict:
+        """
+        Persiste el resultado de un envío (siempre en el hilo de la sesión)
+        """
+        lote_id = trabajo["lote_id"]
+        documentos_procesados = trabajo["documentos"]
+        
+        if no_enviado(error):
+            return self._a_contingencia([trabajo], error)[0]
+        
+        if error is None:
+            try:
+                self._procesar_respuesta_lote(lote_id, response, documentos_procesados) 
+                logger.info(f"Lote {lote_id} enviado exitosamente a SIFEN")
+                
+                return {
+                    "lote_id": lote_id,
+                    "estado": "ENVIADO_SIFEN",   # si todo sale bien se marca nuevo estado de lote como ENVIADO_SIFEN
+                    "documentos": len(documentos_procesados),
+                    "respuesta": response[:500] if response else None 
+                }
+            except Exception as e:
+                error = e
+        
+        logger.error(f"Error enviando lote {lote_id}: {str(error)}")
+        
+        self.db.rollback()
+        self.lote_repo.actualizar_lote(
+            lote_id=lote_id,
+            update_data={
+                "estado": "ERROR_ENVIO", #SI hay error de envio de marca estado como ERROR_ENVIO
+                "xml_response": str(error)
+            },
+            commit=False
+        )
+        
+        # Actualizar estados de documentos (mismo commit que el lote)
+        self.repo_doc.masiveSetState(documentos_procesados,state="ERROR_ENVIO")
+        
+        return {
+            "lote_id": lote_id,
+            "estado": "ERROR_ENVIO",
+            "documentos": len(documentos_procesados),
+            "error": str(error)
+        }
+    
+    def _a_contingencia(self, trabajos: list, motivo) -> list:
+        """
+        SIFEN no recibió los lotes (circuito abierto o sin conexión): quedan
+        en el spool LOTE_CONTINGENCIA con su XML ya firmado, sin tocar los
+        documentos, hasta que drenar_contingencia los envíe.
+        """
+        lote_ids = [trabajo["lote_id"] for trabajo in trabajos]
+        logger.warning(f"⏸️ {len(lote_ids)} lotes a contingencia ({motivo}): {lote_ids[:10]}")
+        
+        self.db.rollback()
+        self.lote_repo.actualizar_estado_lotes(lote_ids, "LOTE_CONTINGENCIA")
+        
+        return [
+            {
+                "lote_id": trabajo["lote_id"],
+                "estado": "LOTE_CONTINGENCIA",
+                "documentos": len(trabajo["documentos"]),
+                "error": str(motivo)
             }
+            for trabajo in trabajos
+        ]
+    
+    def reintentar_lotes_armados(self, antiguedad_segundos: int = None, limite: int = 20) -> list:
+        """
+        Reenvía lotes que quedaron en LOTE_ARMADO (el proceso cayó después
+        del commit del lote y antes del envío). El XML ya armado se toma de
+        xml_request, así que el reintento no vuelve a generar ni firmar.
+        """
+        return self._despachar(self.lotes_armados_pendientes(antiguedad_segundos, limite))
+    
+    def lotes_armados_pendientes(self, antiguedad_segundos: int = None, limite: int = 20,
+                                 excluir: Collection[int] = ()) -> list:
+        """
+        Reclama lotes LOTE_ARMADO huérfanos y los retorna como trabajos de
+        envío. `excluir`: lotes que el llamador ya tiene en curso.
+        """
+        if circuito_abierto(endpoint_lote):
+            return []
+        
+        antiguedad = settings.LOTE_ARMADO_TIMEOUT if antiguedad_segundos is None else antiguedad_segundos
+        return self._trabajos_de_lotes(self.lote_repo.reclamar_lotes_armados(antiguedad, limite, excluir))
+    
+    def lotes_contingencia_pendientes(self, limite: int = None, excluir: Collection[int] = ()) -> list:
+        """
+        Reclama lotes del spool de contingencia como trabajos de envío.
+        Mientras el circuito siga abierto no reclama nada.
+        """
+        if circuito_abierto(endpoint_lote):
+            return []
+        
+        lotes = self.lote_repo.reclamar_lotes_contingencia(limite or settings.CONTINGENCIA_CONCURRENCIA, excluir)
+        return self._trabajos_de_lotes(lotes)
+    
+    def drenar_contingencia(self, limite: int = None) -> list:
+        """
+        Envía el spool de contingencia con la concurrencia de recuperación
+        (CONTINGENCIA_CONCURRENCIA); el ritmo real lo fija el límite de tasa.
+        Cada tanda reclama solo lo que el despacho puede tener en vuelo, así
+        ningún lote pasa a LOTE_ARMADO mucho antes de salir; sigue hasta
+        vaciar el spool o hasta que el circuito vuelva a abrirse.
+        """
+        limite = limite or settings.CONTINGENCIA_CONCURRENCIA
+        resultados = []
+        while True:
+            trabajos = self.lotes_contingencia_pendientes(limite)
+            if not trabajos:
+                break
             
-        except Exception as e:
-            logger.error(f"Error enviando lote {lote.id}: {str(e)}")
-            
-            
-            self.lote_repo.actualizar_lote(
-                lote_id=lote.id,
-                update_data={
-                    "estado": "ERROR_ENVIO", #SI hay error de envio de marca estado como ERROR_ENVIO
-                    "xml_response": str(e)
-                }
+            tanda = self._despachar(
+                trabajos,
+                max_total=settings.CONTINGENCIA_CONCURRENCIA,
+                max_por_emisor=settings.CONTINGENCIA_MAX_POR_EMISOR
             )
+            resultados.extend(tanda)
             
-            # Actualizar estados de documentos
-            self.repo_doc.masiveSetState(doc_data,state="ERROR_ENVIO")
-            
-            raise
+            reencolados = sum(1 for r in tanda if r["estado"] == "LOTE_CONTINGENCIA")
+            logger.info(f"📤 Contingencia: {len(tanda) - reencolados} lotes enviados, {reencolados} siguen en spool")
+            if len(trabajos) < limite or reencolados:
+                break
+        return resultados
+    
+    def _trabajos_de_lotes(self, lotes: list) -> list:
+        """Trabajos de envío de lotes ya armados (XML firmado en xml_request)"""
+        documentos = self.lote_doc_repo.documentos_por_lotes([lote.id for lote in lotes])
+        return [
+            self._trabajo_envio(lote.id, lote.xml_request.encode('utf-8'), lote.emisor, documentos[lote.id],
+                                lote.fecha_envio)
+            for lote in lotes
+        ]
     
     def _procesar_respuesta_lote(self, lote_id: int, respuesta: str, documentos: list):
         """
         Procesa la respuesta del lote y actualiza estados
         """
         try:
-            import xml.etree.ElementTree as ET
-            
             # Extraer dProtConsLote del XML de respuesta
             nro_lote_sifen = None
+            # XML sin protocolo (SOAP Fault, otra raíz): el lote queda rechazado
+            update_data = {
+                "xml_response": respuesta,
+                "estado": "LOTE_RECHAZADO"  # estado si sifen rechaza el lote 
+            }
             try:
                 if not respuesta:
                     raise ValueError("Respuesta SOAP vacía")
-                root = ET.fromstring(respuesta)
-                ns = {'ns2': 'http://ekuatia.set.gov.py/sifen/xsd'}
-                prot_cons_lote = root.find('.//ns2:dProtConsLote', ns)
-                if prot_cons_lote is not None and prot_cons_lote.text:
-                    nro_lote_sifen = prot_cons_lote.text.strip()
+                envio = parse_envio_lote(respuesta)
+                if envio.prot_cons_lote:
+                    nro_lote_sifen = envio.prot_cons_lote
                     logger.info(f"Protocolo SIFEN {nro_lote_sifen} extraído para lote {lote_id}")
+                    ahora = datetime.now()
                     update_data = {
                         "xml_response": respuesta,
-                        "estado": "RECIBIDO_SIFEN"   #ACA CREO QUE DEBERIA DE SER ESTADO : RECIBIDO_SIFEN
-                    }
-                else:
-                    update_data = {
-                        "xml_response": respuesta,
-                        "estado": "LOTE_RECHAZADO"  # estado si sifen rechaza el lote 
+                        "estado": "RECIBIDO_SIFEN",   #ACA CREO QUE DEBERIA DE SER ESTADO : RECIBIDO_SIFEN
+                        # El envío real fija la antigüedad del lote y su primera consulta de estado
+                        "fecha_envio": ahora,
+                        "next_check_at": ahora + timedelta(seconds=settings.ESTADOS_PRIMERA_CONSULTA),
+                        "intentos_consulta": 0
                     }
                     
             except Exception as e:
@@ -218,11 +494,13 @@ class FacturaService:
             if nro_lote_sifen:
                 update_data["nro_lote_sifen"] = nro_lote_sifen
             
-            self.lote_repo.actualizar_lote(lote_id, update_data)  
+            self.lote_repo.actualizar_lote(lote_id, update_data, commit=False)  
             
-            # 
-            # Aca se deberia de marcar como RECIBIDO_SIFEN por cada documento
-            self.repo_doc.masiveSetState(documentos,state="RECIBIDO_SIFEN")
+            # Los documentos siguen al lote (un único commit junto con el lote):
+            # sin protocolo nadie va a consultar su estado, quedan en ERROR_ENVIO
+            # como cuando el envío falla
+            estado_documentos = "RECIBIDO_SIFEN" if nro_lote_sifen else "ERROR_ENVIO"
+            self.repo_doc.masiveSetState(documentos, state=estado_documentos)
                 
             
             logger.info(f"Respuesta del lote {lote_id} procesada")
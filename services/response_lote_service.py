@@ -1,7 +1,9 @@
-from lxml import etree
+from sqlalchemy import func, insert, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
 from datetime import datetime
 
+from utils.parseSifen import parse_respuesta_lote
 from domain.models.models import (
     Lote, Documento, LoteDocumento,
     ConsultaLote, ConsultaDocumento, Estado
@@ -15,135 +17,139 @@ def serviceResponseLote(db: Session, lote_id: int, xml_response: str):
     - XML crudo en Lote
     - Resultado general en ConsultaLote
     - Resultado por CDC en LoteDocumento + Documento + Estado
+
+    Los documentos se resuelven con un solo SELECT por el conjunto de CDC
+    y el detalle se escribe con INSERT/UPSERT masivos: los viajes a la
+    base son los mismos para un lote de 1 o de 50 documentos.
     """
 
     # =====================
-    # 1. Parsear XML
+    # 1. Parsear XML (iterparse: no se arma el árbol completo del lote)
     # =====================
-    root = etree.fromstring(xml_response.encode("utf-8"))
-    ns = {
-        "env": "http://www.w3.org/2003/05/soap-envelope",
-        "ns2": "http://ekuatia.set.gov.py/sifen/xsd"
-    }
-
-    body = root.find("env:Body", ns)
-    res = body.find("ns2:rResEnviConsLoteDe", ns)
-
-    if res is None:
-        raise ValueError("SOAP inválido: no existe rResEnviConsLoteDe")
-
-    dFecProc = res.findtext("ns2:dFecProc", namespaces=ns)
-    dCodResLot = res.findtext("ns2:dCodResLot", namespaces=ns)
-    dMsgResLot = res.findtext("ns2:dMsgResLot", namespaces=ns)
-
-    gResProcLote_nodes = res.findall("ns2:gResProcLote", ns)
+    respuesta = parse_respuesta_lote(xml_response, streaming=True)
+    fecha_proc = respuesta.fec_proc
+    dCodResLot = respuesta.cod_res_lot
+    dMsgResLot = respuesta.msg_res_lot
+    # Un CDC repetido en la respuesta queda con su último resultado: el
+    # upsert multi-fila no admite dos filas para la misma clave
+    resultados = list({r.cdc: r for r in respuesta.detalles}.values())
+
+    # Cantidad fija de sentencias sin importar el tamaño del lote:
+    # UPDATE lote, INSERT consulta, SELECT documentos, UPDATE documentos
+    # por estado y un INSERT masivo por tabla de detalle.
 
     # =====================
-    # 2. Obtener lote
+    # 2. Actualizar lote
     # =====================
-    lote = db.query(Lote).filter(Lote.id == lote_id).first()
-    if not lote:
+    lote = db.execute(
+        update(Lote)
+        .where(Lote.id == lote_id)
+        .values(xml_response=xml_response, estado="PROCESADO")
+        .returning(Lote.id, Lote.nro_lote_sifen)
+    ).first()
+    if lote is None:
         raise ValueError(f"Lote {lote_id} no existe")
 
-    lote.xml_response = xml_response
-    lote.estado = "PROCESADO"
-    db.add(lote)
-
     # =====================
     # 3. Guardar consulta lote
     # =====================
-    consulta_lote = ConsultaLote(
-        nro_lote=lote.nro_lote_sifen,
-        cod_respuesta_lote=dCodResLot,
-        msg_respuesta_lote=dMsgResLot,
-        fecha_consulta=_parse_datetime(dFecProc),
-    )
-    db.add(consulta_lote)
-    db.flush()  # para tener consulta_lote.id
+    consulta_lote_id = db.execute(
+        insert(ConsultaLote)
+        .values(
+            nro_lote=lote.nro_lote_sifen,
+            cod_respuesta_lote=dCodResLot,
+            msg_respuesta_lote=dMsgResLot,
+            fecha_consulta=fecha_proc,
+        )
+        .returning(ConsultaLote.id)
+    ).scalar_one()
+
+    if not resultados:
+        db.commit()
+        return True
 
     # =====================
-    # 4. Procesar cada DE del lote
+    # 4. Documentos del lote (un SELECT por el conjunto de CDC)
     # =====================
-    for nodo in gResProcLote_nodes:
-        cdc = nodo.findtext("ns2:id", namespaces=ns)
-        estado_res = nodo.findtext("ns2:dEstRes", namespaces=ns)  # Aprobado / Rechazado
-        prot_aut = nodo.findtext("ns2:dProtAut", namespaces=ns)
-
-        gResProc = nodo.find("ns2:gResProc", ns)
-        cod_res = gResProc.findtext("ns2:dCodRes", namespaces=ns) if gResProc is not None else None
-        msg_res = gResProc.findtext("ns2:dMsgRes", namespaces=ns) if gResProc is not None else None
-
-        # ---------------------
-        # Buscar documento
-        # ---------------------
-        documento = db.query(Documento).filter(Documento.cdc_de == cdc).first()
-        if not documento:
-            # Esto es error grave de tu sistema: mandaste un CDC que no existe
-            raise ValueError(f"CDC {cdc} no existe en de_documento")
-
-        # ---------------------
-        # Actualizar Documento
-        # ---------------------
-        if estado_res and estado_res.upper() == "APROBADO":
-            documento.estado_actual = "APROBADO"
-        else:
-            documento.estado_actual = "RECHAZADO"
-
-        documento.fecha_ultima_consulta = datetime.utcnow()
-        documento.intentos_consulta = (documento.intentos_consulta or 0) + 1
-        db.add(documento)
-
-        # ---------------------
-        # Historial de estados
-        # ---------------------
-        estado_hist = Estado(
-            de_id=documento.id,
-            dcodres=cod_res or "0000",
-            dmsgres=msg_res or estado_res or "SIN MENSAJE",
-            dfecproc=_parse_datetime(dFecProc),
-        )
-        db.add(estado_hist)
-
-        # ---------------------
-        # Relación lote-documento
-        # ---------------------
-        lote_doc = (
-            db.query(LoteDocumento)
-            .filter(
-                LoteDocumento.lote_id == lote.id,
-                LoteDocumento.documento_id == documento.id,
+    cdcs = {r.cdc for r in resultados}
+    ids_por_cdc = dict(
+        db.query(Documento.cdc_de, Documento.id)
+        .filter(Documento.cdc_de.in_(cdcs))
+        .all()
+    )
+    faltantes = cdcs - ids_por_cdc.keys()
+    if faltantes:
+        # Esto es error grave de tu sistema: mandaste un CDC que no existe
+        db.rollback()
+        raise ValueError(f"CDC {sorted(faltantes)[0]} no existe en de_documento")
+
+    # ---------------------
+    # Actualizar Documento (un UPDATE por estado)
+    # ---------------------
+    por_estado = {}
+    for r in resultados:
+        estado = "APROBADO" if r.est_res and r.est_res.upper() == "APROBADO" else "RECHAZADO"
+        por_estado.setdefault(estado, []).append(ids_por_cdc[r.cdc])
+
+    ahora = datetime.utcnow()
+    for estado, ids in por_estado.items():
+        db.execute(
+            update(Documento)
+            .where(Documento.id.in_(ids))
+            .values(
+                estado_actual=estado,
+                fecha_ultima_consulta=ahora,
+                intentos_consulta=func.coalesce(Documento.intentos_consulta, 0) + 1,
             )
-            .first()
         )
 
-        if not lote_doc:
-            lote_doc = LoteDocumento(
-                lote_id=lote.id,
-                documento_id=documento.id,
-                cdc=cdc,
-            )
-
-        lote_doc.estado_resultado = estado_res.upper() if estado_res else None
-        lote_doc.codigo_error = cod_res
-        lote_doc.mensaje_error = msg_res
-        db.add(lote_doc)
-
-        # ---------------------
-        # Guardar consulta documento
-        # ---------------------
-        cons_doc = ConsultaDocumento(
-            consulta_lote_id=consulta_lote.id,
-            documento_id=documento.id,
-            cdc=cdc,
-        )
-        db.add(cons_doc)
+    # ---------------------
+    # Historial de estados
+    # ---------------------
+    db.execute(insert(Estado), [
+        {
+            "de_id": ids_por_cdc[r.cdc],
+            "dcodres": r.cod_res or "0000",
+            "dmsgres": (r.msg_res or r.est_res or "SIN MENSAJE")[:255],
+            "dfecproc": fecha_proc,
+        }
+        for r in resultados
+    ])
+
+    # ---------------------
+    # Relación lote-documento (upsert sobre uq_lote_documento)
+    # ---------------------
+    upsert = pg_insert(LoteDocumento).values([
+        {
+            "lote_id": lote_id,
+            "documento_id": ids_por_cdc[r.cdc],
+            "estado_resultado": r.est_res.upper() if r.est_res else None,
+            "codigo_error": r.cod_res,
+            "mensaje_error": r.msg_res,
+        }
+        for r in resultados
+    ])
+    db.execute(upsert.on_conflict_do_update(
+        constraint="uq_lote_documento",
+        set_={
+            "estado_resultado": upsert.excluded.estado_resultado,
+            "codigo_error": upsert.excluded.codigo_error,
+            "mensaje_error": upsert.excluded.mensaje_error,
+        },
+    ))
+
+    # ---------------------
+    # Guardar consulta documento
+    # ---------------------
+    db.execute(insert(ConsultaDocumento), [
+        {
+            "consulta_lote_id": consulta_lote_id,
+            "documento_id": ids_por_cdc[r.cdc],
+            "cdc": r.cdc,
+        }
+        for r in resultados
+    ])
 
     db.commit()
     return True
 
-
-def _parse_datetime(value: str | None):
-    if not value:
-        return None
-    # Ej: 2026-01-27T13:14:34-03:00
-    return datetime.fromisoformat(value.replace("Z", "+00:00"))
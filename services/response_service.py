@@ -1,10 +1,43 @@
 from sqlalchemy.orm import Session
 from datetime import datetime
 from domain.models.models import Estado
-import xml.etree.ElementTree as ET
+from utils.parseSifen import parse_protocolo_de
 import html
 
-def getResponse(xml_string: str, db: Session, documento_id: int) -> Estado:
+
+def leerProtDe(xml_string: str) -> dict:
+    """
+    Extrae los datos del rProtDe de una respuesta de SIFEN (rEnviDe).
+    No toca la base de datos: se puede ejecutar en cualquier hilo.
+    
+    Returns:
+        dict con dcodres, dmsgres, dfecproc, est_res y prot_aut
+    """
+    prot = parse_protocolo_de(xml_string)
+    
+    dcodres = prot.cod_res or '0000'
+    # Decodificar HTML entities
+    dmsgres = html.unescape(prot.msg_res or 'Sin mensaje')
+    
+    # Parsear fecha
+    dfecproc = None
+    if prot.fec_proc:
+        try:
+            dfecproc = datetime.fromisoformat(prot.fec_proc.replace('Z', '+00:00'))
+        except:
+            dfecproc = datetime.now()
+    
+    return {
+        "dcodres": dcodres,
+        "dmsgres": dmsgres,
+        "dfecproc": dfecproc,
+        "est_res": prot.est_res,
+        "prot_aut": prot.prot_aut,
+    }
+
+
+def getResponse(xml_string: str, db: Session, documento_id: int,
+                protocolo: dict = None, commit: bool = True) -> Estado:
     """
     Guarda la respuesta XML del SIFEN en la tabla de estados.
     
@@ -12,57 +45,34 @@ def getResponse(xml_string: str, db: Session, documento_id: int) -> Estado:
         xml_string: XML de respuesta
         db: Sesión de base de datos
         documento_id: ID del documento relacionado
+        protocolo: rProtDe ya leído con leerProtDe (evita parsear de nuevo)
+        commit: False para dejar el estado en la transacción del llamador
     
     Returns:
         Objeto Estado creado
     """
     try:
-        root = ET.fromstring(xml_string)
-        
-        # Namespaces
-        ns = {
-            'ns2': 'http://ekuatia.set.gov.py/sifen/xsd',
-            'env': 'http://www.w3.org/2003/05/soap-envelope'
-        }
-        
-        # Buscar elementos
-        rprotde = root.find('.//ns2:rProtDe', ns)
-        
-        if rprotde is None:
-            raise ValueError("XML no contiene rProtDe")
-        
-        # Extraer datos
-        dcodres = rprotde.findtext('ns2:gResProc/ns2:dCodRes', default='0000', namespaces=ns)
-        dmsgres = rprotde.findtext('ns2:gResProc/ns2:dMsgRes', default='Sin mensaje', namespaces=ns)
-        dfecproc_str = rprotde.findtext('ns2:dFecProc', namespaces=ns)
-        
-        # Decodificar HTML entities
-        dmsgres = html.unescape(dmsgres)
-        
-        # Parsear fecha
-        dfecproc = None
-        if dfecproc_str:
-            try:
-                dfecproc = datetime.fromisoformat(dfecproc_str.replace('Z', '+00:00'))
-            except:
-                dfecproc = datetime.now()
+        datos = protocolo or leerProtDe(xml_string)
         
         # Crear y guardar estado
         estado = Estado(
             de_id=documento_id,
-            dcodres=dcodres,
-            dmsgres=dmsgres[:255],  # Limitar a 255 caracteres
-            dfecproc=dfecproc or datetime.now()
+            dcodres=datos["dcodres"],
+            dmsgres=datos["dmsgres"][:255],  # Limitar a 255 caracteres
+            dfecproc=datos["dfecproc"] or datetime.now()
         )
         
         db.add(estado)
-        db.commit()
-        db.refresh(estado)
+        if commit:
+            db.commit()
+            db.refresh(estado)
+        else:
+            db.flush()
         
         return estado
         
-    except ET.ParseError:
-        raise ValueError("XML mal formado")
+    except ValueError:
+        raise
     except Exception as e:
         db.rollback()
-        raise Exception(f"Error guardando respuesta: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Error guardando respuesta: {str(e)}")
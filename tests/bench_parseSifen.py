@@ -0,0 +1,47 @@
+"""
+Benchmark del parser unificado (utils/parseSifen) contra los parsers anteriores.
+
+    python -m tests.bench_parseSifen [repeticiones]
+
+No es un test de pytest: solo imprime tiempos por llamada.
+"""
+
+import sys
+import timeit
+
+from tests.test_parseSifen import RESPUESTA_EVENTO, respuesta_lote
+from utils.parseResponseEvento import parse_evento_response
+from utils.parseResponseLote import parse_lote_response
+from utils.parseSifen import parse_respuesta_evento, parse_respuesta_lote
+
+
+def _medir(funcion, repeticiones: int) -> float:
+    """Mejor de 5 corridas, en microsegundos por llamada"""
+    return min(timeit.repeat(funcion, number=repeticiones, repeat=5)) / repeticiones * 1e6
+
+
+def main(repeticiones: int = 200):
+    casos = []
+    for cantidad in (1, 50, 1000):
+        xml = respuesta_lote(cantidad)
+        casos.append((f"lote {cantidad} DEs", [
+            ("parse_lote_response (ET)", lambda xml=xml: parse_lote_response(xml)),
+            ("parse_respuesta_lote", lambda xml=xml: parse_respuesta_lote(xml)),
+            ("parse_respuesta_lote stream", lambda xml=xml: parse_respuesta_lote(xml, streaming=True)),
+        ]))
+    casos.append(("evento", [
+        ("parse_evento_response (.//)", lambda: parse_evento_response(RESPUESTA_EVENTO)),
+        ("parse_respuesta_evento", lambda: parse_respuesta_evento(RESPUESTA_EVENTO)),
+    ]))
+
+    for nombre, funciones in casos:
+        print(f"\n{nombre}")
+        base = None
+        for etiqueta, funcion in funciones:
+            micros = _medir(funcion, repeticiones)
+            base = base or micros
+            print(f"  {etiqueta:<32} {micros:>10.1f} µs   x{base / micros:.2f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
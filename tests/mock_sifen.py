@@ -0,0 +1,382 @@
+"""
+Servidor SIFEN simulado para pruebas de carga y latencia sin los endpoints de la SET.
+
+Atiende por HTTPS (con mTLS opcional) o HTTP las operaciones SOAP 1.2 que
+usa el daemon, identificadas por el elemento del Body (la ruta da igual):
+
+    rEnvioLote          -> rResEnviLoteDe       (0300, dProtConsLote)
+    rEnviConsLoteDe     -> rResEnviConsLoteDe   (0361 mientras procesa, luego 0362)
+    rEnviDe             -> rRetEnviDe/rProtDe   (0260 / rechazo)
+    rEnviEventoDe       -> rRetEnviEventoDe     (0600)
+    rEnviConsDeRequest  -> rEnviConsDeResponse  (0422 / 0420)
+    rEnviConsRUC        -> rResEnviConsRUC      (0502)
+
+Las respuestas tienen el mismo formato que las reales (ver tests/output);
+con `ConfigMock.respuestas_fijas` se puede devolver un archivo tal cual.
+
+Uso como script (apuntar LOTE_ENDPOINT, CONSULTA_LOTE_ENDPOINT,
+RECIBE_ENDPOINT, EVENTO_ENDPOINT, ... a https://localhost:8443/ y
+SOAP_CA_BUNDLE al certificado del servidor):
+
+    python -m tests.mock_sifen --puerto 8443 --cert srv.pem --key srv.key \\
+        --ca-clientes ca.pem --latencia 0.2 --tasa-error 0.01 --demora-lote 30
+
+Uso en tests:
+
+    with MockSifen(ConfigMock(rechazar={cdc})) as mock:
+        requests.post(mock.url, data=sobre)
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import random
+import ssl
+import threading
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from typing import Dict, List, Optional, Set, Tuple
+
+NS_SIFEN = "http://ekuatia.set.gov.py/sifen/xsd"
+NS_SOAP = "http://www.w3.org/2003/05/soap-envelope"
+
+_SOBRE = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<env:Envelope xmlns:env="http://www.w3.org/2003/05/soap-envelope"><env:Header/><env:Body>'
+    '{}'
+    '</env:Body></env:Envelope>'
+)
+
+
+@dataclass
+class ConfigMock:
+    """Comportamiento del servidor simulado"""
+    latencia: float = 0.0               # segundos fijos por respuesta
+    jitter: float = 0.0                 # segundos aleatorios extra (0..jitter)
+    tasa_error: float = 0.0             # probabilidad de HTTP 500 (falla de SIFEN)
+    demora_lote: float = 0.0            # segundos que un lote responde 0361 (en procesamiento)
+    tasa_rechazo: float = 0.0           # fracción de CDC rechazados (determinística por CDC)
+    rechazar: Set[str] = field(default_factory=set)   # CDC rechazados siempre
+    respuestas_fijas: Dict[str, str] = field(default_factory=dict)  # operación -> archivo XML
+    semilla: Optional[int] = None
+
+
+class EstadoMock:
+    """Lotes recibidos y contadores; compartido por los hilos del servidor"""
+
+    def __init__(self, config: ConfigMock):
+        self.config = config
+        self.lotes: Dict[str, Tuple[float, List[str]]] = {}
+        self.documentos: Dict[str, Tuple[str, str, str]] = {}
+        self.solicitudes: Dict[str, int] = {}
+        self._protocolos = count(5586437372087769201)
+        self._autorizaciones = count(3042178502)
+        self._random = random.Random(config.semilla)
+        self._lock = threading.Lock()
+
+    def contar(self, operacion: str):
+        with self._lock:
+            self.solicitudes[operacion] = self.solicitudes.get(operacion, 0) + 1
+
+    def sortear_error(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.config.tasa_error
+
+    def demora(self) -> float:
+        with self._lock:
+            return self.config.latencia + self._random.uniform(0, self.config.jitter)
+
+    def resultado(self, cdc: str) -> Tuple[str, str, str]:
+        """(dEstRes, dCodRes, dMsgRes) del CDC; siempre el mismo para el mismo CDC"""
+        with self._lock:
+            if cdc in self.documentos:
+                return self.documentos[cdc]
+        rechazado = cdc in self.config.rechazar
+        if not rechazado and self.config.tasa_rechazo:
+            fraccion = int(hashlib.sha1(cdc.encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+            rechazado = fraccion < self.config.tasa_rechazo
+        if rechazado:
+            res = ("Rechazado", "1001", "CDC duplicado")
+        else:
+            res = ("Aprobado", "0260", "Autorización del DE satisfactoria")
+        with self._lock:
+            self.documentos[cdc] = res
+        return res
+
+    def registrar_lote(self, cdcs: List[str]) -> str:
+        with self._lock:
+            protocolo = str(next(self._protocolos))
+            self.lotes[protocolo] = (time.monotonic(), cdcs)
+        return protocolo
+
+    def autorizacion(self) -> str:
+        with self._lock:
+            return str(next(self._autorizaciones))
+
+
+# ---------------------------------------------------------------------- respuestas
+
+def _fecha() -> str:
+    return datetime.now().astimezone().isoformat(timespec="seconds")
+
+
+def _ns2(tag: str, contenido: str = "", attrs: str = "") -> str:
+    return f"<ns2:{tag}{attrs}>{contenido}</ns2:{tag}>"
+
+
+def _raiz(tag: str, contenido: str) -> str:
+    return _SOBRE.format(_ns2(tag, contenido, f' xmlns:ns2="{NS_SIFEN}"'))
+
+
+def _res_proc(cod: str, msg: str) -> str:
+    return _ns2("gResProc", _ns2("dCodRes", cod) + _ns2("dMsgRes", msg))
+
+
+def _cdcs(nodo: ET.Element) -> List[str]:
+    """Id de cada DE firmado (rDE/DE@Id)"""
+    return [de.get("Id") for de in nodo.iter(f"{{{NS_SIFEN}}}DE")]
+
+
+def _texto(cuerpo: ET.Element, tag: str) -> str:
+    return cuerpo.findtext(f"{{{NS_SIFEN}}}{tag}") or ""
+
+
+def responder_envio_lote(estado: EstadoMock, cuerpo: ET.Element) -> str:
+    xde = _texto(cuerpo, "xDE")
+    with zipfile.ZipFile(io.BytesIO(base64.b64decode(xde))) as zf:
+        lote = b"".join(zf.read(nombre) for nombre in zf.namelist())
+    protocolo = estado.registrar_lote(_cdcs(ET.fromstring(lote)))
+    return _raiz("rResEnviLoteDe",
+                 _ns2("dFecProc", _fecha())
+                 + _ns2("dCodRes", "0300")
+                 + _ns2("dMsgRes", "Lote recibido con éxito")
+                 + _ns2("dProtConsLote", protocolo)
+                 + _ns2("dTpoProces", "0"))
+
+
+def responder_consulta_lote(estado: EstadoMock, cuerpo: ET.Element) -> str:
+    protocolo = _texto(cuerpo, "dProtConsLote").strip()
+    lote = estado.lotes.get(protocolo)
+    if lote is None:
+        return _raiz("rResEnviConsLoteDe",
+                     _ns2("dFecProc", _fecha())
+                     + _ns2("dCodResLot", "0360")
+                     + _ns2("dMsgResLot", f"Número de Lote {{{protocolo}}} inexistente"))
+
+    recibido, cdcs = lote
+    if time.monotonic() - recibido < estado.config.demora_lote:
+        return _raiz("rResEnviConsLoteDe",
+                     _ns2("dFecProc", _fecha())
+                     + _ns2("dCodResLot", "0361")
+                     + _ns2("dMsgResLot", f"Lote {{{protocolo}}} en procesamiento"))
+
+    detalles = []
+    for cdc in cdcs:
+        est_res, cod, msg = estado.resultado(cdc)
+        detalles.append(_ns2("gResProcLote",
+                             _ns2("id", cdc)
+                             + _ns2("dEstRes", est_res)
+                             + (_ns2("dProtAut", estado.autorizacion()) if est_res == "Aprobado" else "")
+                             + _res_proc(cod, msg)))
+    return _raiz("rResEnviConsLoteDe",
+                 _ns2("dFecProc", _fecha())
+                 + _ns2("dCodResLot", "0362")
+                 + _ns2("dMsgResLot", f"Procesamiento de lote {{{protocolo}}} concluido")
+                 + "".join(detalles))
+
+
+def responder_envio_de(estado: EstadoMock, cuerpo: ET.Element) -> str:
+    cdcs = _cdcs(cuerpo) or [""]
+    est_res, cod, msg = estado.resultado(cdcs[0])
+    return _raiz("rRetEnviDe", _ns2("rProtDe",
+                                    _ns2("Id", cdcs[0])
+                                    + _ns2("dFecProc", _fecha())
+                                    + _ns2("dDigVal", "bW9jaw==")
+                                    + _ns2("dEstRes", est_res)
+                                    + (_ns2("dProtAut", estado.autorizacion()) if est_res == "Aprobado" else "")
+                                    + _res_proc(cod, msg)))
+
+
+def responder_evento(estado: EstadoMock, cuerpo: ET.Element) -> str:
+    rEve = cuerpo.find(f".//{{{NS_SIFEN}}}rEve")
+    id_evento = rEve.get("Id", "1") if rEve is not None else "1"
+    return _raiz("rRetEnviEventoDe",
+                 _ns2("dFecProc", _fecha())
+                 + _ns2("gResProcEVe",
+                        _ns2("dEstRes", "Aprobado")
+                        + _ns2("dProtAut", estado.autorizacion())
+                        + _ns2("id", id_evento)
+                        + _res_proc("0600", "Evento registrado correctamente")))
+
+
+def responder_consulta_de(estado: EstadoMock, cuerpo: ET.Element) -> str:
+    cdc = _texto(cuerpo, "dCDC")
+    if cdc in estado.documentos:
+        cod, msg = "0422", "CDC encontrado"
+    else:
+        cod, msg = "0420", "Documento No Existe en SIFEN o ha sido Rechazado"
+    return _raiz("rEnviConsDeResponse",
+                 _ns2("dFecProc", _fecha()) + _ns2("dCodRes", cod) + _ns2("dMsgRes", msg))
+
+
+def responder_consulta_ruc(estado: EstadoMock, cuerpo: ET.Element) -> str:
+    ruc = _texto(cuerpo, "dRUCCons")
+    return _raiz("rResEnviConsRUC",
+                 _ns2("dCodRes", "0502")
+                 + _ns2("dMsgRes", "RUC encontrado")
+                 + _ns2("xContRUC",
+                        _ns2("dRUCCons", ruc)
+                        + _ns2("dRazCons", "CONTRIBUYENTE SIMULADO")
+                        + _ns2("dCodEstCons", "ACT")
+                        + _ns2("dDesEstCons", "ACTIVO")
+                        + _ns2("dRUCFactElec", "S")))
+
+
+OPERACIONES = {
+    "rEnvioLote": responder_envio_lote,
+    "rEnviConsLoteDe": responder_consulta_lote,
+    "rEnviDe": responder_envio_de,
+    "rEnviEventoDe": responder_evento,
+    "rEnviConsDeRequest": responder_consulta_de,
+    "rEnviConsRUC": responder_consulta_ruc,
+}
+
+
+# ---------------------------------------------------------------------- servidor
+
+class _Manejador(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"    # keep-alive, como SIFEN
+    estado: EstadoMock = None
+
+    def do_POST(self):
+        largo = int(self.headers.get("Content-Length", 0))
+        cuerpo_http = self.rfile.read(largo)
+
+        time.sleep(self.estado.demora())
+        if self.estado.sortear_error():
+            self._enviar(500, b"Error interno simulado")
+            return
+
+        try:
+            body = ET.fromstring(cuerpo_http).find(f"{{{NS_SOAP}}}Body")
+            operacion_xml = next(iter(body))
+            operacion = operacion_xml.tag.split("}")[-1]
+        except Exception:
+            self._enviar(400, b"SOAP invalido")
+            return
+
+        self.estado.contar(operacion)
+        fija = self.estado.config.respuestas_fijas.get(operacion)
+        if fija:
+            with open(fija, "rb") as f:
+                self._enviar(200, f.read())
+            return
+
+        responder = OPERACIONES.get(operacion)
+        if responder is None:
+            self._enviar(404, f"Operacion no soportada: {operacion}".encode())
+            return
+        self._enviar(200, responder(self.estado, operacion_xml).encode("utf-8"))
+
+    def _enviar(self, codigo: int, contenido: bytes):
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/soap+xml; charset=UTF-8")
+        self.send_header("Content-Length", str(len(contenido)))
+        self.end_headers()
+        self.wfile.write(contenido)
+
+    def log_message(self, *args):
+        pass
+
+
+class MockSifen:
+    """
+    Servidor en un hilo. Con `cert`/`key` atiende HTTPS; con además
+    `ca_clientes` exige certificado cliente (mTLS) firmado por esa CA.
+    """
+
+    def __init__(self, config: ConfigMock = None, host: str = "127.0.0.1", puerto: int = 0,
+                 cert: str = None, key: str = None, ca_clientes: str = None):
+        self.estado = EstadoMock(config or ConfigMock())
+        manejador = type("Manejador", (_Manejador,), {"estado": self.estado})
+        self.servidor = ThreadingHTTPServer((host, puerto), manejador)
+        self.servidor.daemon_threads = True
+        self.esquema = "http"
+
+        if cert:
+            contexto = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            contexto.load_cert_chain(cert, key)
+            if ca_clientes:
+                contexto.verify_mode = ssl.CERT_REQUIRED
+                contexto.load_verify_locations(ca_clientes)
+            self.servidor.socket = contexto.wrap_socket(self.servidor.socket, server_side=True)
+            self.esquema = "https"
+
+        self._hilo = None
+
+    @property
+    def url(self) -> str:
+        host, puerto = self.servidor.server_address[:2]
+        return f"{self.esquema}://{'localhost' if host == '127.0.0.1' else host}:{puerto}/de/ws"
+
+    def iniciar(self) -> "MockSifen":
+        self._hilo = threading.Thread(target=self.servidor.serve_forever, name="mock-sifen", daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.detener()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor SIFEN simulado")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8443)
+    parser.add_argument("--cert", help="certificado del servidor (HTTPS)")
+    parser.add_argument("--key", help="clave del servidor")
+    parser.add_argument("--ca-clientes", help="CA de los certificados cliente (habilita mTLS)")
+    parser.add_argument("--latencia", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--tasa-error", type=float, default=0.0)
+    parser.add_argument("--demora-lote", type=float, default=0.0)
+    parser.add_argument("--tasa-rechazo", type=float, default=0.0)
+    parser.add_argument("--rechazar", nargs="*", default=[], help="CDC a rechazar")
+    parser.add_argument("--fija", nargs="*", default=[], metavar="OPERACION=ARCHIVO",
+                        help="respuesta fija, ej. rEnviConsLoteDe=tests/output/last_soap_response.xml")
+    args = parser.parse_args()
+
+    config = ConfigMock(
+        latencia=args.latencia,
+        jitter=args.jitter,
+        tasa_error=args.tasa_error,
+        demora_lote=args.demora_lote,
+        tasa_rechazo=args.tasa_rechazo,
+        rechazar=set(args.rechazar),
+        respuestas_fijas=dict(f.split("=", 1) for f in args.fija),
+    )
+    mock = MockSifen(config, args.host, args.puerto, args.cert, args.key, args.ca_clientes)
+    print(f"🧪 SIFEN simulado en {mock.url}")
+    try:
+        mock.servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock.servidor.server_close()
+        print(f"📊 Solicitudes: {mock.estado.solicitudes}")
+
+
+if __name__ == "__main__":
+    main()
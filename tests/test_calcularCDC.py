@@ -0,0 +1,43 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+from utils.buildCDC import buildCDC, calcularCDC
+
+
+class _SesionFalsa:
+    def add(self, obj):
+        pass
+
+
+def _doc():
+    return SimpleNamespace(
+        tipo_doc=1,
+        drucem="80012345",
+        dnumdoc="15",
+        dfeemide=datetime(2025, 12, 18, 14, 17, 10),
+        cdc_de=None,
+        ddvid=None,
+        emisor=SimpleNamespace(ddvemi=7, itipcont=2),
+        timbrado=SimpleNamespace(dest="1", dpunexp="1"),
+        operacion=SimpleNamespace(itipemi=1, dcodseg="123456789"),
+    )
+
+
+def test_calcular_cdc_no_modifica_documento():
+    doc = _doc()
+
+    cdc, dv = calcularCDC(doc)
+
+    assert len(cdc) == 44
+    assert cdc.endswith(str(dv))
+    assert doc.cdc_de is None and doc.ddvid is None
+
+
+def test_calcular_cdc_coincide_con_buildCDC():
+    doc = _doc()
+    cdc, dv = calcularCDC(doc)
+
+    buildCDC(_SesionFalsa(), doc, commit=False)
+
+    assert doc.cdc_de == cdc
+    assert doc.ddvid == dv
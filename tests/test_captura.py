@@ -0,0 +1,108 @@
+import os
+import time
+
+import pytest
+import requests
+
+from config.setting import settings
+from core.infraestructure.soap import captura, soap_client
+from core.infraestructure.soap.soap_client import SOAPClient
+from tests.mock_sifen import ConfigMock, MockSifen
+
+NS = "http://ekuatia.set.gov.py/sifen/xsd"
+CDC = "01048496782001001000002122026030515328616516"
+XDE = f'<rDE xmlns="{NS}"><DE Id="{CDC}"><dDesPro>{"x" * 300}</dDesPro></DE></rDE>'.encode()
+
+
+def _sobre(did: int) -> bytes:
+    return (
+        '<soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope"><soap:Body>'
+        f'<rEnviDe xmlns="{NS}"><dId>{did}</dId><xDE>'
+    ).encode() + XDE + b"</xDE></rEnviDe></soap:Body></soap:Envelope>"
+
+
+@pytest.fixture
+def cliente(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "SOAP_CAPTURA_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "SOAP_CAPTURA_BUFFER", 3)
+    monkeypatch.setattr(settings, "SOAP_CAPTURA_MAX_BYTES", 400)
+    monkeypatch.setattr(captura, "_buffers", {})
+    monkeypatch.setattr(captura, "_ultimo_error", {})
+    # El mock va por http: no hace falta el certificado del emisor
+    monkeypatch.setattr(soap_client, "obtener_sesion", lambda *args: requests.Session())
+    return SOAPClient("cert.pem", "key.pem", debug=True)
+
+
+def test_muestreo_buffer_y_volcado(cliente, monkeypatch, tmp_path):
+    with MockSifen() as mock:
+        monkeypatch.setattr(settings, "SOAP_CAPTURA_MUESTREO", 0.0)
+        cliente.send(mock.url, _sobre(1))
+        assert captura.capturados() == []
+
+        monkeypatch.setattr(settings, "SOAP_CAPTURA_MUESTREO", 1.0)
+        for did in range(2, 7):
+            cliente.send(mock.url, _sobre(did))
+
+    capturados = captura.capturados(mock.url)
+    assert [c.status for c in capturados] == [200, 200, 200]                # últimos 3
+    assert all(len(c.solicitud) <= 400 for c in capturados)
+    assert os.listdir(tmp_path) == []                                       # nada a disco
+
+    ruta = captura.volcar()
+    captura.esperar_escritura()
+    volcado = open(ruta, "rb").read()
+    assert volcado.count(b"--- solicitud ---") == 3
+    solicitud = volcado.split(b"--- respuesta ---")[0]
+    assert CDC.encode() not in solicitud and b"[redactado" in solicitud
+
+
+def test_error_se_captura_y_escribe_siempre(cliente, monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "SOAP_CAPTURA_MUESTREO", 0.0)
+    with MockSifen(ConfigMock(tasa_error=1.0)) as mock:
+        with pytest.raises(requests.HTTPError):
+            cliente.send(mock.url, _sobre(1))
+
+    captura.esperar_escritura()
+    archivos = os.listdir(tmp_path)
+    assert len(archivos) == 1 and archivos[0].endswith("-rEnviDe.log")
+    assert [c.status for c in captura.capturados()] == [500]
+
+
+def test_errores_seguidos_se_escriben_juntos(cliente, monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "SOAP_CAPTURA_MUESTREO", 0.0)
+    with MockSifen(ConfigMock(tasa_error=1.0)) as mock:
+        for did in range(1, 4):
+            with pytest.raises(requests.HTTPError):
+                cliente.send(mock.url, _sobre(did))
+        captura.esperar_escritura()
+        assert len(os.listdir(tmp_path)) == 1      # uno por intervalo y endpoint
+
+        monkeypatch.setattr(settings, "SOAP_CAPTURA_ERRORES_INTERVALO", 0)
+        with pytest.raises(requests.HTTPError):
+            cliente.send(mock.url, _sobre(4))
+
+    captura.esperar_escritura()
+    ultimo = max(os.listdir(tmp_path))
+    # El segundo archivo trae los omitidos que quedaron en el buffer (3 como máximo)
+    assert open(tmp_path / ultimo, "rb").read().count(b"--- solicitud ---") == 3
+
+
+def test_senal_solo_marca_y_vuelca_el_escritor(cliente, monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "SOAP_CAPTURA_MUESTREO", 1.0)
+    with MockSifen() as mock:
+        cliente.send(mock.url, _sobre(1))
+
+    # Con el lock tomado (el hilo principal en medio de _guardar) el handler no se bloquea
+    with captura._lock:
+        captura._pedir_volcado(None, None)
+
+    limite = time.monotonic() + 5
+    while not os.listdir(tmp_path) and time.monotonic() < limite:
+        time.sleep(0.05)
+    captura.esperar_escritura()
+    assert [a.startswith("captura-") for a in os.listdir(tmp_path)] == [True]
+
+
+def test_redactar_cuerpo_recortado():
+    recortado = b"<ns0:rEnviDe><ns0:xDE>" + XDE[:100]
+    assert captura.redactar(recortado) == b"<ns0:rEnviDe><ns0:xDE>[redactado 100 bytes]"
@@ -0,0 +1,66 @@
+import pytest
+import requests
+
+from config.setting import settings
+from core.infraestructure.soap import cassette, soap_client
+from core.infraestructure.soap.cassette import CassetteSinRespuesta, clave_soap
+from core.infraestructure.soap.soap_client import SOAPClient
+from tests.mock_sifen import ConfigMock, MockSifen
+from utils.parseSifen import parse_protocolo_de
+
+CDC = "01048496782001001000002122026030515328616516"
+NS = "http://ekuatia.set.gov.py/sifen/xsd"
+
+
+def _sobre(operacion: str, contenido: str) -> bytes:
+    return (
+        '<soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope"><soap:Body>'
+        f'<{operacion} xmlns="{NS}">{contenido}</{operacion}>'
+        '</soap:Body></soap:Envelope>'
+    ).encode()
+
+
+def _envio_de(did: int) -> bytes:
+    rde = f'<rDE xmlns="{NS}"><DE Id="{CDC}"/></rDE>'
+    return _sobre("rEnviDe", f"<dId>{did}</dId><xDE>{rde}</xDE>")
+
+
+@pytest.fixture
+def modo(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "SOAP_CASSETTE", str(tmp_path))
+    monkeypatch.setattr(settings, "SOAP_REPLAY_ESCALA", 0.0)
+    # La solicitud sin respuesta grabada se captura como error: que no quede en el repo
+    monkeypatch.setattr(settings, "SOAP_CAPTURA_DIR", str(tmp_path / "capturas"))
+
+    def cambiar(nuevo):
+        monkeypatch.setattr(settings, "SOAP_TRANSPORTE", nuevo)
+        monkeypatch.setattr(cassette, "_transporte", None)
+
+    return cambiar
+
+
+def test_clave_soap():
+    assert clave_soap(_envio_de(15)) == ("rEnviDe", "15")
+    assert clave_soap(b"<env:Body><xsd:rEnviEventoDe><xsd:dId> 7 </xsd:dId>") == ("rEnviEventoDe", "7")
+
+
+def test_grabar_y_reproducir_sin_red(modo, monkeypatch):
+    # El mock va por http: no hace falta el certificado del emisor
+    monkeypatch.setattr(soap_client, "obtener_sesion", lambda *args: requests.Session())
+    cliente = SOAPClient("cert.pem", "key.pem", debug=False)
+
+    modo("grabar")
+    with MockSifen(ConfigMock(latencia=0.05)) as mock:
+        grabada = cliente.send(mock.url, _envio_de(1)).content
+        cassette.obtener_cassette().cerrar()
+
+    # El mock ya no existe: la respuesta sale del cassette
+    modo("reproducir")
+    reproducida = cliente.send(mock.url, _envio_de(1))
+
+    assert reproducida.status_code == 200
+    assert reproducida.content == grabada
+    assert parse_protocolo_de(reproducida.text).cod_res == "0260"
+
+    with pytest.raises(CassetteSinRespuesta):
+        cliente.send(mock.url, _envio_de(2))
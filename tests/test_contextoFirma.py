@@ -0,0 +1,69 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+from core.infraestructure.xml.sign_xml import obtener_contexto_firma
+
+
+def _credenciales(tmp_path, password=None):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    nombre = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Emisor Test")])
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(nombre)
+        .issuer_name(nombre)
+        .public_key(key.public_key())
+        .serial_number(1234)
+        .not_valid_before(datetime.utcnow())
+        .not_valid_after(datetime.utcnow() + timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    cifrado = (
+        serialization.BestAvailableEncryption(password.encode())
+        if password else serialization.NoEncryption()
+    )
+    cert_path = tmp_path / "cert.pem"
+    key_path = tmp_path / "key.pem"
+    cert_path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, cifrado
+    ))
+    return str(cert_path), str(key_path)
+
+
+def test_contexto_se_reutiliza_y_precalcula_issuer_serial(tmp_path):
+    cert_path, key_path = _credenciales(tmp_path)
+
+    ctx1 = obtener_contexto_firma(cert_path, key_path)
+    ctx2 = obtener_contexto_firma(cert_path, key_path)
+
+    assert ctx1 is ctx2
+    assert ctx1.serial_number == "1234"
+    assert "Emisor Test" in ctx1.issuer_name
+
+
+def test_contexto_se_recarga_si_cambia_mtime(tmp_path):
+    cert_path, key_path = _credenciales(tmp_path)
+    ctx1 = obtener_contexto_firma(cert_path, key_path)
+
+    os.utime(key_path, (0, ctx1.mtimes[1] + 10))
+
+    assert obtener_contexto_firma(cert_path, key_path) is not ctx1
+
+
+def test_clave_cifrada_usa_password_del_emisor(tmp_path):
+    cert_path, key_path = _credenciales(tmp_path, password="secreto")
+
+    assert obtener_contexto_firma(cert_path, key_path, "secreto").key is not None
+
+
+def test_clave_cifrada_con_password_erroneo(tmp_path):
+    cert_path, key_path = _credenciales(tmp_path, password="secreto")
+
+    with pytest.raises(ValueError):
+        obtener_contexto_firma(cert_path, key_path, "otra")
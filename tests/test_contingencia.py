@@ -0,0 +1,107 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from config.setting import settings
+from core.infraestructure.soap import resiliencia
+from core.infraestructure.soap.resiliencia import CircuitoAbierto
+from services.factura_service import FacturaService, endpoint_lote
+
+
+class LoteRepoFalso:
+    def __init__(self, spool=()):
+        self.spool = list(spool)
+        self.cambios = []
+        self.tandas = []
+
+    def actualizar_estado_lotes(self, lote_ids, estado, commit=True):
+        self.cambios.append((list(lote_ids), estado))
+        return len(lote_ids)
+
+    def renovar_lease(self, lote_id, lease):
+        return datetime.now() if lease is not None else None
+
+    def reclamar_lotes_contingencia(self, limit=100, excluir=()):
+        self.tandas.append(limit)
+        tanda, self.spool = self.spool[:limit], self.spool[limit:]
+        return tanda
+
+
+class LoteDocRepoFalso:
+    def documentos_por_lotes(self, lote_ids):
+        return {lote_id: [{"documento_id": lote_id * 10}] for lote_id in lote_ids}
+
+
+def _servicio(spool=()):
+    service = FacturaService.__new__(FacturaService)
+    service.db = SimpleNamespace(rollback=lambda: None)
+    service.lote_repo = LoteRepoFalso(spool)
+    service.lote_doc_repo = LoteDocRepoFalso()
+    return service
+
+
+def _lote(lote_id):
+    emisor = SimpleNamespace(id=1, drucem="80069563", cert_path="c.pem", key_path="k.pem")
+    return SimpleNamespace(id=lote_id, xml_request="<rLoteDE/>", emisor=emisor, fecha_envio=datetime(2026, 1, 1))
+
+
+def _trabajo(lote_id):
+    return FacturaService._trabajo_envio(lote_id, b"<rLoteDE/>", _lote(lote_id).emisor, [{"documento_id": 1}])
+
+
+@pytest.fixture(autouse=True)
+def circuitos(monkeypatch):
+    monkeypatch.setattr(resiliencia, "_circuitos", {})
+
+
+def _abrir_circuito():
+    circuito = resiliencia.obtener_circuito(endpoint_lote)
+    circuito.fallas = settings.SOAP_CIRCUITO_FALLOS
+    circuito.abierto_hasta = float("inf")
+
+
+def test_lote_no_recibido_va_al_spool():
+    service = _servicio()
+
+    resultado = service.registrar_envio(_trabajo(5), None, CircuitoAbierto(endpoint_lote, 30))
+
+    assert resultado["estado"] == "LOTE_CONTINGENCIA"
+    assert service.lote_repo.cambios == [([5], "LOTE_CONTINGENCIA")]
+
+
+def test_circuito_abierto_no_envia_y_encola_en_bloque(monkeypatch):
+    _abrir_circuito()
+    monkeypatch.setattr(FacturaService, "enviar_soap", staticmethod(lambda trabajo: pytest.fail("no debe enviar")))
+    service = _servicio()
+
+    resultados = service._despachar([_trabajo(1), _trabajo(2), _trabajo(3)])
+
+    assert [r["estado"] for r in resultados] == ["LOTE_CONTINGENCIA"] * 3
+    assert service.lote_repo.cambios == [([1, 2, 3], "LOTE_CONTINGENCIA")]
+    assert service.lotes_contingencia_pendientes() == []
+
+
+def test_drenaje_por_tandas(monkeypatch):
+    enviados = []
+    monkeypatch.setattr(FacturaService, "enviar_soap", staticmethod(lambda trabajo: enviados.append(trabajo["lote_id"])))
+    service = _servicio(spool=[_lote(i) for i in range(1, 6)])
+    service.registrar_envio = lambda trabajo, respuesta, error: {"lote_id": trabajo["lote_id"], "estado": "RECIBIDO_SIFEN"}
+
+    monkeypatch.setattr(settings, "CONTINGENCIA_CONCURRENCIA", 2)
+
+    resultados = service.drenar_contingencia()
+
+    assert sorted(enviados) == [1, 2, 3, 4, 5]
+    assert len(resultados) == 5 and service.lote_repo.spool == []
+    # Nunca se reclama más de lo que el despacho tiene en vuelo
+    assert service.lote_repo.tandas == [2, 2, 2]
+
+
+def test_lease_se_renueva_al_enviar():
+    service = _servicio()
+    trabajo = FacturaService._trabajo_envio(7, b"<rLoteDE/>", _lote(7).emisor, [], datetime(2026, 1, 1))
+
+    assert service.iniciar_envio(trabajo) and trabajo["lease"] > datetime(2026, 1, 1)
+    # Otro worker ya renovó el lease: este no envía
+    assert not service.iniciar_envio(dict(trabajo, lease=None))
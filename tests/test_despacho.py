@@ -0,0 +1,57 @@
+import threading
+import time
+from collections import Counter
+
+from services.despacho_service import DespachoLotes
+
+
+def test_respeta_limites_y_completa_en_hilo_llamador():
+    trabajos = [{"id": i, "emisor": i % 2} for i in range(10)]
+    lock = threading.Lock()
+    en_vuelo, maximo_total = Counter(), {"total": 0, 0: 0, 1: 0}
+    hilo_llamador = threading.get_ident()
+
+    def enviar(trabajo):
+        with lock:
+            en_vuelo[trabajo["emisor"]] += 1
+            maximo_total["total"] = max(maximo_total["total"], sum(en_vuelo.values()))
+            maximo_total[trabajo["emisor"]] = max(maximo_total[trabajo["emisor"]], en_vuelo[trabajo["emisor"]])
+        time.sleep(0.02)
+        with lock:
+            en_vuelo[trabajo["emisor"]] -= 1
+        if trabajo["id"] == 3:
+            raise RuntimeError("timeout")
+        return f"ok-{trabajo['id']}"
+
+    def al_completar(trabajo, respuesta, error):
+        assert threading.get_ident() == hilo_llamador
+        return trabajo["id"], respuesta, error
+
+    resultados = DespachoLotes(max_total=3, max_por_emisor=1).despachar(
+        trabajos, enviar, al_completar, clave=lambda t: t["emisor"]
+    )
+
+    assert sorted(r[0] for r in resultados) == list(range(10))
+    assert maximo_total["total"] <= 2  # 2 emisores x 1 en vuelo
+    assert maximo_total[0] == maximo_total[1] == 1
+    errores = [r for r in resultados if r[2] is not None]
+    assert len(errores) == 1 and errores[0][0] == 3
+
+
+def test_al_iniciar_descarta_sin_enviar():
+    enviados, iniciados = [], []
+
+    def al_iniciar(trabajo):
+        iniciados.append(trabajo["id"])
+        return trabajo["id"] % 2 == 0    # los impares ya los tomó otro worker
+
+    resultados = DespachoLotes(max_total=2, max_por_emisor=1).despachar(
+        [{"id": i, "emisor": 0} for i in range(5)],
+        enviar=lambda trabajo: enviados.append(trabajo["id"]),
+        al_completar=lambda trabajo, respuesta, error: trabajo["id"],
+        clave=lambda t: t["emisor"],
+        al_iniciar=al_iniciar,
+    )
+
+    assert sorted(iniciados) == list(range(5))
+    assert sorted(enviados) == sorted(resultados) == [0, 2, 4]
@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+
+from config.setting import settings
+from services.estados_service import EstadosService
+
+
+def _consulta(intentos=0, antiguedad=timedelta(minutes=5)):
+    return {"lote_id": 7, "intentos": intentos, "fecha_envio": datetime.now() - antiguedad}
+
+
+def _respuesta(cod):
+    return {"cod_res_lot": cod, "msg_res_lot": "", "detalles": []}
+
+
+def test_backoff_exponencial_con_tope():
+    base = settings.ESTADOS_BACKOFF_BASE
+    assert EstadosService._backoff(0) == timedelta(seconds=base)
+    assert EstadosService._backoff(3) == timedelta(seconds=min(base * 8, settings.ESTADOS_BACKOFF_MAX))
+    assert EstadosService._backoff(50) == timedelta(seconds=settings.ESTADOS_BACKOFF_MAX)
+
+
+def test_lote_en_proceso_se_reprograma():
+    service = EstadosService.__new__(EstadosService)
+    ahora = datetime.now()
+
+    cambio = service._reprogramar(_consulta(intentos=2), _respuesta("0361"), ahora)
+
+    assert cambio["estado"] == "RECIBIDO_SIFEN"
+    assert cambio["intentos_consulta"] == 3
+    assert cambio["next_check_at"] == ahora + EstadosService._backoff(2)
+
+
+def test_lote_vencido_o_no_reintentable_se_escala():
+    service = EstadosService.__new__(EstadosService)
+    ahora = datetime.now()
+    vencido = _consulta(antiguedad=timedelta(seconds=settings.ESTADOS_PLAZO_MAXIMO + 1))
+
+    assert service._reprogramar(vencido, _respuesta("0361"), ahora)["estado"] == "CONSULTA_ESCALADA"
+    assert service._reprogramar(_consulta(), _respuesta("0364"), ahora)["estado"] == "CONSULTA_ESCALADA"
+    assert service._reprogramar(_consulta(), None, ahora)["estado"] == "RECIBIDO_SIFEN"
@@ -0,0 +1,78 @@
+from types import SimpleNamespace
+
+import pytest
+
+from services import express_service
+from services.express_service import ExpressService
+from services.response_service import leerProtDe
+
+
+RESPUESTA = """<?xml version="1.0" encoding="UTF-8"?>
+<env:Envelope xmlns:env="http://www.w3.org/2003/05/soap-envelope">
+  <env:Body>
+    <ns2:rRetEnviDe xmlns:ns2="http://ekuatia.set.gov.py/sifen/xsd">
+      <ns2:rProtDe>
+        <ns2:Id>01800695631001001000000612021112917595714694</ns2:Id>
+        <ns2:dFecProc>2024-05-02T10:15:00-04:00</ns2:dFecProc>
+        <ns2:dDigVal>abc=</ns2:dDigVal>
+        <ns2:dEstRes>{est}</ns2:dEstRes>
+        <ns2:dProtAut>{prot}</ns2:dProtAut>
+        <ns2:gResProc>
+          <ns2:dCodRes>{cod}</ns2:dCodRes>
+          <ns2:dMsgRes>{msg}</ns2:dMsgRes>
+        </ns2:gResProc>
+      </ns2:rProtDe>
+    </ns2:rRetEnviDe>
+  </env:Body>
+</env:Envelope>"""
+
+
+def test_lee_protocolo_aprobado():
+    datos = leerProtDe(RESPUESTA.format(
+        est="Aprobado", prot="1234567890", cod="0260", msg="Autorizaci&#243;n del DE satisfactoria"
+    ))
+
+    assert datos["est_res"] == "Aprobado"
+    assert datos["prot_aut"] == "1234567890"
+    assert datos["dcodres"] == "0260"
+    assert datos["dmsgres"] == "Autorización del DE satisfactoria"
+    assert datos["dfecproc"].year == 2024
+    assert ExpressService._estado_documento(datos) == "Aprobado"
+
+
+def test_estado_sin_dEstRes_se_deduce_del_codigo():
+    datos = leerProtDe(RESPUESTA.format(est="", prot="", cod="1001", msg="CDC duplicado"))
+
+    assert ExpressService._estado_documento(datos) == "Rechazado"
+    assert ExpressService._estado_documento({**datos, "dcodres": "0260"}) == "Aprobado"
+
+
+def test_respuesta_sin_rProtDe():
+    with pytest.raises(ValueError):
+        leerProtDe("<a/>")
+
+
+def test_reenvio_no_vuelve_a_firmar(monkeypatch):
+    firmados = []
+
+    def armar(documentos):
+        firmados.extend(doc.id for doc in documentos)
+        return [{"error": None, "cdc_de": "CDC2", "ddvid": 1, "dfecfirma": None, "xml_de": b"<rDE/>"}
+                for doc in documentos]
+
+    monkeypatch.setattr(express_service, "armar_documentos", armar)
+    emisor = SimpleNamespace(id=1, drucem="80069563", cert_path="c.pem", key_path="k.pem")
+    service = ExpressService.__new__(ExpressService)
+    service.db = SimpleNamespace(commit=lambda: None, rollback=lambda: None)
+    service.repo_doc = SimpleNamespace(bulkSetFirmas=lambda firmas, commit: None,
+                                       bulkSetEstados=lambda errores, commit: None)
+
+    trabajos = service._firmar([
+        SimpleNamespace(id=1, cdc_de="CDC1", xml_de="<rDE>firmado</rDE>", emisor=emisor),
+        SimpleNamespace(id=2, cdc_de=None, xml_de=None, emisor=emisor),
+    ])
+
+    assert firmados == [2]
+    assert [(t["documento_id"], t["cdc"], t["xml_de"]) for t in trabajos] == [
+        (1, "CDC1", b"<rDE>firmado</rDE>"), (2, "CDC2", b"<rDE/>"),
+    ]
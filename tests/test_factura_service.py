@@ -0,0 +1,40 @@
+from types import SimpleNamespace
+
+from services.factura_service import FacturaService
+
+FAULT = (
+    '<env:Envelope xmlns:env="http://www.w3.org/2003/05/soap-envelope"><env:Body>'
+    '<env:Fault><env:Code><env:Value>env:Receiver</env:Value></env:Code></env:Fault>'
+    '</env:Body></env:Envelope>'
+)
+
+
+def _servicio(lotes, documentos):
+    service = FacturaService.__new__(FacturaService)
+    service.lote_repo = SimpleNamespace(actualizar_lote=lambda lote_id, datos, commit=True: lotes.append(datos))
+    service.repo_doc = SimpleNamespace(masiveSetState=lambda docs, state: documentos.append(state))
+    return service
+
+
+def test_respuesta_sin_protocolo_rechaza_el_lote():
+    lotes, documentos = [], []
+
+    _servicio(lotes, documentos)._procesar_respuesta_lote(1, FAULT, [{"documento_id": 10}])
+
+    assert lotes == [{"xml_response": FAULT, "estado": "LOTE_RECHAZADO"}]
+    assert documentos == ["ERROR_ENVIO"]
+
+
+def test_respuesta_con_protocolo_marca_recibidos():
+    lotes, documentos = [], []
+    respuesta = (
+        '<env:Envelope xmlns:env="http://www.w3.org/2003/05/soap-envelope"><env:Body>'
+        '<ns2:rResEnviLoteDe xmlns:ns2="http://ekuatia.set.gov.py/sifen/xsd">'
+        '<ns2:dCodRes>0300</ns2:dCodRes><ns2:dProtConsLote>1234567890</ns2:dProtConsLote>'
+        '</ns2:rResEnviLoteDe></env:Body></env:Envelope>'
+    )
+
+    _servicio(lotes, documentos)._procesar_respuesta_lote(1, respuesta, [{"documento_id": 10}])
+
+    assert lotes[0]["estado"] == "RECIBIDO_SIFEN" and lotes[0]["nro_lote_sifen"] == "1234567890"
+    assert documentos == ["RECIBIDO_SIFEN"]
@@ -0,0 +1,25 @@
+from domain.repositories.identidad_cache import IdentidadCache
+
+
+def test_cambio_de_version_compartida_invalida(monkeypatch):
+    versiones = [3, 3, 4]
+    cache = IdentidadCache(ttl=300, verificar=0)
+    monkeypatch.setattr(cache, "_version_compartida", lambda: versiones.pop(0))
+
+    cache._verificar_version(1.0)    # primera lectura: solo la recuerda
+    cache._emisores["80069563"] = (1.0, object())
+    cache._verificar_version(2.0)
+    assert "80069563" in cache._emisores
+
+    cache._verificar_version(3.0)    # otro proceso rotó un certificado
+    assert cache._emisores == {} and cache.version == 4
+
+
+def test_version_se_lee_a_lo_sumo_cada_intervalo(monkeypatch):
+    lecturas = []
+    cache = IdentidadCache(ttl=300, verificar=5)
+    monkeypatch.setattr(cache, "_version_compartida", lambda: lecturas.append(1) or 0)
+
+    for ahora in (10.0, 11.0, 14.9, 15.0):
+        cache._verificar_version(ahora)
+    assert len(lecturas) == 2
@@ -0,0 +1,76 @@
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import OperationalError
+
+from config.setting import settings
+from core.infraestructure.soap import limitador
+
+
+class ConexionFalsa:
+    """Devuelve los saldos indicados, uno por upsert, como si fuera el RETURNING"""
+
+    def __init__(self, saldos, ejecutadas, dormido):
+        self.saldos = saldos
+        self.ejecutadas = ejecutadas
+        self.dormido = dormido
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, sentencia, parametros):
+        self.ejecutadas.append((parametros["clave"], list(self.dormido)))
+        return self
+
+    def scalar_one(self):
+        return self.saldos.pop(0)
+
+
+@pytest.fixture
+def limites(monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_ACTIVO", True)
+    monkeypatch.setattr(settings, "RATE_LIMIT_OPERACIONES", "rEnvioLote=10, rEnviConsLoteDe=20")
+    monkeypatch.setattr(settings, "RATE_LIMIT_EMISOR", 2)
+    monkeypatch.setattr(settings, "RATE_LIMIT_EMISORES", "80069563=0,4444444=8")
+    monkeypatch.setattr(settings, "RATE_LIMIT_RAFAGA", 1)
+
+
+def test_baldes_por_operacion_y_emisor(limites):
+    assert limitador.baldes("rEnvioLote", "1234567") == [("ruc:1234567", 2), ("op:rEnvioLote", 10.0)]
+    assert limitador.baldes("rEnvioLote", "4444444") == [("ruc:4444444", 8.0), ("op:rEnvioLote", 10.0)]
+    assert limitador.baldes("rEnvioLote", "80069563") == [("op:rEnvioLote", 10.0)]    # sin límite
+    assert limitador.baldes("rEnviConsRUC", None) == []
+
+
+def test_emisor_espera_antes_de_tomar_la_operacion(limites, monkeypatch):
+    ejecutadas, dormido = [], []
+    saldos = [-1.0, -0.5]    # ruc:1234567 (2/s) y después op:rEnvioLote (10/s)
+    conexion = ConexionFalsa(saldos, ejecutadas, dormido)
+    monkeypatch.setattr(limitador, "get_engine", lambda: type("E", (), {"begin": lambda self: conexion})())
+    monkeypatch.setattr(limitador.time, "sleep", dormido.append)
+
+    assert limitador.tomar_turno("rEnvioLote", "1234567") == pytest.approx(0.55)
+    # El token de la operación se pide recién después de esperar al emisor
+    assert ejecutadas == [("ruc:1234567", []), ("op:rEnvioLote", [0.5])]
+    assert dormido == [0.5, 0.05]
+
+
+def test_upsert_compila_para_postgresql():
+    sql = str(limitador._TOMAR.compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (clave) DO UPDATE" in sql and "RETURNING tokens" in sql
+    assert sql.count("%(capacidad)s") == 2 and "%(clave)s" in sql and "%(tasa)s" in sql
+
+
+def test_sin_base_no_frena_el_envio(limites, monkeypatch):
+    def engine_caido():
+        raise OperationalError("SELECT 1", {}, Exception("sin conexión"))
+
+    monkeypatch.setattr(limitador, "get_engine", engine_caido)
+    assert limitador.tomar_turno("rEnvioLote", "1234567") == 0.0
+
+
+def test_inactivo(monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_ACTIVO", False)
+    assert limitador.tomar_turno("rEnvioLote", "1234567") == 0.0
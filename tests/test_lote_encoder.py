@@ -0,0 +1,38 @@
+import base64
+import io
+import re
+import zipfile
+
+from core.infraestructure.soap.lote_encoder import codificar_envio_lote
+
+
+def _extraer_lote(sobre: bytes) -> bytes:
+    xde = re.search(rb"<xDE>(.*)</xDE>", sobre).group(1)
+    with zipfile.ZipFile(io.BytesIO(base64.b64decode(xde, validate=True))) as zf:
+        assert zf.namelist() == ["lote.xml"]
+        return zf.read("lote.xml")
+
+
+def test_sobre_contiene_lote_comprimido():
+    partes = [b'<rLoteDE>', b'<rDE>1</rDE>', b'<rDE>2</rDE>', b'</rLoteDE>']
+
+    sobre = codificar_envio_lote(partes, 15)
+
+    assert b"<dId>15</dId>" in sobre
+    assert sobre.endswith(b"</soap:Envelope>")
+    assert _extraer_lote(bytes(sobre)) == b"".join(partes)
+
+
+def test_bytes_y_partes_generan_el_mismo_lote():
+    partes = [b"<rLoteDE>", b"<rDE>" + b"x" * 500_000 + b"</rDE>", b"</rLoteDE>"]
+
+    por_partes = _extraer_lote(bytes(codificar_envio_lote(partes, 1)))
+    completo = _extraer_lote(bytes(codificar_envio_lote(b"".join(partes), 1)))
+
+    assert por_partes == completo == b"".join(partes)
+
+
+def test_quita_bom_inicial():
+    sobre = codificar_envio_lote(b'\xef\xbb\xbf<rLoteDE/>', 1)
+
+    assert _extraer_lote(bytes(sobre)) == b"<rLoteDE/>"
@@ -0,0 +1,68 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import Session
+
+from domain.models.models import Documento, Lote, LoteDocumento
+from domain.repositories.lote_repo import LoteDocumentoRepository, LoteRepository
+
+CDC = "01048496782001001000002122026030515328616516"
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    tablas = [Documento.__table__, Lote.__table__, LoteDocumento.__table__]
+    Documento.metadata.create_all(engine, tables=tablas)
+    with Session(engine) as sesion:
+        yield sesion
+
+
+def test_resultado_masivo_solo_toca_el_lote_indicado(db):
+    db.add(Documento(id=1, cdc_de=CDC, dfeemide=datetime(2026, 3, 5), estado_actual="EN_PROCESO_LOTE"))
+    db.add_all([Lote(id=lote_id, emisorId=1, estado="PROCESADO") for lote_id in (10, 11)])
+    db.add(LoteDocumento(lote_id=10, documento_id=1, estado_resultado="RECHAZADO", codigo_error="1001"))
+    db.add(LoteDocumento(lote_id=11, documento_id=1))
+    db.commit()
+
+    LoteDocumentoRepository(db).actualizar_estados_documentos_masivo(11, [
+        {"cdc": CDC, "estado_resultado": "APROBADO", "codigo_error": "0260", "mensaje_error": "Aprobado"},
+    ])
+
+    filas = db.execute(
+        select(LoteDocumento.lote_id, LoteDocumento.estado_resultado, LoteDocumento.codigo_error)
+        .order_by(LoteDocumento.lote_id)
+    ).all()
+    assert filas == [(10, "RECHAZADO", "1001"), (11, "APROBADO", "0260")]
+    assert db.get(Documento, 1).estado_actual == "APROBADO"
+
+
+def test_reclamo_de_armados_no_toca_los_excluidos(db):
+    vencido = datetime(2026, 3, 5)
+    db.add_all([Lote(id=lote_id, emisorId=1, estado="LOTE_ARMADO", fecha_envio=vencido) for lote_id in (10, 11)])
+    db.commit()
+
+    reclamados = LoteRepository(db).reclamar_lotes_armados(antiguedad_segundos=60, excluir={10})
+
+    assert [lote.id for lote in reclamados] == [11]
+    assert db.get(Lote, 10).fecha_envio == vencido    # su lease sigue siendo el del trabajo encolado
+
+
+def test_agregar_documentos_usa_un_solo_insert(db):
+    db.add_all([
+        Documento(id=doc_id, cdc_de=f"{doc_id:044d}", dfeemide=datetime(2026, 3, 5), estado_actual="PENDIENTE_ENVIO")
+        for doc_id in (1, 2, 3)
+    ])
+    db.add(Lote(id=10, emisorId=1, estado="LOTE_ARMADO"))
+    db.commit()
+    inserts = []
+    event.listen(db.get_bind(), "before_cursor_execute",
+                 lambda conn, cursor, sql, params, context, many: inserts.append(sql) if sql.startswith("INSERT") else None)
+
+    assert LoteDocumentoRepository(db).agregar_documentos_a_lote(10, [1, 2, 3]) == 3
+    db.commit()
+
+    assert len(inserts) == 1
+    assert db.scalars(select(LoteDocumento.documento_id).where(LoteDocumento.lote_id == 10)).all() == [1, 2, 3]
+    assert {doc.estado_actual for doc in db.scalars(select(Documento))} == {"EN_PROCESO_LOTE"}
@@ -0,0 +1,131 @@
+import datetime
+import time
+
+import pytest
+import requests
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from core.infraestructure.soap.lote_encoder import codificar_envio_lote
+from tests.mock_sifen import ConfigMock, MockSifen
+from utils.parseSifen import parse_envio_lote, parse_protocolo_de, parse_respuesta_lote
+
+CDC_OK = "01048496782001001000002122026030515328616516"
+CDC_RECHAZADO = "01048496782001001000002132026030515328616517"
+NS = "http://ekuatia.set.gov.py/sifen/xsd"
+
+
+def _rde(cdc: str) -> bytes:
+    return f'<rDE xmlns="{NS}"><dVerFor>150</dVerFor><DE Id="{cdc}"><dDVId>6</dDVId></DE></rDE>'.encode()
+
+
+def _sobre(operacion: str, contenido: str) -> bytes:
+    return (
+        '<soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope"><soap:Body>'
+        f'<{operacion} xmlns="{NS}">{contenido}</{operacion}>'
+        '</soap:Body></soap:Envelope>'
+    ).encode()
+
+
+def _enviar_lote(url: str, cdcs) -> str:
+    partes = [b'<rLoteDE xmlns="http://ekuatia.set.gov.py/sifen/xsd">', *map(_rde, cdcs), b"</rLoteDE>"]
+    respuesta = requests.post(url, data=bytes(codificar_envio_lote(partes, 1)), timeout=5)
+    return parse_envio_lote(respuesta.content).prot_cons_lote
+
+
+def _consultar_lote(url: str, protocolo: str):
+    sobre = _sobre("rEnviConsLoteDe", f"<dId>1</dId><dProtConsLote>{protocolo}</dProtConsLote>")
+    return parse_respuesta_lote(requests.post(url, data=sobre, timeout=5).content)
+
+
+def test_lote_en_procesamiento_y_resultado_por_cdc():
+    with MockSifen(ConfigMock(demora_lote=0.3, rechazar={CDC_RECHAZADO})) as mock:
+        protocolo = _enviar_lote(mock.url, [CDC_OK, CDC_RECHAZADO])
+
+        assert _consultar_lote(mock.url, protocolo).cod_res_lot == "0361"
+        time.sleep(0.35)
+        resultado = _consultar_lote(mock.url, protocolo)
+
+    assert resultado.cod_res_lot == "0362"
+    assert [(d.cdc, d.est_res, d.cod_res) for d in resultado.detalles] == [
+        (CDC_OK, "Aprobado", "0260"),
+        (CDC_RECHAZADO, "Rechazado", "1001"),
+    ]
+    assert resultado.detalles[0].prot_aut and resultado.detalles[1].prot_aut is None
+    assert mock.estado.solicitudes == {"rEnvioLote": 1, "rEnviConsLoteDe": 2}
+
+
+def test_envio_sincrono_de():
+    with MockSifen() as mock:
+        sobre = _sobre("rEnviDe", f"<dId>1</dId><xDE>{_rde(CDC_OK).decode()}</xDE>")
+        prot = parse_protocolo_de(requests.post(mock.url, data=sobre, timeout=5).content)
+
+    assert (prot.id, prot.est_res, prot.cod_res) == (CDC_OK, "Aprobado", "0260")
+
+
+def test_respuesta_fija_y_errores_simulados():
+    config = ConfigMock(tasa_error=1.0)
+    with MockSifen(config) as mock:
+        assert requests.post(mock.url, data=_sobre("rEnviConsRUC", ""), timeout=5).status_code == 500
+
+        config.tasa_error = 0.0
+        config.respuestas_fijas["rEnviConsLoteDe"] = "tests/output/last_soap_response.xml"
+        muestra = _consultar_lote(mock.url, "5586437372087769201")
+
+    assert muestra.cod_res_lot == "0362"
+    assert muestra.detalles[0].cdc == CDC_OK
+
+
+def _certificado(nombre, clave, emisor=None, clave_emisor=None, ca=False):
+    ahora = datetime.datetime.now(datetime.timezone.utc)
+    sujeto = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, nombre)])
+    builder = (
+        x509.CertificateBuilder()
+        .subject_name(sujeto)
+        .issuer_name(emisor.subject if emisor else sujeto)
+        .public_key(clave.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(ahora - datetime.timedelta(minutes=1))
+        .not_valid_after(ahora + datetime.timedelta(hours=1))
+        .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True)
+    )
+    if not ca:
+        builder = builder.add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost")]), critical=False)
+    return builder.sign(clave_emisor or clave, hashes.SHA256())
+
+
+def _escribir(ruta, cert, clave=None):
+    ruta.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    if clave is not None:
+        ruta.with_suffix(".key").write_bytes(clave.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ))
+
+
+def test_mtls_exige_certificado_cliente(tmp_path):
+    clave_ca = ec.generate_private_key(ec.SECP256R1())
+    ca = _certificado("CA prueba", clave_ca, ca=True)
+    _escribir(tmp_path / "ca.pem", ca)
+    for nombre in ("servidor", "cliente"):
+        clave = ec.generate_private_key(ec.SECP256R1())
+        _escribir(tmp_path / f"{nombre}.pem", _certificado(nombre, clave, ca, clave_ca), clave)
+
+    mock = MockSifen(
+        cert=str(tmp_path / "servidor.pem"), key=str(tmp_path / "servidor.key"),
+        ca_clientes=str(tmp_path / "ca.pem"),
+    )
+    with mock:
+        sobre = _sobre("rEnviConsRUC", "<dId>1</dId><dRUCCons>80069563</dRUCCons>")
+        respuesta = requests.post(
+            mock.url, data=sobre, timeout=5, verify=str(tmp_path / "ca.pem"),
+            cert=(str(tmp_path / "cliente.pem"), str(tmp_path / "cliente.key")),
+        )
+        with pytest.raises((requests.exceptions.SSLError, requests.exceptions.ConnectionError)):
+            requests.post(mock.url, data=sobre, timeout=5, verify=str(tmp_path / "ca.pem"))
+
+    assert respuesta.status_code == 200
+    assert b"<ns2:dCodRes>0502</ns2:dCodRes>" in respuesta.content
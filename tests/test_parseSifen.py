@@ -0,0 +1,126 @@
+from datetime import datetime
+
+import pytest
+
+from utils.parseResponseEvento import parse_evento_response
+from utils.parseResponseLote import parse_lote_response
+from utils.parseSifen import (
+    iter_detalles_lote,
+    parse_envio_lote,
+    parse_protocolo_de,
+    parse_respuesta_evento,
+    parse_respuesta_lote,
+)
+
+SOAP = '<env:Envelope xmlns:env="http://www.w3.org/2003/05/soap-envelope"><env:Body>{}</env:Body></env:Envelope>'
+NS2 = 'xmlns:ns2="http://ekuatia.set.gov.py/sifen/xsd"'
+
+
+def respuesta_lote(cantidad: int) -> bytes:
+    """Respuesta rResEnviConsLoteDe con `cantidad` DEs (aprobados y rechazados alternados)"""
+    detalles = "".join(
+        "<ns2:gResProcLote>"
+        f"<ns2:id>{i:044d}</ns2:id>"
+        f"<ns2:dEstRes>{'Aprobado' if i % 2 else 'Rechazado'}</ns2:dEstRes>"
+        + (f"<ns2:dProtAut>{i:010d}</ns2:dProtAut>" if i % 2 else "")
+        + "<ns2:gResProc>"
+        f"<ns2:dCodRes>{'0260' if i % 2 else '1001'}</ns2:dCodRes>"
+        f"<ns2:dMsgRes>Resultado {i}</ns2:dMsgRes>"
+        "</ns2:gResProc>"
+        "</ns2:gResProcLote>"
+        for i in range(cantidad)
+    )
+    return SOAP.format(
+        f"<ns2:rResEnviConsLoteDe {NS2}>"
+        "<ns2:dFecProc>2026-01-27T13:14:34-03:00</ns2:dFecProc>"
+        "<ns2:dCodResLot>0362</ns2:dCodResLot>"
+        "<ns2:dMsgResLot>Procesamiento de lote concluido</ns2:dMsgResLot>"
+        f"{detalles}"
+        "</ns2:rResEnviConsLoteDe>"
+    ).encode("utf-8")
+
+
+RESPUESTA_EVENTO = SOAP.format(
+    f"<ns2:rRetEnviEventoDe {NS2}>"
+    "<ns2:dFecProc>2026-01-27T13:14:34-03:00</ns2:dFecProc>"
+    "<ns2:gResProcEVe>"
+    "<ns2:dEstRes>Aprobado</ns2:dEstRes>"
+    "<ns2:dProtAut>123456</ns2:dProtAut>"
+    "<ns2:id>1</ns2:id>"
+    "<ns2:gResProc><ns2:dCodRes>0600</ns2:dCodRes><ns2:dMsgRes>Evento registrado</ns2:dMsgRes></ns2:gResProc>"
+    "</ns2:gResProcEVe>"
+    "</ns2:rRetEnviEventoDe>"
+).encode("utf-8")
+
+
+def test_lote_equivale_al_parser_anterior():
+    xml = respuesta_lote(5)
+    anterior = parse_lote_response(xml)
+    nuevo = parse_respuesta_lote(xml)
+
+    assert nuevo.cod_res_lot == anterior["cod_res_lot"] == "0362"
+    assert nuevo.msg_res_lot == anterior["msg_res_lot"]
+    assert nuevo.fec_proc == anterior["fec_proc"]
+    assert [d.as_dict() for d in nuevo.detalles] == anterior["detalles"]
+    # Acceso estilo dict para el código existente
+    assert nuevo["detalles"][1]["est_res"] == "Aprobado"
+
+
+def test_lote_streaming_equivale():
+    xml = respuesta_lote(50)
+
+    assert parse_respuesta_lote(xml, streaming=True) == parse_respuesta_lote(xml)
+    assert [d.cdc for d in iter_detalles_lote(xml)] == [f"{i:044d}" for i in range(50)]
+
+
+def test_lote_sin_respuesta():
+    with pytest.raises(ValueError):
+        parse_respuesta_lote(SOAP.format("").encode())
+    with pytest.raises(ValueError):
+        parse_respuesta_lote(SOAP.format("").encode(), streaming=True)
+
+
+def test_envio_lote():
+    xml = SOAP.format(
+        f"<ns2:rResEnviLoteDe {NS2}>"
+        "<ns2:dFecProc>2026-01-27T13:14:34Z</ns2:dFecProc>"
+        "<ns2:dCodRes>0300</ns2:dCodRes>"
+        "<ns2:dMsgRes>Lote recibido con éxito</ns2:dMsgRes>"
+        "<ns2:dProtConsLote> 1234567890 </ns2:dProtConsLote>"
+        "<ns2:dTpoProces>0</ns2:dTpoProces>"
+        "</ns2:rResEnviLoteDe>"
+    )
+
+    envio = parse_envio_lote(xml)
+
+    assert envio.prot_cons_lote == "1234567890"
+    assert envio.cod_res == "0300"
+    assert envio.fec_proc == datetime.fromisoformat("2026-01-27T13:14:34+00:00")
+
+
+def test_protocolo_de():
+    xml = SOAP.format(
+        f"<ns2:rRetEnviDe {NS2}><ns2:rProtDe>"
+        f"<ns2:Id>{1:044d}</ns2:Id>"
+        "<ns2:dFecProc>2026-01-27T13:14:34-03:00</ns2:dFecProc>"
+        "<ns2:dEstRes>Aprobado</ns2:dEstRes>"
+        "<ns2:dProtAut>99</ns2:dProtAut>"
+        "<ns2:gResProc><ns2:dCodRes>0260</ns2:dCodRes><ns2:dMsgRes>OK</ns2:dMsgRes></ns2:gResProc>"
+        "</ns2:rProtDe></ns2:rRetEnviDe>"
+    )
+
+    prot = parse_protocolo_de(xml)
+
+    assert (prot.id, prot.est_res, prot.prot_aut, prot.cod_res) == (f"{1:044d}", "Aprobado", "99", "0260")
+    with pytest.raises(ValueError):
+        parse_protocolo_de("<no-cerrado>")
+
+
+def test_evento_equivale_al_parser_anterior():
+    anterior = parse_evento_response(RESPUESTA_EVENTO)
+    nuevo = parse_respuesta_evento(RESPUESTA_EVENTO)
+
+    assert (nuevo.cod_res, nuevo.msg_res, nuevo.prot_aut, nuevo.est_res, nuevo.fec_proc, nuevo.id) == (
+        anterior["dCodRes"], anterior["dMsgRes"], anterior["dProtAut"],
+        anterior["dEstRes"], anterior["dFecProc"], anterior["id"],
+    )
@@ -0,0 +1,111 @@
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+from daemon import pipeline
+from daemon.pipeline import PipelineFacturas, _FIN
+from services.factura_service import FacturaService
+
+
+@contextmanager
+def sesion_falsa():
+    yield SimpleNamespace()
+
+
+def test_envio_descarta_lotes_tomados_por_otro_worker(monkeypatch):
+    enviados = []
+    monkeypatch.setattr(pipeline, "get_db_session", sesion_falsa)
+    # Solo el lote 2 conserva su lease; el 1 ya lo reclamó otro worker
+    monkeypatch.setattr(FacturaService, "iniciar_envio", lambda self, trabajo: trabajo["lote_id"] == 2)
+    monkeypatch.setattr(FacturaService, "enviar_soap", staticmethod(lambda trabajo: enviados.append(trabajo["lote_id"])))
+
+    etapas = PipelineFacturas(owner="w1")
+    etapas.hilos_envio = 1
+    etapas._lotes_en_curso.update({1, 2})
+    for lote_id in (1, 2):
+        etapas.colas["envio"].put({"lote_id": lote_id, "emisor_id": 1})
+    etapas.colas["envio"].put(_FIN)
+
+    etapas._etapa_envio()
+
+    assert enviados == [2]
+    assert etapas._lotes_en_curso == {2}    # el 2 sigue en curso hasta persistirse
+    assert etapas.colas["persistencia"].get()[0]["lote_id"] == 2
+
+
+def test_firma_descarta_documentos_sin_lease(monkeypatch):
+    monkeypatch.setattr(pipeline, "get_db_session", sesion_falsa)
+    monkeypatch.setattr(pipeline.DocumentoRepo, "renovarLease", lambda self, owner, ids, segundos: [ids[0]])
+    monkeypatch.setattr(pipeline, "armar_documentos", lambda docs: [{"id": doc.id} for doc in docs])
+
+    etapas = PipelineFacturas(owner="w1")
+    etapas.hilos_firma = 1
+    etapas.colas["firma"].put({"documentos": [SimpleNamespace(id=10), SimpleNamespace(id=11)]})
+    etapas.colas["firma"].put(_FIN)
+
+    etapas._etapa_firma()
+
+    item = etapas.colas["armado"].get()
+    assert [doc.id for doc in item["documentos"]] == [10] and list(item["armados"]) == [10]
+
+
+def test_etapas_sobreviven_a_la_base_caida(monkeypatch):
+    fallas = []
+
+    @contextmanager
+    def base_caida():
+        fallas.append(threading.current_thread().name)
+        raise RuntimeError("base caída")
+        yield
+
+    monkeypatch.setattr(pipeline, "get_db_session", base_caida)
+    monkeypatch.setattr(pipeline, "_ESPERA_ERROR", 0.01)
+
+    etapas = PipelineFacturas(owner="w1", interval=0.01)
+    etapas.hilos_firma = etapas.hilos_envio = 1
+    etapas.iniciar()
+    etapas.colas["firma"].put({"documentos": [SimpleNamespace(id=10)]})
+    etapas.colas["armado"].put({"documentos": [SimpleNamespace(id=11)], "emisor": None,
+                                "tipo_documento": "1", "armados": {}})
+
+    # Cada etapa con base falla al menos dos veces y sigue viva
+    for _ in range(200):
+        nombres = set(fallas)
+        if {"pipeline-firma-0", "pipeline-armado-0"} <= nombres and fallas.count("pipeline-reclamo-0") > 1:
+            break
+        time.sleep(0.01)
+    assert {"pipeline-reclamo-0", "pipeline-firma-0", "pipeline-armado-0"} <= set(fallas)
+    assert all(hilo.is_alive() for hilo in etapas._hilos)
+
+    etapas.detener(timeout=2)
+    assert not any(hilo.is_alive() for hilo in etapas._hilos)
+    assert etapas.esperar(0)
+
+
+def test_reclamo_excluye_lotes_en_curso_y_encola_sin_sesion(monkeypatch):
+    eventos = []
+
+    @contextmanager
+    def sesion():
+        eventos.append("abre")
+        yield SimpleNamespace()
+        eventos.append("cierra")
+
+    def armados(self, excluir=()):
+        eventos.append(("excluir", set(excluir)))
+        return [{"lote_id": 2, "emisor_id": 1}]
+
+    monkeypatch.setattr(pipeline, "get_db_session", sesion)
+    monkeypatch.setattr(FacturaService, "lotes_armados_pendientes", armados)
+    monkeypatch.setattr(FacturaService, "lotes_contingencia_pendientes", lambda self, limite, excluir=(): [])
+    monkeypatch.setattr(pipeline.DocumentoRepo, "claimPendientes", lambda self, **kwargs: [])
+
+    etapas = PipelineFacturas(owner="w1")
+    etapas._lotes_en_curso.add(1)
+    envio = etapas.colas["envio"]
+    monkeypatch.setattr(envio, "put", lambda trabajo: eventos.append(("encola", trabajo["lote_id"])))
+
+    assert etapas._reclamar() == 1
+    assert eventos == ["abre", ("excluir", {1}), "cierra", ("encola", 2)]
+    assert etapas._lotes_en_curso == {1, 2}
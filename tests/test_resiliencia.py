@@ -0,0 +1,179 @@
+import socket
+from contextlib import nullcontext
+from types import SimpleNamespace
+
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from config.setting import settings
+from core.infraestructure.soap import limitador, resiliencia, soap_client
+from core.infraestructure.soap.resiliencia import AMBIGUO, DEFINITIVO, NO_ENVIADO, CircuitoAbierto
+from core.infraestructure.soap.soap_client import SOAPClient
+
+ENDPOINT = "https://sifen.test/de/ws/async/recibe-lote.wsdl"
+
+
+def _rechazada() -> requests.ConnectionError:
+    """Como lo arma requests cuando el TCP no llega a conectar"""
+    return requests.ConnectionError(MaxRetryError(None, "/", NewConnectionError(None, "Connection refused")))
+
+
+def _cortada() -> requests.ConnectionError:
+    """Como lo arma requests cuando el servidor corta con el cuerpo ya enviado"""
+    return requests.ConnectionError(ProtocolError("Connection aborted.", ConnectionResetError()))
+
+
+def _http_error(status: int) -> requests.HTTPError:
+    respuesta = requests.Response()
+    respuesta.status_code = status
+    return requests.HTTPError(response=respuesta)
+
+
+class Servidor:
+    """enviar() falso: lanza los errores indicados y después responde"""
+
+    def __init__(self, *errores):
+        self.errores = list(errores)
+        self.llamadas = []
+
+    def __call__(self, timeouts):
+        self.llamadas.append(timeouts)
+        if self.errores:
+            raise self.errores.pop(0)
+        return "ok"
+
+
+@pytest.fixture(autouse=True)
+def politica(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "SOAP_CAPTURA_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "SOAP_BACKOFF_BASE", 0.0)
+    monkeypatch.setattr(settings, "SOAP_REINTENTOS", 3)
+    monkeypatch.setattr(settings, "SOAP_CIRCUITO_FALLOS", 3)
+    monkeypatch.setattr(settings, "SOAP_CIRCUITO_ESPERA", 30)
+    monkeypatch.setattr(resiliencia, "_circuitos", {})
+    monkeypatch.setattr(resiliencia, "_max_reintentos", None)
+
+
+def test_clasificar():
+    assert resiliencia.clasificar(requests.exceptions.ConnectTimeout()) == NO_ENVIADO
+    assert resiliencia.clasificar(_rechazada()) == NO_ENVIADO
+    assert resiliencia.clasificar(requests.exceptions.SSLError("sslv3 alert handshake failure")) == NO_ENVIADO
+    assert resiliencia.clasificar(_cortada()) == AMBIGUO
+    assert resiliencia.clasificar(requests.ConnectionError()) == AMBIGUO
+    assert resiliencia.clasificar(_http_error(503)) == NO_ENVIADO
+    assert resiliencia.clasificar(requests.exceptions.ReadTimeout()) == AMBIGUO
+    assert resiliencia.clasificar(_http_error(500)) == AMBIGUO
+    assert resiliencia.clasificar(_http_error(504)) == AMBIGUO
+    assert resiliencia.clasificar(_http_error(400)) == DEFINITIVO
+    assert resiliencia.no_enviado(CircuitoAbierto(ENDPOINT, 10))
+    assert not resiliencia.no_enviado(requests.exceptions.ReadTimeout())
+
+
+def test_reintenta_lo_que_no_llego():
+    servidor = Servidor(_rechazada(), _http_error(503))
+    assert resiliencia.ejecutar(ENDPOINT, "rEnvioLote", servidor, 45) == "ok"
+    assert len(servidor.llamadas) == 3
+
+
+def test_ambiguo_solo_se_reintenta_en_consultas():
+    envio = Servidor(requests.exceptions.ReadTimeout())
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        resiliencia.ejecutar(ENDPOINT, "rEnvioLote", envio, 45)
+    assert len(envio.llamadas) == 1
+
+    cortado = Servidor(_cortada())
+    with pytest.raises(requests.ConnectionError):
+        resiliencia.ejecutar(ENDPOINT, "rEnvioLote", cortado, 45)
+    assert len(cortado.llamadas) == 1
+
+    consulta = Servidor(requests.exceptions.ReadTimeout())
+    assert resiliencia.ejecutar(ENDPOINT + "?c", "rEnviConsLoteDe", consulta, 45) == "ok"
+    assert len(consulta.llamadas) == 2
+
+
+def test_circuito_abre_y_cierra_con_una_prueba(monkeypatch):
+    resiliencia.configurar(max_reintentos=0)
+    for _ in range(3):
+        with pytest.raises(requests.ConnectionError):
+            resiliencia.ejecutar(ENDPOINT, "rEnvioLote", Servidor(_rechazada()), 45)
+
+    # Abierto: falla al instante, sin llamar a la red
+    servidor = Servidor()
+    with pytest.raises(CircuitoAbierto):
+        resiliencia.ejecutar(ENDPOINT, "rEnvioLote", servidor, 45)
+    assert servidor.llamadas == [] and resiliencia.circuito_abierto(ENDPOINT)
+
+    # Vencida la espera pasa una prueba; si responde, el circuito se cierra
+    resiliencia.obtener_circuito(ENDPOINT).abierto_hasta = 0
+    assert resiliencia.ejecutar(ENDPOINT, "rEnvioLote", servidor, 45) == "ok"
+    assert resiliencia.obtener_circuito(ENDPOINT).estado == "cerrado"
+
+
+def test_http_500_abre_el_circuito():
+    consulta = Servidor(_http_error(500))
+    assert resiliencia.ejecutar(ENDPOINT + "?c", "rEnviConsLoteDe", consulta, 45) == "ok"
+    assert len(consulta.llamadas) == 2
+
+    resiliencia.configurar(max_reintentos=0)
+    for _ in range(3):
+        with pytest.raises(requests.HTTPError):
+            resiliencia.ejecutar(ENDPOINT, "rEnvioLote", Servidor(_http_error(500)), 45)
+    assert resiliencia.circuito_abierto(ENDPOINT)
+
+
+def test_timeout_adaptativo(monkeypatch):
+    monkeypatch.setattr(settings, "SOAP_TIMEOUT_MIN", 0.1)
+    monkeypatch.setattr(settings, "SOAP_TIMEOUT_FACTOR", 3)
+    circuito = resiliencia.obtener_circuito(ENDPOINT)
+    assert circuito.timeout_lectura(45) == 45    # sin muestras suficientes
+
+    for _ in range(50):
+        circuito.exito(0.2)
+    assert circuito.timeout_lectura(45) == pytest.approx(0.6)
+    assert circuito.timeout_lectura(0.5) == 0.5
+
+    # Solo las consultas: un envío lento no se corta antes de lo pedido
+    consulta, envio = Servidor(), Servidor()
+    resiliencia.ejecutar(ENDPOINT, "rEnviConsLoteDe", consulta, 45)
+    resiliencia.ejecutar(ENDPOINT, "rEnvioLote", envio, 45)
+    assert consulta.llamadas[0][1] == pytest.approx(0.6)
+    assert envio.llamadas[0][1] == 45
+
+
+def test_soap_client_sin_servidor_abre_el_circuito(monkeypatch):
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        puerto = s.getsockname()[1]    # puerto libre: conexión rechazada
+    url = f"http://localhost:{puerto}/de/ws"
+    monkeypatch.setattr(soap_client, "obtener_sesion", lambda *args: requests.Session())
+
+    cliente = SOAPClient("cert.pem", "key.pem", debug=False)
+    with pytest.raises(requests.ConnectionError) as error:
+        cliente.send(url, b"<soap:Body><rEnvioLote><dId>1</dId></rEnvioLote></soap:Body>")
+
+    assert resiliencia.no_enviado(error.value)
+    assert resiliencia.circuito_abierto(url)
+
+
+def test_espera_del_limite_no_cuenta_como_latencia(monkeypatch):
+    reloj = [0.0]
+    monkeypatch.setattr(resiliencia.time, "perf_counter", lambda: reloj[0])
+    monkeypatch.setattr(limitador.time, "sleep", lambda segundos: reloj.__setitem__(0, reloj[0] + segundos))
+    # Balde de rEnvioLote saturado: 2 tokens de deuda a 10/s son 0,2 s de espera
+    monkeypatch.setattr(settings, "RATE_LIMIT_ACTIVO", True)
+    monkeypatch.setattr(settings, "RATE_LIMIT_OPERACIONES", "rEnvioLote=10")
+    conexion = SimpleNamespace(execute=lambda sentencia, parametros: SimpleNamespace(scalar_one=lambda: -2.0))
+    monkeypatch.setattr(limitador, "get_engine", lambda: SimpleNamespace(begin=lambda: nullcontext(conexion)))
+
+    def enviar(cliente, endpoint, soap_bytes, timeouts):
+        reloj[0] += 0.05    # lo que tarda SIFEN
+        return "ok"
+
+    monkeypatch.setattr(SOAPClient, "_enviar", enviar)
+    SOAPClient("cert.pem", "key.pem", debug=False).send(
+        ENDPOINT, b"<soap:Body><rEnvioLote><dId>1</dId></rEnvioLote></soap:Body>"
+    )
+
+    assert reloj[0] == pytest.approx(0.25)
+    assert list(resiliencia.obtener_circuito(ENDPOINT).latencias) == [pytest.approx(0.05)]
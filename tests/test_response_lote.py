@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+
+from sqlalchemy.dialects import postgresql
+
+from services.response_lote_service import serviceResponseLote
+from tests.test_parseSifen import NS2, SOAP
+
+CDC_A = "0" * 43 + "1"
+CDC_B = "0" * 43 + "2"
+
+
+def _detalle(cdc: str, estado: str, codigo: str) -> str:
+    return (
+        f"<ns2:gResProcLote><ns2:id>{cdc}</ns2:id><ns2:dEstRes>{estado}</ns2:dEstRes>"
+        f"<ns2:gResProc><ns2:dCodRes>{codigo}</ns2:dCodRes><ns2:dMsgRes>{estado}</ns2:dMsgRes></ns2:gResProc>"
+        "</ns2:gResProcLote>"
+    )
+
+
+def _respuesta(*detalles) -> str:
+    return SOAP.format(
+        f"<ns2:rResEnviConsLoteDe {NS2}>"
+        "<ns2:dFecProc>2026-01-27T13:14:34-03:00</ns2:dFecProc>"
+        "<ns2:dCodResLot>0362</ns2:dCodResLot>"
+        "<ns2:dMsgResLot>Procesamiento de lote concluido</ns2:dMsgResLot>"
+        f"{''.join(detalles)}"
+        "</ns2:rResEnviConsLoteDe>"
+    )
+
+
+class SesionFalsa:
+    """Registra las sentencias; responde como PostgreSQL a los RETURNING y al SELECT de CDC"""
+
+    def __init__(self, ids_por_cdc):
+        self.ids_por_cdc = ids_por_cdc
+        self.sentencias = []
+        self.consultas = 0
+        self.commits = 0
+
+    def execute(self, sentencia, parametros=None):
+        self.sentencias.append((sentencia, parametros))
+        return SimpleNamespace(
+            first=lambda: SimpleNamespace(id=7, nro_lote_sifen="123456"),
+            scalar_one=lambda: 99,
+        )
+
+    def query(self, *columnas):
+        self.consultas += 1
+        filas = list(self.ids_por_cdc.items())
+        return SimpleNamespace(filter=lambda *args: SimpleNamespace(all=lambda: filas))
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+def test_sentencias_fijas_y_cdc_repetido_deduplicado():
+    db = SesionFalsa({CDC_A: 1, CDC_B: 2})
+    xml = _respuesta(
+        _detalle(CDC_A, "Rechazado", "1001"),
+        _detalle(CDC_B, "Aprobado", "0260"),
+        _detalle(CDC_A, "Aprobado", "0260"),    # SIFEN repite el CDC: gana el último
+    )
+
+    assert serviceResponseLote(db, 7, xml)
+
+    # UPDATE lote, INSERT consulta, un UPDATE por estado, historial, upsert y consulta documento
+    tablas = [sentencia.table.name for sentencia, _ in db.sentencias]
+    assert tablas == [
+        "de_lote", "de_consulta_lote", "de_documento",
+        "de_estado", "de_lote_documento", "de_consulta_documento",
+    ]
+    assert db.consultas == 1 and db.commits == 1
+
+    upsert = db.sentencias[4][0].compile(dialect=postgresql.dialect())
+    assert "ON CONFLICT ON CONSTRAINT uq_lote_documento DO UPDATE" in str(upsert)
+    filas = sorted(
+        (upsert.params[f"documento_id_m{i}"], upsert.params[f"estado_resultado_m{i}"], upsert.params[f"codigo_error_m{i}"])
+        for i in range(2)
+    )
+    assert filas == [(1, "APROBADO", "0260"), (2, "APROBADO", "0260")]
+    assert "documento_id_m2" not in upsert.params
+    assert len(db.sentencias[3][1]) == 2    # historial: una fila por CDC
@@ -0,0 +1,64 @@
+import pytest
+
+from config.setting import settings
+from core.infraestructure.xml import validador_xsd
+from core.infraestructure.xml.validador_xsd import ErrorEsquema, obtener_esquema, validar
+
+XSD = """<?xml version="1.0" encoding="UTF-8"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+           xmlns="http://ekuatia.set.gov.py/sifen/xsd"
+           targetNamespace="http://ekuatia.set.gov.py/sifen/xsd"
+           elementFormDefault="qualified">
+  <xs:include schemaLocation="tipos.xsd"/>
+  <xs:element name="rDE">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:element name="dVerFor" type="tVerFor"/>
+      </xs:sequence>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>
+"""
+
+TIPOS = """<?xml version="1.0" encoding="UTF-8"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+           targetNamespace="http://ekuatia.set.gov.py/sifen/xsd"
+           elementFormDefault="qualified">
+  <xs:simpleType name="tVerFor">
+    <xs:restriction base="xs:integer"><xs:enumeration value="150"/></xs:restriction>
+  </xs:simpleType>
+</xs:schema>
+"""
+
+RDE = '<rDE xmlns="http://ekuatia.set.gov.py/sifen/xsd"><dVerFor>{}</dVerFor></rDE>'
+
+
+@pytest.fixture
+def xsd_dir(tmp_path, monkeypatch):
+    (tmp_path / "prueba.xsd").write_text(XSD, encoding="utf-8")
+    (tmp_path / "tipos.xsd").write_text(TIPOS, encoding="utf-8")
+    monkeypatch.setattr(settings, "XSD_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "XSD_VALIDAR", True)
+    monkeypatch.setattr(validador_xsd, "_esquemas", {})
+    return tmp_path
+
+
+def test_valida_con_include_y_cachea(xsd_dir):
+    validar(RDE.format(150).encode(), "prueba.xsd")
+
+    assert obtener_esquema("prueba.xsd") is obtener_esquema("prueba.xsd")
+
+
+def test_xml_invalido_lanza_error_esquema(xsd_dir):
+    with pytest.raises(ErrorEsquema) as error:
+        validar(RDE.format(999).encode(), "prueba.xsd")
+
+    assert error.value.errores
+    assert isinstance(error.value, ValueError)
+
+
+def test_sin_xsd_o_deshabilitado_no_valida(xsd_dir, monkeypatch):
+    validar(RDE.format(999).encode(), "inexistente.xsd")
+
+    monkeypatch.setattr(settings, "XSD_VALIDAR", False)
+    validar(RDE.format(999).encode(), "prueba.xsd")
@@ -16,7 +16,7 @@ def _z(val, n, name):
         raise ValueError(f"CDC ERROR → {name} inválido: {val}")
 
 
-def buildCDC(db, doc: Documento):
+def _partesCDC(doc: Documento) -> dict:
     _req(doc, "doc")
     _req(doc.emisor, "doc.emisor")
     _req(doc.timbrado, "doc.timbrado")
@@ -40,6 +40,22 @@ def buildCDC(db, doc: Documento):
     partes["tipemi"] = str(_req(doc.operacion.itipemi, "doc.operacion.itipemi"))
     partes["codseg"] = _z(_req(doc.operacion.dcodseg, "doc.operacion.dcodseg"), 9, "dcodseg")
 
+    return partes
+
+
+def calcularCDC(doc: Documento):
+    """
+    Calcula el CDC sin tocar el documento ni la sesión.
+    Retorna (cdc_de, ddvid): el CDC completo de 44 dígitos y su dígito verificador.
+    """
+    cdc = "".join(_partesCDC(doc).values())
+    dv = calcular_dv_11a(cdc)
+    return f'{cdc}{dv}', dv
+
+
+def buildCDC(db, doc: Documento, commit: bool = True):
+    partes = _partesCDC(doc)
+
     cdc = "".join(partes.values())
 
     dv =calcular_dv_11a(cdc)
@@ -47,7 +63,8 @@ def buildCDC(db, doc: Documento):
     doc.cdc_de = f'{cdc}{dv}'
     doc.ddvid = dv
     db.add(doc)
-    db.commit()
-    db.refresh(doc)
+    if commit:
+        db.commit()
+        db.refresh(doc)
 
     return cdc, partes  # ← devolvemos partes para debug
@@ -2,9 +2,15 @@ from datetime import datetime, timedelta
 from domain.models.models import Documento
 
 
-def loadFec(db, doc: Documento):
+def calcularFecFirma() -> datetime:
+    """Fecha de firma con margen respecto a la transmisión (no toca la sesión)."""
+    return datetime.now() - timedelta(seconds=120)
+
+
+def loadFec(db, doc: Documento, flush: bool = True):
     """Carga dfecfirma 1 segundo antes de la transmisión."""
-    fecha_firma = datetime.now() - timedelta(seconds=120)
+    fecha_firma = calcularFecFirma()
     doc.dfecfirma = fecha_firma
-    db.flush()  # asegura que SQLAlchemy reconozca el cambio
-    db.refresh(doc)  # actualiza el objeto con la DB si hay triggers o default
+    if flush:
+        db.flush()  # asegura que SQLAlchemy reconozca el cambio
+        db.refresh(doc)  # actualiza el objeto con la DB si hay triggers o default
@@ -0,0 +1,344 @@
+"""
+Parser único de respuestas SIFEN.
+
+Las expresiones XPath se compilan una sola vez al importar el módulo
+(con el mapa de namespaces ya resuelto) y se evalúan con rutas relativas
+al nodo de respuesta, sin búsquedas `.//` sobre todo el documento (salvo
+en eventos, cuya estructura varía según el tipo); los campos de cada DE
+de un lote se leen en una sola pasada por sus hijos. Los resultados son
+registros compactos con `__slots__`; para compatibilidad con el código
+que usaba dicts también admiten `r["campo"]`.
+
+Para resultados de lote muy grandes `parse_respuesta_lote(..., streaming=True)`
+recorre el XML con `iterparse` y libera cada gResProcLote apenas se lee.
+"""
+
+from datetime import datetime
+from io import BytesIO
+from typing import Iterator, List, Optional, Union
+
+from lxml import etree
+
+NS_SOAP = "http://www.w3.org/2003/05/soap-envelope"
+NS_SIFEN = "http://ekuatia.set.gov.py/sifen/xsd"
+NS = {"env": NS_SOAP, "s": NS_SIFEN}
+
+_PARSER = etree.XMLParser(remove_blank_text=True, resolve_entities=False, huge_tree=True)
+
+
+def _xpath(expr: str) -> etree.XPath:
+    return etree.XPath(expr, namespaces=NS, smart_strings=False)
+
+
+# Respuesta de consulta de lote (rResEnviConsLoteDe)
+_X_RES_LOTE = _xpath("/env:Envelope/env:Body/s:rResEnviConsLoteDe")
+_X_DETALLES_LOTE = _xpath("s:gResProcLote")
+
+# Respuesta de envío de lote (rResEnviLoteDe)
+_X_RES_ENVIO_LOTE = _xpath("/env:Envelope/env:Body/s:rResEnviLoteDe")
+
+# Respuesta síncrona de DE (rRetEnviDe/rProtDe)
+_X_PROT_DE = _xpath("/env:Envelope/env:Body/*/s:rProtDe | /env:Envelope/env:Body/s:rProtDe")
+
+# Respuesta de evento: la estructura varía según el tipo, se toma la primera ocurrencia
+_X_EVENTO = {
+    campo: _xpath(f"(//s:{tag})[1]/text()")
+    for campo, tag in (
+        ("cod_res", "dCodRes"), ("msg_res", "dMsgRes"), ("prot_aut", "dProtAut"),
+        ("est_res", "dEstRes"), ("fec_proc", "dFecProc"), ("id", "id"),
+    )
+}
+
+# Campos hijos directos (texto) relativos al nodo de respuesta
+_X_TEXTO = {
+    tag: _xpath(f"s:{tag}/text()")
+    for tag in (
+        "id", "Id", "dFecProc", "dCodResLot", "dMsgResLot", "dEstRes", "dProtAut",
+        "dProtConsLote", "dTpoProces", "dCodRes", "dMsgRes",
+    )
+}
+_X_RES_PROC = {
+    tag: _xpath(f"s:gResProc/s:{tag}/text()")
+    for tag in ("dCodRes", "dMsgRes")
+}
+
+
+def _texto(nodo, tag: str) -> Optional[str]:
+    valores = _X_TEXTO[tag](nodo)
+    return valores[0] if valores else None
+
+
+def _res_proc(nodo, tag: str) -> Optional[str]:
+    valores = _X_RES_PROC[tag](nodo)
+    return valores[0] if valores else None
+
+
+def _fecha(valor: Optional[str]) -> Optional[datetime]:
+    # Ej: 2026-01-27T13:14:34-03:00
+    if not valor:
+        return None
+    return datetime.fromisoformat(valor.strip().replace("Z", "+00:00"))
+
+
+def _raiz(xml: Union[bytes, str]):
+    if isinstance(xml, str):
+        xml = xml.encode("utf-8")
+    try:
+        return etree.fromstring(xml, _PARSER)
+    except etree.XMLSyntaxError:
+        raise ValueError("XML mal formado")
+
+
+# ---------------------------------------------------------------------- registros
+
+class _Registro:
+    """Base de los registros: acceso por atributo o por clave"""
+    __slots__ = ()
+
+    def __getitem__(self, campo):
+        try:
+            return getattr(self, campo)
+        except AttributeError:
+            raise KeyError(campo)
+
+    def get(self, campo, default=None):
+        return getattr(self, campo, default)
+
+    def as_dict(self) -> dict:
+        return {campo: getattr(self, campo) for campo in self.__slots__}
+
+    def __eq__(self, otro):
+        return type(self) is type(otro) and self.as_dict() == otro.as_dict()
+
+    def __repr__(self):
+        campos = ", ".join(f"{c}={getattr(self, c)!r}" for c in self.__slots__)
+        return f"{type(self).__name__}({campos})"
+
+
+class ResultadoDE(_Registro):
+    """Resultado de un DE dentro de un lote (gResProcLote)"""
+    __slots__ = ("cdc", "est_res", "prot_aut", "cod_res", "msg_res")
+
+    def __init__(self, cdc, est_res, prot_aut, cod_res, msg_res):
+        self.cdc = cdc
+        self.est_res = est_res
+        self.prot_aut = prot_aut
+        self.cod_res = cod_res
+        self.msg_res = msg_res
+
+
+class ResultadoLote(_Registro):
+    """Respuesta de consulta de lote (rResEnviConsLoteDe)"""
+    __slots__ = ("fec_proc", "cod_res_lot", "msg_res_lot", "detalles")
+
+    def __init__(self, fec_proc, cod_res_lot, msg_res_lot, detalles: List[ResultadoDE]):
+        self.fec_proc = fec_proc
+        self.cod_res_lot = cod_res_lot
+        self.msg_res_lot = msg_res_lot
+        self.detalles = detalles
+
+
+class RespuestaEnvioLote(_Registro):
+    """Respuesta de envío de lote (rResEnviLoteDe)"""
+    __slots__ = ("fec_proc", "cod_res", "msg_res", "prot_cons_lote", "tpo_proces")
+
+    def __init__(self, fec_proc, cod_res, msg_res, prot_cons_lote, tpo_proces):
+        self.fec_proc = fec_proc
+        self.cod_res = cod_res
+        self.msg_res = msg_res
+        self.prot_cons_lote = prot_cons_lote
+        self.tpo_proces = tpo_proces
+
+
+class ProtocoloDE(_Registro):
+    """Protocolo de un DE enviado por rEnviDe (rProtDe); fec_proc es el texto recibido"""
+    __slots__ = ("id", "fec_proc", "est_res", "prot_aut", "cod_res", "msg_res")
+
+    def __init__(self, id, fec_proc, est_res, prot_aut, cod_res, msg_res):
+        self.id = id
+        self.fec_proc = fec_proc
+        self.est_res = est_res
+        self.prot_aut = prot_aut
+        self.cod_res = cod_res
+        self.msg_res = msg_res
+
+
+class RespuestaEvento(_Registro):
+    """Respuesta de recepción de evento (rRetEnviEventoDe); fec_proc es el texto recibido"""
+    __slots__ = ("id", "fec_proc", "est_res", "prot_aut", "cod_res", "msg_res")
+
+    def __init__(self, id, fec_proc, est_res, prot_aut, cod_res, msg_res):
+        self.id = id
+        self.fec_proc = fec_proc
+        self.est_res = est_res
+        self.prot_aut = prot_aut
+        self.cod_res = cod_res
+        self.msg_res = msg_res
+
+
+# ---------------------------------------------------------------------- parsers
+
+_CAMPOS_DE = {
+    f"{{{NS_SIFEN}}}id": "cdc",
+    f"{{{NS_SIFEN}}}dEstRes": "est_res",
+    f"{{{NS_SIFEN}}}dProtAut": "prot_aut",
+    f"{{{NS_SIFEN}}}dCodRes": "cod_res",
+    f"{{{NS_SIFEN}}}dMsgRes": "msg_res",
+}
+_TAG_RES_PROC = f"{{{NS_SIFEN}}}gResProc"
+
+
+def _resultado_de(nodo) -> ResultadoDE:
+    # Un gResProcLote se lee en una pasada por sus hijos: con 50-1000 DEs
+    # por respuesta es más barato que evaluar una XPath por campo
+    campos = dict.fromkeys(ResultadoDE.__slots__)
+    for hijo in nodo:
+        if hijo.tag == _TAG_RES_PROC:
+            for dato in hijo:
+                if dato.tag in _CAMPOS_DE and campos[_CAMPOS_DE[dato.tag]] is None:
+                    campos[_CAMPOS_DE[dato.tag]] = dato.text
+        elif hijo.tag in _CAMPOS_DE:
+            campos[_CAMPOS_DE[hijo.tag]] = hijo.text
+    return ResultadoDE(**campos)
+
+
+def parse_respuesta_lote(xml: Union[bytes, str], streaming: bool = False) -> ResultadoLote:
+    """
+    Parsea la respuesta de consulta de lote.
+    Con `streaming=True` no se construye el árbol completo (lotes grandes).
+    """
+    if streaming:
+        return _parse_respuesta_lote_stream(xml)
+
+    res = _X_RES_LOTE(_raiz(xml))
+    if not res:
+        raise ValueError("rResEnviConsLoteDe no encontrado")
+    res = res[0]
+
+    return ResultadoLote(
+        fec_proc=_fecha(_texto(res, "dFecProc")),
+        cod_res_lot=_texto(res, "dCodResLot"),
+        msg_res_lot=_texto(res, "dMsgResLot"),
+        detalles=[_resultado_de(nodo) for nodo in _X_DETALLES_LOTE(res)],
+    )
+
+
+_TAG_RES_LOTE = f"{{{NS_SIFEN}}}rResEnviConsLoteDe"
+_TAG_DETALLE = f"{{{NS_SIFEN}}}gResProcLote"
+_TAGS_CABECERA = {
+    f"{{{NS_SIFEN}}}dFecProc": "fec_proc",
+    f"{{{NS_SIFEN}}}dCodResLot": "cod_res_lot",
+    f"{{{NS_SIFEN}}}dMsgResLot": "msg_res_lot",
+}
+
+
+def iter_detalles_lote(xml: Union[bytes, str]) -> Iterator[ResultadoDE]:
+    """Genera los resultados por DE de una consulta de lote sin armar el árbol completo"""
+    for tipo, valor in _iterparse_lote(xml):
+        if tipo == "detalle":
+            yield valor
+
+
+def _parse_respuesta_lote_stream(xml: Union[bytes, str]) -> ResultadoLote:
+    cabecera = {"fec_proc": None, "cod_res_lot": None, "msg_res_lot": None}
+    detalles = []
+    encontrado = False
+
+    for tipo, valor in _iterparse_lote(xml):
+        if tipo == "detalle":
+            detalles.append(valor)
+        elif tipo == "fin":
+            encontrado = True
+        else:
+            cabecera[tipo] = valor
+
+    if not encontrado:
+        raise ValueError("rResEnviConsLoteDe no encontrado")
+
+    return ResultadoLote(
+        fec_proc=_fecha(cabecera["fec_proc"]),
+        cod_res_lot=cabecera["cod_res_lot"],
+        msg_res_lot=cabecera["msg_res_lot"],
+        detalles=detalles,
+    )
+
+
+def _iterparse_lote(xml: Union[bytes, str]):
+    if isinstance(xml, str):
+        xml = xml.encode("utf-8")
+    fuente = BytesIO(xml) if isinstance(xml, (bytes, bytearray)) else xml
+
+    contexto = etree.iterparse(
+        fuente,
+        events=("end",),
+        tag=(_TAG_RES_LOTE, _TAG_DETALLE, *_TAGS_CABECERA),
+        remove_blank_text=True,
+        resolve_entities=False,
+        huge_tree=True,
+    )
+    try:
+        for _, elem in contexto:
+            if elem.tag == _TAG_DETALLE:
+                yield "detalle", _resultado_de(elem)
+                # Liberar el nodo ya leído y los hermanos anteriores
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+            elif elem.tag == _TAG_RES_LOTE:
+                yield "fin", None
+            elif elem.getparent() is not None and elem.getparent().tag == _TAG_RES_LOTE:
+                yield _TAGS_CABECERA[elem.tag], elem.text
+    except etree.XMLSyntaxError:
+        raise ValueError("XML mal formado")
+
+
+def parse_envio_lote(xml: Union[bytes, str]) -> RespuestaEnvioLote:
+    """Parsea la respuesta de envío de lote (protocolo de consulta dProtConsLote)"""
+    res = _X_RES_ENVIO_LOTE(_raiz(xml))
+    if not res:
+        raise ValueError("rResEnviLoteDe no encontrado")
+    res = res[0]
+
+    prot_cons_lote = _texto(res, "dProtConsLote")
+    return RespuestaEnvioLote(
+        fec_proc=_fecha(_texto(res, "dFecProc")),
+        cod_res=_texto(res, "dCodRes"),
+        msg_res=_texto(res, "dMsgRes"),
+        prot_cons_lote=prot_cons_lote.strip() if prot_cons_lote else None,
+        tpo_proces=_texto(res, "dTpoProces"),
+    )
+
+
+def parse_protocolo_de(xml: Union[bytes, str]) -> ProtocoloDE:
+    """Parsea el rProtDe de la respuesta síncrona de rEnviDe"""
+    prot = _X_PROT_DE(_raiz(xml))
+    if not prot:
+        raise ValueError("XML no contiene rProtDe")
+    prot = prot[0]
+
+    return ProtocoloDE(
+        id=_texto(prot, "Id"),
+        fec_proc=_texto(prot, "dFecProc"),
+        est_res=_texto(prot, "dEstRes"),
+        prot_aut=_texto(prot, "dProtAut"),
+        cod_res=_res_proc(prot, "dCodRes"),
+        msg_res=_res_proc(prot, "dMsgRes"),
+    )
+
+
+def parse_respuesta_evento(xml: Union[bytes, str]) -> RespuestaEvento:
+    """Parsea la respuesta de recepción de un evento"""
+    raiz = _raiz(xml)
+
+    def primero(campo):
+        valores = _X_EVENTO[campo](raiz)
+        return valores[0] if valores else None
+
+    return RespuestaEvento(
+        id=primero("id"),
+        fec_proc=primero("fec_proc"),
+        est_res=primero("est_res"),
+        prot_aut=primero("prot_aut"),
+        cod_res=primero("cod_res"),
+        msg_res=primero("msg_res"),
+    )